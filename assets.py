@@ -0,0 +1,69 @@
+"""This module loads the images and sounds of the game.
+Assets are found next to this module whatever the working directory,
+and each one is loaded once per process, the first time it is used.
+"""
+import os
+
+import pygame
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+# channel kept for the stone placement sound so it never waits for a free one
+TAP_CHANNEL = 0
+
+_IMAGES = {}
+_SOUNDS = {}
+
+
+def asset_path(*parts):
+    """Get the path of an asset
+
+    Args:
+        *parts (str): path of the asset inside the assets folder
+
+    Returns:
+        str: absolute path of the asset
+    """
+    return os.path.join(ASSET_DIR, *parts)
+
+
+def image(name):
+    """Get an image, the display must be set first
+
+    Args:
+        name (str): file name in assets/img
+
+    Returns:
+        pygame.Surface: the image with its alpha channel
+    """
+    img = _IMAGES.get(name)
+    if img is None:
+        img = pygame.image.load(asset_path("img", name)).convert_alpha()
+        _IMAGES[name] = img
+    return img
+
+
+def sound(name):
+    """Get a sound, decoded in full when first loaded
+
+    Args:
+        name (str): file name in assets/sound
+
+    Returns:
+        pygame.mixer.Sound: the sound, None if there is no audio device
+    """
+    if name not in _SOUNDS:
+        if pygame.mixer.get_init() is None:
+            return None
+        if pygame.mixer.get_num_channels() <= TAP_CHANNEL:
+            pygame.mixer.set_num_channels(TAP_CHANNEL + 1)
+        pygame.mixer.set_reserved(TAP_CHANNEL + 1)
+        _SOUNDS[name] = pygame.mixer.Sound(asset_path("sound", name))
+    return _SOUNDS[name]
+
+
+def play_tap():
+    """Play the stone placement sound on its own channel
+    """
+    tap = sound("tap.mp3")
+    if tap is not None:
+        pygame.mixer.Channel(TAP_CHANNEL).play(tap)
@@ -0,0 +1,165 @@
+"""This module contains the BatchBoard class.
+BatchBoard objects step many games of Go at once, every board is a
+slice of one (B, N, N) int8 array and captures, suicide and Ko are
+found for all boards together with vectorized neighbour operations.
+"""
+import sys
+import time
+
+import numpy as np
+
+from go_board import BLACK_STONE, PASS
+
+
+def dilate(mask):
+    """Grow a mask by one point in the four directions
+
+    Args:
+        mask (np.ndarray): (B, N, N) boolean mask
+
+    Returns:
+        np.ndarray: mask with every neighbour of a set point set
+    """
+    grown = mask.copy()
+    grown[:, 1:, :] |= mask[:, :-1, :]
+    grown[:, :-1, :] |= mask[:, 1:, :]
+    grown[:, :, 1:] |= mask[:, :, :-1]
+    grown[:, :, :-1] |= mask[:, :, 1:]
+    return grown
+
+
+def alive(stones, empty):
+    """Find the stones whose group has at least one liberty
+
+    Args:
+        stones (np.ndarray): (B, N, N) mask of the stones of one color per board
+        empty (np.ndarray): (B, N, N) mask of the empty points
+
+    Returns:
+        np.ndarray: mask of the stones connected to an empty point
+    """
+    # stones touching an empty point, then spread along their groups
+    connected = stones & dilate(empty)
+    while True:
+        grown = stones & dilate(connected)
+        if np.array_equal(grown, connected):
+            return connected
+        connected = grown
+
+
+class BatchBoard:
+    """Class representing many Go boards stepped together
+
+    Args:
+        batch (int): number of boards
+        size (int): size of every board
+    """
+
+    def __init__(self, batch, size):
+        self.batch = batch
+        self.size = size
+        self.boards = np.zeros((batch, size, size), dtype=np.int8)
+        # boards before the last move, a move recreating them violates Ko
+        self.previous = np.zeros_like(self.boards)
+        self.to_play = np.full(batch, BLACK_STONE, dtype=np.int8)
+        self.passes = np.zeros(batch, dtype=np.int8)
+        self.white_captured = np.zeros(batch, dtype=np.int32)
+        self.black_captured = np.zeros(batch, dtype=np.int32)
+
+    @property
+    def done(self):
+        """np.ndarray: mask of the boards where both players passed"""
+        return self.passes >= 2
+
+    def step(self, moves):
+        """Play one move on every board, illegal moves are not played
+
+        Args:
+            moves (np.ndarray): (B,) positions of the moves, PASS to pass
+
+        Returns:
+            np.ndarray: (B,) mask of the boards where the move was played
+        """
+        moves = np.asarray(moves)
+        index = np.arange(self.batch)
+        passing = moves == PASS
+        rows, cols = np.divmod(np.where(passing, 0, moves), self.size)
+        color = self.to_play[:, None, None]
+
+        # placing the stones
+        legal = ~passing & (self.boards[index, rows, cols] == 0)
+        new = self.boards.copy()
+        playing = np.flatnonzero(legal)
+        new[playing, rows[playing], cols[playing]] = self.to_play[playing]
+
+        # removing opponent groups without liberties
+        opponent = new == -color
+        dead = opponent & ~alive(opponent, new == 0)
+        captured = dead.sum(axis=(1, 2))
+        new[dead] = 0
+
+        # the placed group must have a liberty after captures
+        own = new == color
+        suicide = (own & ~alive(own, new == 0)).any(axis=(1, 2))
+        # the move must not recreate the board before the opponent's move
+        repeated = (new == self.previous).all(axis=(1, 2))
+        legal &= ~suicide & ~repeated
+
+        played = legal | passing
+        self.previous[played] = self.boards[played]
+        self.boards[legal] = new[legal]
+        black = self.to_play == BLACK_STONE
+        self.white_captured += np.where(legal & black, captured, 0)
+        self.black_captured += np.where(legal & ~black, captured, 0)
+        self.passes = np.where(passing, self.passes + 1, np.where(legal, 0, self.passes))
+        self.to_play = np.where(played, -self.to_play, self.to_play).astype(np.int8)
+        return played
+
+    def random_moves(self, rng):
+        """Pick a random empty point on every board
+
+        Args:
+            rng (np.random.Generator): random number generator
+
+        Returns:
+            np.ndarray: (B,) positions, PASS for full boards
+        """
+        empty = (self.boards == 0).reshape(self.batch, -1)
+        noise = rng.random(empty.shape) * empty
+        moves = noise.argmax(axis=1)
+        return np.where(empty.any(axis=1), moves, PASS)
+
+    def reset(self, mask):
+        """Start new games on some boards
+
+        Args:
+            mask (np.ndarray): (B,) mask of the boards to reset
+        """
+        self.boards[mask] = 0
+        self.previous[mask] = 0
+        self.to_play[mask] = BLACK_STONE
+        self.passes[mask] = 0
+        self.white_captured[mask] = 0
+        self.black_captured[mask] = 0
+
+
+def main():
+    """Plays random moves on a batch of boards and prints the rate
+    of moves played per second
+    """
+    batch = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+    steps = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    rng = np.random.default_rng(0)
+    boards = BatchBoard(batch, size)
+    played = 0
+    start = time.perf_counter()
+    for _ in range(steps):
+        played += boards.step(boards.random_moves(rng)).sum()
+    elapsed = time.perf_counter() - start
+    print(f"{batch} boards of {size}x{size}: {played / elapsed:.0f} moves/s")
+
+
+if __name__ == "__main__":
+    main()
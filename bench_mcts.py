@@ -0,0 +1,40 @@
+"""Benchmark of the playouts per second of the MCTS bot
+for an increasing number of worker processes
+"""
+import os
+import sys
+
+from go_board import GoBoard
+from go_bot import MCTS, ParallelMCTS
+
+
+def main():
+    """Runs the search on an empty board with 1 to all cores and
+    prints the playout rate and speedup of each
+    """
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 9
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    board = GoBoard(size)
+
+    search = MCTS(seconds=seconds, seed=0)
+    search.search(board)
+    base = search.last_playouts / seconds
+    print(f"{size}x{size}, {seconds}s per search")
+    print(f"workers  1: {base:8.1f} playouts/s, speedup 1.00")
+
+    workers = 2
+    while workers <= os.cpu_count():
+        search = ParallelMCTS(workers=workers, seconds=seconds, seed=0)
+        # warm up the pool so process start-up is not measured
+        search.seconds = 0.1
+        search.search(board)
+        search.seconds = seconds
+        search.search(board)
+        rate = search.last_playouts / seconds
+        print(f"workers {workers:2}: {rate:8.1f} playouts/s, speedup {rate / base:.2f}")
+        search.close()
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,57 @@
 """Client to connect to server for Go online
 """
 import socket
+import sys
 
 import pygame
 
+from go_board import MAX_SIZE, MIN_SIZE
 from go_gui_online import GoGuiOnline
+from network import Multiplexer
 
 HOST = socket.gethostbyname(socket.gethostname())
 PORT = 5000
+DEFAULT_SIZE = 19
 
 
 def main():
     """Creates a client and connects to server, then launches the Go game
+    on the board size given on the command line, followed by the name
+    the player is rated under and the number of games to play, one
+    after the other on the same connection
     """
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE
+    name = sys.argv[2] if len(sys.argv) > 2 else ""
+    games = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    if not MIN_SIZE <= size <= MAX_SIZE:
+        print(f"Board size must be between {MIN_SIZE} and {MAX_SIZE}")
+        return
     pygame.mixer.init(22050, -16, 2, 64)
     pygame.init()
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
         addr = (HOST, PORT)
         client.connect(addr)
 
-        # receiving meta game information
-        player_num = int(client.recv(1024).decode("utf-8"))
-        print(f"You are player {player_num}")
-        game_id = int(client.recv(1024).decode("utf-8"))
-        print(f"Game id {game_id}")
-
-        # starting game on client side
-        go_game = GoGuiOnline(client, 19, player_num)
-        go_game.start_game()
+        # every game of this client is carried by the one connection
+        mux = Multiplexer(client)
+
+        for _ in range(games):
+            # asking for a board size, the server pairs players by size
+            # and rating, then sends meta game information on a new
+            # channel of the connection
+            try:
+                channel, player_num, game_id, game_size = mux.open(size, name)
+            except ConnectionError as error:
+                print(error)
+                break
+            print(f"You are player {player_num}")
+            print(f"Game id {game_id}, {game_size}x{game_size} board")
+
+            # starting game on client side, closing the window or the
+            # server ending the game moves on to the next game
+            go_game = GoGuiOnline(channel, game_size, player_num)
+            go_game.start_game()
+        mux.close()
 
     pygame.quit()
 
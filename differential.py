@@ -0,0 +1,926 @@
+"""Differential test of the rules engines against the original rules.
+ReferenceBoard keeps the rules GoGui was first written with, board
+arrays, group dictionaries, Ko by comparing boards and territory
+scoring, and is never optimized. Move sequences are played on it, on
+GoBoard and on a one-board BatchBoard in lockstep, comparing boards,
+captures, the side to move and the legality of every point after every
+move. Generated sequences also take moves back with
+GameHistory.truncate, which undoes the engine with its deltas, and the
+result is checked against the reference replayed from scratch. The final position is scored with score_game, the scoring GoGui
+uses, and counted again by the reference without the dead stones
+score_game found. A sequence that disagrees is shrunk to the shortest
+one that still disagrees.
+"""
+import multiprocessing
+import random
+import sys
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from batch_board import BatchBoard
+from game_archive import GameArchive, decode_moves
+from game_history import GameHistory
+from go_board import BLACK_STONE, PASS, WHITE_STONE, GoBoard
+from go_bot import KOMI
+from scoring import AREA, TERRITORY, score_game
+from sgf import iter_games
+
+# where a sequence first disagrees, expected is the reference
+Mismatch = namedtuple("Mismatch", ["step", "check", "expected", "actual"])
+# step of a sequence taking back the last count moves played
+Undo = namedtuple("Undo", ["count"])
+
+# chance that a generated move is a pass
+PASS_CHANCE = 0.05
+# chance that a generated step takes moves back, and most moves taken
+# back at once
+UNDO_CHANCE = 0.05
+MAX_UNDO = 4
+# sequences generated by every task of the worker processes
+TASK_GAMES = 50
+# playouts finding dead stones and their seed, so a run can be
+# repeated, which stones are dead does not matter to the comparison
+SCORE_PLAYOUTS = 16
+SCORE_SEED = 0
+
+
+class ReferenceBoard:
+    """Class representing the original rules of GoGui
+
+    Args:
+        size (int): size of the board
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.board = np.zeros((self.size, self.size), dtype=int)
+        # keeps track of the parent of each group
+        self.pointer = np.empty((self.size, self.size), dtype=int)
+        self.pointer.fill(-1)
+        self.white_groups = {}
+        self.black_groups = {}
+        self.newest_stone = None
+        self.states = deque()
+        # True for black, False for white
+        self.color = True
+        self.white_captured = 0
+        self.black_captured = 0
+
+    def save_state(self):
+        """Push the state of the game, the previous states are used to
+        detect Ko and to take back illegal moves
+        """
+        self.states.append(
+            (
+                self.board.copy(),
+                self.pointer.copy(),
+                self.white_groups.copy(),
+                self.black_groups.copy(),
+                self.white_captured,
+                self.black_captured,
+            )
+        )
+
+    def restore_state(self):
+        """Pop the state of the game pushed last
+        """
+        (
+            self.board,
+            self.pointer,
+            self.white_groups,
+            self.black_groups,
+            self.white_captured,
+            self.black_captured,
+        ) = self.states.pop()
+
+    def play(self, move):
+        """Play a move for the side to move, illegal moves are taken back
+
+        Args:
+            move (int): position of the stone, row * size + col, or PASS
+
+        Returns:
+            bool: True if the move was played
+        """
+        if move == PASS:
+            self.save_state()
+            self.color = not self.color
+            return True
+        row, col = divmod(move, self.size)
+        if self.board[row, col] != 0:
+            return False
+        self.save_state()
+
+        # updating board
+        color_num = 1 if self.color else -1
+        self.board[row, col] = color_num
+        self.newest_stone = move
+
+        # adding to group
+        self.add_group(row, col, color_num)
+        # remove captured stones
+        self.check_board()
+
+        # checking for Ko, prevent illegal move
+        if self.check_ko() or self.board[row, col] == 0:
+            # violated Ko or suicide, move prevented
+            self.restore_state()
+            return False
+        self.color = not self.color
+        return True
+
+    def is_legal(self, move):
+        """Check a move by playing it and taking it back
+
+        Args:
+            move (int): position of the stone, or PASS
+
+        Returns:
+            bool: True if the move is legal
+        """
+        newest_stone = self.newest_stone
+        color = self.color
+        if not self.play(move):
+            return False
+        self.restore_state()
+        self.newest_stone = newest_stone
+        self.color = color
+        return True
+
+    def check_liberty(self, row, col):
+        """Checks the liberty of a stone
+
+        Args:
+            row (int): row of the stone
+            col (int): column of the stone
+
+        Returns:
+            bool: True if stone has liberty, False otherwise
+        """
+        # checking row above
+        if row != 0 and self.board[row - 1, col] == 0:
+            return True
+        # checking row below
+        if row != self.size - 1 and self.board[row + 1, col] == 0:
+            return True
+        # checking col to the left
+        if col != 0 and self.board[row, col - 1] == 0:
+            return True
+        # checking col to the right
+        if col != self.size - 1 and self.board[row, col + 1] == 0:
+            return True
+
+        return False
+
+    def check_board(self):
+        """Checks the entire board for any stones that should be removed
+        because they lack liberty
+        """
+        # checking white stones
+        white_to_del = []
+        check_again = None
+        for key, group in self.white_groups.items():
+            for pos in group:
+                if pos == self.newest_stone:
+                    # do not check newest placed stone yet
+                    check_again = key
+                    break
+                if self.check_liberty(pos // self.size, pos % self.size):
+                    break
+            else:
+                # if no stones in a group has liberty, remove entire group
+                white_to_del.append(key)
+                for pos in group:
+                    self.white_captured += 1
+                    row = pos // self.size
+                    col = pos % self.size
+                    self.board[row, col] = 0
+                    self.pointer[row, col] = 0
+
+        # remove group representation
+        for to_del in white_to_del:
+            del self.white_groups[to_del]
+
+        # checking black stones
+        black_to_del = []
+        for key, group in self.black_groups.items():
+            for pos in group:
+                if pos == self.newest_stone:
+                    # do not check newest placed stone yet
+                    check_again = key
+                    break
+                if self.check_liberty(pos // self.size, pos % self.size):
+                    break
+            else:
+                # if no stones in a group has liberty, remove entire group
+                black_to_del.append(key)
+                for pos in group:
+                    self.black_captured += 1
+                    row = pos // self.size
+                    col = pos % self.size
+                    self.board[row, col] = 0
+                    self.pointer[row, col] = 0
+
+        # remove group representation
+        for to_del in black_to_del:
+            del self.black_groups[to_del]
+
+        if check_again is not None:
+            # checking newest placed stone and removing it if necessary
+            if self.color:
+                for pos in self.black_groups[check_again]:
+                    if self.check_liberty(pos // self.size, pos % self.size):
+                        break
+                else:
+                    for pos in self.black_groups[check_again]:
+                        self.black_captured += 1
+                        row = pos // self.size
+                        col = pos % self.size
+                        self.board[row, col] = 0
+                        self.pointer[row, col] = 0
+                    del self.black_groups[check_again]
+            else:
+                for pos in self.white_groups[check_again]:
+                    if self.check_liberty(pos // self.size, pos % self.size):
+                        break
+                else:
+                    for pos in self.white_groups[check_again]:
+                        self.white_captured += 1
+                        row = pos // self.size
+                        col = pos % self.size
+                        self.board[row, col] = 0
+                        self.pointer[row, col] = 0
+                    del self.white_groups[check_again]
+
+    def add_group(self, row, col, color_num):
+        """Updating stones to form correct groups
+
+        Args:
+            row (int): row of the stone
+            col (int): column of the stone
+            color_num (int): 1 for black, -1 for white
+        """
+        group = self.black_groups if color_num == 1 else self.white_groups
+        setted = False
+
+        # checking whether stone above is of same color
+        if row != 0 and self.board[row - 1, col] == color_num:
+            parent = self.pointer[row - 1, col]
+            self.pointer[row, col] = parent
+            # adding stone to group of above stone
+            group[parent] = group[parent].union({row * self.size + col})
+            setted = True
+
+        # checking whether stone below is of same color
+        if row != self.size - 1 and self.board[row + 1, col] == color_num:
+            if setted:
+                # adding group of below stone to group newest stone belongs to
+                prev_parent = self.pointer[row + 1, col]
+                if prev_parent != parent:
+                    for pos in group[prev_parent]:
+                        self.pointer[pos // self.size, pos % self.size] = parent
+                    group[parent] = group[parent].union(group[prev_parent])
+                    del group[prev_parent]
+            else:
+                parent = self.pointer[row + 1, col]
+                self.pointer[row, col] = parent
+                # adding stone to group of below stone
+                group[parent] = group[parent].union({row * self.size + col})
+                setted = True
+
+        # checking whether left stone is of same color
+        if col != 0 and self.board[row, col - 1] == color_num:
+            if setted:
+                # adding left group to group newest stone belongs to
+                prev_parent = self.pointer[row, col - 1]
+                if prev_parent != parent:
+                    for pos in group[prev_parent]:
+                        self.pointer[pos // self.size, pos % self.size] = parent
+                    group[parent] = group[parent].union(group[prev_parent])
+                    del group[prev_parent]
+            else:
+                parent = self.pointer[row, col - 1]
+                self.pointer[row, col] = parent
+                # adding stone to left group
+                group[parent] = group[parent].union({row * self.size + col})
+                setted = True
+
+        # checking whether right stone is of same color
+        if col != self.size - 1 and self.board[row, col + 1] == color_num:
+            if setted:
+                # adding right group to group newest stone belongs to
+                prev_parent = self.pointer[row, col + 1]
+                if prev_parent != parent:
+                    for pos in group[prev_parent]:
+                        self.pointer[pos // self.size, pos % self.size] = parent
+                    group[parent] = group[parent].union(group[prev_parent])
+                    del group[prev_parent]
+            else:
+                parent = self.pointer[row, col + 1]
+                self.pointer[row, col] = parent
+                # adding stone to right group
+                group[parent] = group[parent].union({row * self.size + col})
+                setted = True
+
+        # create new group of stone if there are no adjacent same color stones
+        if not setted:
+            parent = row * self.size + col
+            self.pointer[row, col] = parent
+            group[parent] = {parent}
+
+    def check_ko(self):
+        """Checking whether newest move violates Ko rule
+
+        Returns:
+            bool: True if violated, False otherwise
+        """
+        if len(self.states) > 2:
+            _ = self.states.pop()
+            board_2, pointer_2, white_2, black_2, w_cap_2, b_cap_2 = self.states.pop()
+
+            self.states.append((board_2, pointer_2, white_2, black_2, w_cap_2, b_cap_2))
+            self.states.append(_)
+
+            return (board_2 == self.board).all()
+        else:
+            return False
+
+    def check_zero_liberty(self, row, col):
+        """Checks the colors surrounding an empty intersection
+
+        Args:
+            row (int): row of the intersection
+            col (int): column of the intersection
+
+        Returns:
+            set: colors of the adjacent stones
+        """
+        surrounded_by = set()
+        # checking row above
+        if row != 0 and self.board[row - 1, col] == 1:
+            surrounded_by.add(1)
+        elif row != 0 and self.board[row - 1, col] == -1:
+            surrounded_by.add(-1)
+        # checking row below
+        if row != self.size - 1 and self.board[row + 1, col] == 1:
+            surrounded_by.add(1)
+        elif row != self.size - 1 and self.board[row + 1, col] == -1:
+            surrounded_by.add(-1)
+        # checking col to the left
+        if col != 0 and self.board[row, col - 1] == 1:
+            surrounded_by.add(1)
+        elif col != 0 and self.board[row, col - 1] == -1:
+            surrounded_by.add(-1)
+        # checking col to the right
+        if col != self.size - 1 and self.board[row, col + 1] == 1:
+            surrounded_by.add(1)
+        elif col != self.size - 1 and self.board[row, col + 1] == -1:
+            surrounded_by.add(-1)
+
+        return surrounded_by
+
+    def check_territory(self, empty_groups, territory):
+        """Checking whether each group of empty intersections is part of
+        a color's territory
+
+        Args:
+            empty_groups (dict): empty intersections of every group
+            territory (np.ndarray): filled with the owner of every intersection
+
+        Returns:
+            tuple: territory of black and white
+        """
+        black = 0
+        white = 0
+        for group in empty_groups.values():
+            surrounded_by = set()
+            for pos in group:
+                new = self.check_zero_liberty(pos // self.size, pos % self.size)
+                surrounded_by = surrounded_by.union(new)
+                if len(surrounded_by) >= 2:
+                    break
+            else:
+                try:
+                    color = surrounded_by.pop()
+                    for pos in group:
+                        territory[pos // self.size, pos % self.size] = color
+                    if color == 1:
+                        black += len(group)
+                    else:
+                        white += len(group)
+                except KeyError:
+                    pass
+        return black, white
+
+    def group_empty(self, row, col, group, pointer):
+        """Group all empty intersections
+
+        Args:
+            row (int): row of target intersection
+            col (int): column of target intersection
+            group (dict): empty intersections of every group
+            pointer (np.ndarray): parent of every empty intersection
+        """
+        setted = False
+
+        # checking whether stone above is of same color
+        if row != 0 and self.board[row - 1, col] == 0:
+            parent = pointer[row - 1, col]
+            pointer[row, col] = parent
+            # adding stone to group of above stone
+            group[parent] = group[parent].union({row * self.size + col})
+            setted = True
+
+        # checking whether left stone is of same color
+        if col != 0 and self.board[row, col - 1] == 0:
+            if setted:
+                # adding left group to group newest stone belongs to
+                prev_parent = pointer[row, col - 1]
+                if prev_parent != parent:
+                    for pos in group[prev_parent]:
+                        pointer[pos // self.size, pos % self.size] = parent
+                    group[parent] = group[parent].union(group[prev_parent])
+                    del group[prev_parent]
+            else:
+                parent = pointer[row, col - 1]
+                pointer[row, col] = parent
+                # adding stone to left group
+                group[parent] = group[parent].union({row * self.size + col})
+                setted = True
+
+        # create new group of stone if there are no adjacent same color stones
+        if not setted:
+            parent = row * self.size + col
+            pointer[row, col] = parent
+            group[parent] = {parent}
+
+    def score(self, dead=()):
+        """Score the game with territory and prisoners, the dead stones
+        are taken off the board first and every other stone is alive
+
+        Args:
+            dead (iterable): positions of the dead stones
+
+        Returns:
+            tuple: black score, white score, the owner of every empty
+                intersection and the stones left on the board
+        """
+        board = self.board
+        white_captured = self.white_captured
+        black_captured = self.black_captured
+        self.board = board.copy()
+        for pos in dead:
+            row, col = divmod(pos, self.size)
+            if self.board[row, col] == 1:
+                black_captured += 1
+            else:
+                white_captured += 1
+            self.board[row, col] = 0
+        try:
+            empty_groups = {}
+            pointer = self.pointer.copy()
+            territory = np.zeros((self.size, self.size), dtype=int)
+
+            for row in range(self.size):
+                for col in range(self.size):
+                    if self.board[row, col] == 0:
+                        self.group_empty(row, col, empty_groups, pointer)
+
+            black, white = self.check_territory(empty_groups, territory)
+            stones = self.board
+        finally:
+            self.board = board
+        return black + white_captured, white + black_captured, territory, stones
+
+
+def compare(reference, engine, step, legality=True):
+    """Compare the reference and the engine after a move
+
+    Args:
+        reference (ReferenceBoard): reference rules
+        engine (GoBoard): rules engine
+        step (int): number of moves tried so far
+        legality (bool): whether the legality of every point is compared
+
+    Returns:
+        Mismatch: first difference found, None if they agree
+    """
+    if not np.array_equal(reference.board, engine.board):
+        return Mismatch(step, "board", reference.board.tolist(), engine.board.tolist())
+    captured = (reference.white_captured, reference.black_captured)
+    if captured != (engine.white_captured, engine.black_captured):
+        return Mismatch(
+            step, "captures", captured, (engine.white_captured, engine.black_captured)
+        )
+    to_play = BLACK_STONE if reference.color else WHITE_STONE
+    if to_play != engine.to_play:
+        return Mismatch(step, "to play", to_play, engine.to_play)
+    if legality:
+        for move in range(engine.area):
+            expected = reference.is_legal(move)
+            if expected != engine.is_legal(move):
+                return Mismatch(step, f"legality of {move}", expected, not expected)
+    return None
+
+
+def compare_batch(reference, batch, step):
+    """Compare the reference and the first board of a BatchBoard
+
+    Args:
+        reference (ReferenceBoard): reference rules
+        batch (BatchBoard): batched rules engine
+        step (int): number of moves tried so far
+
+    Returns:
+        Mismatch: first difference found, None if they agree
+    """
+    if not np.array_equal(reference.board, batch.boards[0]):
+        return Mismatch(step, "batch board", reference.board.tolist(), batch.boards[0].tolist())
+    captured = (reference.white_captured, reference.black_captured)
+    actual = (int(batch.white_captured[0]), int(batch.black_captured[0]))
+    if captured != actual:
+        return Mismatch(step, "batch captures", captured, actual)
+    to_play = BLACK_STONE if reference.color else WHITE_STONE
+    if to_play != batch.to_play[0]:
+        return Mismatch(step, "batch to play", to_play, int(batch.to_play[0]))
+    return None
+
+
+def compare_score(reference, engine, step):
+    """Score the engine with score_game in both modes and count the
+    same position again on the reference, without the dead stones
+    score_game found
+
+    Args:
+        reference (ReferenceBoard): reference rules
+        engine (GoBoard): rules engine
+        step (int): number of moves tried so far
+
+    Returns:
+        Mismatch: first difference found, None if they agree
+    """
+    for mode in (TERRITORY, AREA):
+        result = score_game(engine, mode, KOMI, playouts=SCORE_PLAYOUTS, seed=SCORE_SEED)
+        black, white, territory, stones = reference.score(result["dead"])
+        if mode == AREA:
+            black = int((territory == 1).sum() + (stones == 1).sum())
+            white = int((territory == -1).sum() + (stones == -1).sum())
+        expected = (black, white + KOMI)
+        actual = (result["black"], result["white"])
+        if expected != actual or not np.array_equal(territory, result["territory"]):
+            return Mismatch(step, f"{mode} score", expected, actual)
+    return None
+
+
+def replay_reference(size, played):
+    """Play moves on a new reference and a new BatchBoard
+
+    Args:
+        size (int): size of the board
+        played (list): position of every move, all legal, or PASS
+
+    Returns:
+        tuple: the ReferenceBoard and the BatchBoard
+    """
+    reference = ReferenceBoard(size)
+    batch = BatchBoard(1, size)
+    for move in played:
+        reference.play(move)
+        batch.step(np.array([move]))
+    return reference, batch
+
+
+def take_back(size, history, played, count, step):
+    """Take moves back on the engine with GameHistory.truncate and
+    compare its hash with the engine replayed from scratch
+
+    Args:
+        size (int): size of the board
+        history (GameHistory): history of the engine, truncated
+        played (list): moves played so far, shortened
+        count (int): number of moves to take back
+        step (int): number of moves tried so far
+
+    Returns:
+        Mismatch: difference found in the hash, None if they agree
+    """
+    keep = max(0, len(played) - count)
+    history.truncate(keep)
+    del played[keep:]
+    replayed = GoBoard(size)
+    for move in played:
+        replayed.play(move)
+    if history.engine.key() != replayed.key():
+        return Mismatch(step, "hash after undo", replayed.key(), history.engine.key())
+    return None
+
+
+def run_sequence(size, moves, legality=True):
+    """Try a sequence of moves on the reference, the engine and a
+    BatchBoard in lockstep, illegal moves are skipped by all of them,
+    and score the final position. Moves taken back by Undo steps are
+    taken back on the engine, the reference and the BatchBoard are
+    replayed without them
+
+    Args:
+        size (int): size of the board
+        moves (list): position of every move, PASS or Undo
+        legality (bool): whether the legality of every point is compared
+
+    Returns:
+        Mismatch: first difference found, None if they agree
+    """
+    reference = ReferenceBoard(size)
+    history = GameHistory(size)
+    engine = history.engine
+    batch = BatchBoard(1, size)
+    # moves played by all of them, to replay the reference
+    played = []
+    mismatch = compare(reference, engine, 0, legality)
+    if mismatch is not None:
+        return mismatch
+    step = 0
+    for step, move in enumerate(moves, 1):
+        if isinstance(move, Undo):
+            mismatch = take_back(size, history, played, move.count, step)
+            if mismatch is not None:
+                return mismatch
+            # the engine is replaced when it can not undo its deltas
+            engine = history.engine
+            reference, batch = replay_reference(size, played)
+            mismatch = compare(reference, engine, step, legality) or compare_batch(
+                reference, batch, step
+            )
+            if mismatch is not None:
+                return mismatch
+            continue
+        expected = reference.play(move)
+        actual = move == PASS or engine.is_legal(move)
+        if expected != actual:
+            return Mismatch(step, f"legality of {move}", expected, actual)
+        if actual:
+            history.play(move)
+            played.append(move)
+        batched = bool(batch.step(np.array([move]))[0])
+        if expected != batched:
+            return Mismatch(step, f"batch legality of {move}", expected, batched)
+        mismatch = compare(reference, engine, step, legality) or compare_batch(
+            reference, batch, step
+        )
+        if mismatch is not None:
+            return mismatch
+    return compare_score(reference, engine, step)
+
+
+def shrink(size, moves, legality=True):
+    """Find a shorter sequence that still disagrees by removing chunks
+    of moves, then single moves, until none can be removed
+
+    Args:
+        size (int): size of the board
+        moves (list): sequence that disagrees
+        legality (bool): whether the legality of every point is compared
+
+    Returns:
+        tuple: shortest sequence found and its Mismatch
+    """
+    mismatch = run_sequence(size, moves, legality)
+    # nothing after the first difference matters
+    moves = list(moves[: mismatch.step])
+    chunk = max(1, len(moves) // 2)
+    while True:
+        start = 0
+        while start < len(moves):
+            candidate = moves[:start] + moves[start + chunk :]
+            found = run_sequence(size, candidate, legality)
+            if found is not None:
+                moves = candidate[: found.step]
+                mismatch = found
+            else:
+                start += chunk
+        if chunk == 1:
+            return moves, mismatch
+        chunk = max(1, chunk // 2)
+
+
+def random_sequence(size, rng, length=None):
+    """Generate a sequence of moves, illegal moves and moves taken back
+    included
+
+    Args:
+        size (int): size of the board
+        rng (random.Random): random number generator
+        length (int, optional): number of steps, about two per point if not given
+
+    Returns:
+        list: position of every move, PASS or Undo
+    """
+    area = size * size
+    if length is None:
+        length = rng.randint(1, 2 * area)
+    sequence = []
+    for _ in range(length):
+        chance = rng.random()
+        if chance < PASS_CHANCE:
+            sequence.append(PASS)
+        elif chance < PASS_CHANCE + UNDO_CHANCE:
+            sequence.append(Undo(rng.randint(1, MAX_UNDO)))
+        else:
+            sequence.append(rng.randrange(area))
+    return sequence
+
+
+def record_sequence(moves):
+    """Turn the moves of a record into the sequence of ReferenceBoard,
+    a pass is added where a color plays twice in a row
+
+    Args:
+        moves (list): (color, position) of every move
+
+    Returns:
+        list: position of every move, or PASS
+    """
+    sequence = []
+    to_play = BLACK_STONE
+    for color, pos in moves:
+        if color != to_play:
+            sequence.append(PASS)
+        sequence.append(pos)
+        to_play = -color
+    return sequence
+
+
+def check_random(size, seed, games, legality=True):
+    """Check generated sequences
+
+    Args:
+        size (int): size of the board
+        seed (int): seed of the generated sequences
+        games (int): number of sequences
+        legality (bool): whether the legality of every point is compared
+
+    Returns:
+        tuple: number of moves tried, and the first sequence that
+            disagrees with its Mismatch, None if they all agree
+    """
+    rng = random.Random(seed)
+    tried = 0
+    for _ in range(games):
+        moves = random_sequence(size, rng)
+        tried += len(moves)
+        if run_sequence(size, moves, legality) is not None:
+            return tried, shrink(size, moves, legality)
+    return tried, None
+
+
+def _check_task(task):
+    """Check generated sequences in a worker process
+
+    Args:
+        task (tuple): arguments of check_random
+
+    Returns:
+        tuple: result of check_random
+    """
+    return check_random(*task)
+
+
+def run_random(games, size, seed=0, workers=1, legality=True):
+    """Check many generated sequences, spread over worker processes
+
+    Args:
+        games (int): number of sequences
+        size (int): size of the board
+        seed (int): seed of the first task, every task has its own seed
+        workers (int): number of worker processes
+        legality (bool): whether the legality of every point is compared
+
+    Returns:
+        tuple: number of moves tried, and the first sequence that
+            disagrees with its Mismatch, None if they all agree
+    """
+    tasks = [
+        (size, seed + index, min(TASK_GAMES, games - start), legality)
+        for index, start in enumerate(range(0, games, TASK_GAMES))
+    ]
+    tried = 0
+    if workers > 1:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers) as pool:
+            for moves, failure in pool.imap_unordered(_check_task, tasks):
+                tried += moves
+                if failure is not None:
+                    pool.terminate()
+                    return tried, failure
+        return tried, None
+    for task in tasks:
+        moves, failure = check_random(*task)
+        tried += moves
+        if failure is not None:
+            return tried, failure
+    return tried, None
+
+
+def run_records(records, legality=True):
+    """Check the games of a collection, games with setup stones are skipped
+
+    Args:
+        records (iterable): (size, moves) of every game, moves are
+            (color, position)
+        legality (bool): whether the legality of every point is compared
+
+    Returns:
+        tuple: number of games and moves tried, and the size of the board,
+            the first sequence that disagrees and its Mismatch, None if
+            they all agree
+    """
+    games = 0
+    tried = 0
+    for size, moves in records:
+        sequence = record_sequence(moves)
+        games += 1
+        tried += len(sequence)
+        if run_sequence(size, sequence, legality) is not None:
+            return games, tried, (size,) + shrink(size, sequence, legality)
+    return games, tried, None
+
+
+def sgf_records(path):
+    """Read the games of an SGF collection for run_records
+
+    Args:
+        path (str): path of the SGF file
+
+    Yields:
+        tuple: size and moves of every game without setup stones
+    """
+    for record in iter_games(path):
+        if not record.setup:
+            yield record.size, record.moves
+
+
+def archive_records(path):
+    """Read the games of a GameArchive for run_records
+
+    Args:
+        path (str): path of the archive
+
+    Yields:
+        tuple: size and moves of every game without setup stones
+    """
+    with GameArchive(path) as archive:
+        for game in archive:
+            if not len(game.setup):
+                yield game.size, decode_moves(game.moves)
+
+
+def report(tried, seconds, failure):
+    """Print the result of a run
+
+    Args:
+        tried (int): number of moves tried
+        seconds (float): time taken
+        failure (tuple): size, sequence and Mismatch, None if they all agree
+    """
+    print(f"{tried} moves in {seconds:.2f}s")
+    if failure is None:
+        print("the engine agrees with the reference")
+        return
+    size, moves, mismatch = failure
+    print(f"{size}x{size} mismatch at move {mismatch.step}: {mismatch.check}")
+    print(f"moves: {moves}")
+    print(f"reference: {mismatch.expected}")
+    print(f"engine:    {mismatch.actual}")
+
+
+def main():
+    """Checks generated sequences with "random <games> [size] [seed] [workers]",
+    or the games of a collection with "sgf <path>" or "archive <path>",
+    "--fast" skips the legality of every point
+    """
+    args = [arg for arg in sys.argv[1:] if arg != "--fast"]
+    legality = len(args) == len(sys.argv) - 1
+    start = time.perf_counter()
+    if 2 <= len(args) <= 5 and args[0] == "random":
+        games = int(args[1])
+        size = int(args[2]) if len(args) > 2 else 9
+        seed = int(args[3]) if len(args) > 3 else 0
+        workers = int(args[4]) if len(args) > 4 else 1
+        tried, failure = run_random(games, size, seed, workers, legality)
+        report(tried, time.perf_counter() - start, failure and (size,) + failure)
+    elif len(args) == 2 and args[0] in ("sgf", "archive"):
+        records = sgf_records(args[1]) if args[0] == "sgf" else archive_records(args[1])
+        games, tried, failure = run_records(records, legality)
+        print(f"{games} games")
+        report(tried, time.perf_counter() - start, failure)
+    else:
+        print(
+            "usage: differential.py random <games> [size] [seed] [workers] | "
+            "sgf <path> | archive <path> [--fast]"
+        )
+
+
+if __name__ == "__main__":
+    main()
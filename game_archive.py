@@ -0,0 +1,346 @@
+"""This module reads and writes the binary game archive format.
+Every game is a fixed size header followed by 2 bytes per stone or
+move, and an index of game offsets at the end of the file allows
+random access. Archives are memory-mapped so games are read without
+copying.
+
+File layout:
+    header: magic, version, number of games, offset of the index
+    games: game header then setup stones then moves, 2 bytes each
+    index: offset of every game, 8 bytes each
+"""
+import mmap
+import struct
+import sys
+import time
+
+import numpy as np
+
+from go_board import BLACK_STONE, PASS, WHITE_STONE, GoBoard
+from sgf import GameRecord, iter_games
+
+MAGIC = b"GOAR"
+VERSION = 1
+# magic, version, number of games, offset of the index
+FILE_HEADER = struct.Struct("<4sHxxIQ")
+# size, winner, komi * 2, number of setup stones, number of moves
+GAME_HEADER = struct.Struct("<BbhHI")
+
+# a move is its position with the top bit set for white
+WHITE_BIT = 0x8000
+PASS_CODE = 0x7FFF
+
+
+def encode_move(color, pos):
+    """Encode a move in 2 bytes
+
+    Args:
+        color (int): 1 for black, -1 for white
+        pos (int): position of the move, or PASS
+
+    Returns:
+        int: encoded move
+    """
+    code = PASS_CODE if pos == PASS else pos
+    return code | WHITE_BIT if color == WHITE_STONE else code
+
+
+def decode_moves(codes):
+    """Decode an array of moves
+
+    Args:
+        codes (np.ndarray): encoded moves
+
+    Returns:
+        list: (color, position) of every move
+    """
+    colors = np.where(codes & WHITE_BIT, WHITE_STONE, BLACK_STONE).tolist()
+    positions = (codes & PASS_CODE).tolist()
+    return [
+        (color, PASS if pos == PASS_CODE else pos)
+        for color, pos in zip(colors, positions)
+    ]
+
+
+def winner_of(result):
+    """Get the winner from an SGF result
+
+    Args:
+        result (str): result such as "B+R" or "W+3.5"
+
+    Returns:
+        int: 1 if black won, -1 if white won, 0 otherwise
+    """
+    if result.startswith("B+"):
+        return BLACK_STONE
+    if result.startswith("W+"):
+        return WHITE_STONE
+    return 0
+
+
+class ArchiveWriter:
+    """Class writing games to a new archive, used as a context manager
+
+    Args:
+        path (str): path of the archive
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.offsets = []
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, record):
+        """Append a game to the archive
+
+        Args:
+            record (GameRecord): game to append
+
+        Returns:
+            int: id of the game in the archive
+        """
+        self.offsets.append(self.file.tell())
+        self.file.write(
+            GAME_HEADER.pack(
+                record.size,
+                winner_of(record.result),
+                int(record.komi * 2),
+                len(record.setup),
+                len(record.moves),
+            )
+        )
+        codes = [encode_move(color, pos) for color, pos in record.setup + record.moves]
+        self.file.write(np.array(codes, dtype="<u2").tobytes())
+        return len(self.offsets) - 1
+
+    def close(self):
+        """Write the index and the file header, then close the file
+        """
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.offsets, dtype="<u8").tobytes())
+        self.file.seek(0)
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, len(self.offsets), index_offset))
+        self.file.close()
+
+
+class ArchivedGame:
+    """Class representing a game read from an archive, its moves are
+    a view into the memory-mapped file
+
+    Args:
+        size (int): size of the board
+        winner (int): 1 if black won, -1 if white won, 0 otherwise
+        komi (float): points given to white
+        setup (np.ndarray): encoded setup stones
+        moves (np.ndarray): encoded moves
+    """
+
+    __slots__ = ("size", "winner", "komi", "setup", "moves")
+
+    def __init__(self, size, winner, komi, setup, moves):
+        self.size = size
+        self.winner = winner
+        self.komi = komi
+        self.setup = setup
+        self.moves = moves
+
+    def to_record(self):
+        """Convert the game to a record
+
+        Returns:
+            GameRecord: record of the game
+        """
+        result = {BLACK_STONE: "B+", WHITE_STONE: "W+"}.get(self.winner, "")
+        return GameRecord(
+            self.size,
+            decode_moves(self.moves),
+            decode_moves(self.setup),
+            self.komi,
+            result,
+        )
+
+    def replay(self):
+        """Play the game through the rules engine
+
+        Raises:
+            ValueError: if a move is illegal
+
+        Returns:
+            GoBoard: engine at the end of the game
+        """
+        if len(self.setup):
+            return self.to_record().replay()
+        engine = GoBoard(self.size)
+        codes = self.moves.tolist()
+        for code in codes:
+            color = WHITE_STONE if code & WHITE_BIT else BLACK_STONE
+            if color != engine.to_play:
+                engine.play(PASS)
+            pos = code & PASS_CODE
+            engine.play(PASS if pos == PASS_CODE else pos)
+        return engine
+
+
+class GameArchive:
+    """Class reading an archive through a memory map
+
+    Args:
+        path (str): path of the archive
+
+    Raises:
+        ValueError: if the file is not an archive
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, index_offset = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a game archive")
+        self.index = np.frombuffer(self.map, dtype="<u8", count=count, offset=index_offset)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def header(self, game_id):
+        """Read the header of a game without its moves
+
+        Args:
+            game_id (int): id of the game
+
+        Returns:
+            tuple: size, winner, komi * 2, number of setup stones, number of moves
+        """
+        return GAME_HEADER.unpack_from(self.map, int(self.index[game_id]))
+
+    def __getitem__(self, game_id):
+        """Read a game
+
+        Args:
+            game_id (int): id of the game
+
+        Returns:
+            ArchivedGame: the game, its moves are not copied
+        """
+        offset = int(self.index[game_id])
+        size, winner, komi, setup, moves = GAME_HEADER.unpack_from(self.map, offset)
+        offset += GAME_HEADER.size
+        codes = np.frombuffer(self.map, dtype="<u2", count=setup + moves, offset=offset)
+        return ArchivedGame(size, winner, komi / 2, codes[:setup], codes[setup:])
+
+    def __iter__(self):
+        for game_id in range(len(self)):
+            yield self[game_id]
+
+    def filter(self, size=None, winner=None, min_moves=0):
+        """Find games by their headers, moves are never read
+
+        Args:
+            size (int, optional): size of the board
+            winner (int, optional): 1 for black wins, -1 for white wins
+            min_moves (int): minimum number of moves
+
+        Yields:
+            int: id of every matching game
+        """
+        for game_id in range(len(self)):
+            game_size, game_winner, _, _, moves = self.header(game_id)
+            if size is not None and game_size != size:
+                continue
+            if winner is not None and game_winner != winner:
+                continue
+            if moves >= min_moves:
+                yield game_id
+
+    def close(self):
+        """Release the memory map
+        """
+        # views into the map must be released before it can be closed
+        self.index = None
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+
+
+def convert_sgf(sgf_path, archive_path):
+    """Convert an SGF collection to an archive
+
+    Args:
+        sgf_path (str): path of the SGF collection
+        archive_path (str): path of the archive to create
+
+    Returns:
+        int: number of games converted
+    """
+    with ArchiveWriter(archive_path) as writer:
+        for record in iter_games(sgf_path):
+            writer.add(record)
+        return len(writer.offsets)
+
+
+def replay_archive(path):
+    """Replay every game of an archive through the rules engine
+
+    Args:
+        path (str): path of the archive
+
+    Returns:
+        dict: number of games, moves, invalid games and elapsed seconds
+    """
+    moves = 0
+    invalid = []
+    start = time.perf_counter()
+    with GameArchive(path) as archive:
+        games = len(archive)
+        for game_id, game in enumerate(archive):
+            try:
+                game.replay()
+            except (ValueError, IndexError) as error:
+                invalid.append((game_id, str(error)))
+            moves += len(game.moves)
+        # the last game is a view into the map, release it before closing
+        game = None
+    elapsed = time.perf_counter() - start
+    return {"games": games, "moves": moves, "invalid": invalid, "seconds": elapsed}
+
+
+def main():
+    """Converts an SGF collection to an archive with
+    "convert <sgf> <archive>", or replays an archive with
+    "replay <archive>"
+    """
+    if len(sys.argv) == 4 and sys.argv[1] == "convert":
+        count = convert_sgf(sys.argv[2], sys.argv[3])
+        print(f"Converted {count} games")
+    elif len(sys.argv) == 3 and sys.argv[1] == "replay":
+        stats = replay_archive(sys.argv[2])
+        seconds = max(stats["seconds"], 1e-9)
+        print(
+            f"{stats['games']} games, {stats['moves']} moves in {seconds:.2f}s "
+            f"({stats['games'] / seconds:.0f} games/s, "
+            f"{stats['moves'] / seconds:.0f} moves/s), "
+            f"{len(stats['invalid'])} invalid"
+        )
+    else:
+        print("usage: game_archive.py convert <sgf> <archive> | replay <archive>")
+
+
+if __name__ == "__main__":
+    main()
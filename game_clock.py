@@ -0,0 +1,306 @@
+"""This module contains the GameClock and TimerHeap classes.
+GameClock objects keep the time of both players of a game under
+absolute, Fischer or byo-yomi time control. The TimerHeap keeps the
+deadline of every running clock in one heap, so a single thread can
+flag any number of games when their time runs out.
+"""
+import heapq
+import threading
+import time
+
+from go_board import BLACK_STONE, WHITE_STONE
+
+ABSOLUTE = "absolute"
+FISCHER = "fischer"
+BYOYOMI = "byoyomi"
+
+
+class TimeControl:
+    """Class representing the time given to each player
+
+    Args:
+        kind (str): ABSOLUTE, FISCHER or BYOYOMI
+        main (float): main time in seconds
+        increment (float): seconds added after every move with FISCHER
+        periods (int): number of byo-yomi periods
+        period_time (float): seconds of every byo-yomi period
+    """
+
+    def __init__(self, kind, main, increment=0.0, periods=0, period_time=0.0):
+        if kind not in (ABSOLUTE, FISCHER, BYOYOMI):
+            raise ValueError(f"unknown time control {kind}")
+        self.kind = kind
+        self.main = main
+        self.increment = increment if kind == FISCHER else 0.0
+        self.periods = periods if kind == BYOYOMI else 0
+        self.period_time = period_time if kind == BYOYOMI else 0.0
+
+    @classmethod
+    def parse(cls, text):
+        """Read a time control such as "absolute:600", "fischer:300+10"
+        or "byoyomi:600:5x30"
+
+        Args:
+            text (str): time control
+
+        Raises:
+            ValueError: if the text is not a time control
+
+        Returns:
+            TimeControl: the time control
+        """
+        kind, _, rest = text.partition(":")
+        if kind == FISCHER:
+            main, _, increment = rest.partition("+")
+            return cls(kind, float(main), increment=float(increment or 0))
+        if kind == BYOYOMI:
+            main, _, overtime = rest.partition(":")
+            periods, _, period_time = overtime.partition("x")
+            return cls(kind, float(main), periods=int(periods), period_time=float(period_time))
+        return cls(kind, float(rest))
+
+
+class GameClock:
+    """Class representing the clocks of both players of a game, times
+    are given by the caller so a copy can follow another time source
+
+    Args:
+        control (TimeControl): time given to each player
+    """
+
+    def __init__(self, control):
+        self.control = control
+        # main time left and byo-yomi periods left at the start of the turn
+        self.main = {BLACK_STONE: float(control.main), WHITE_STONE: float(control.main)}
+        self.periods = {BLACK_STONE: control.periods, WHITE_STONE: control.periods}
+        self.to_play = BLACK_STONE
+        # time the current turn started, None while the clock is stopped
+        self.turn_start = None
+        # color that ran out of time
+        self.flagged = None
+
+    def start(self, now):
+        """Start the clock of the player to move
+
+        Args:
+            now (float): current time in seconds
+        """
+        self.turn_start = now
+
+    def stop(self):
+        """Stop both clocks
+        """
+        self.turn_start = None
+
+    def _charge(self, color, elapsed):
+        """Take time from a player
+
+        Args:
+            color (int): color of the player
+            elapsed (float): seconds used
+
+        Returns:
+            tuple: main time, periods and time of the current period
+                left, and whether the player ran out of time
+        """
+        main = self.main[color]
+        periods = self.periods[color]
+        period_time = self.control.period_time
+        if elapsed <= main:
+            return main - elapsed, periods, period_time, False
+        if not periods:
+            return 0.0, 0, 0.0, True
+        # every period used up in full is lost, a move in time keeps it
+        used, into = divmod(elapsed - main, period_time)
+        if used >= periods:
+            return 0.0, 0, 0.0, True
+        return 0.0, periods - int(used), period_time - into, False
+
+    def remaining(self, color, now):
+        """Get the time left of a player
+
+        Args:
+            color (int): color of the player
+            now (float): current time in seconds
+
+        Returns:
+            tuple: main time, periods and time of the current period left
+        """
+        elapsed = 0.0
+        if color == self.to_play and self.turn_start is not None:
+            elapsed = now - self.turn_start
+        main, periods, period, _ = self._charge(color, elapsed)
+        return main, periods, period
+
+    def deadline(self):
+        """Get the time the player to move runs out of time
+
+        Returns:
+            float: deadline in seconds, None if the clock is stopped
+        """
+        if self.turn_start is None or self.flagged is not None:
+            return None
+        color = self.to_play
+        return (
+            self.turn_start
+            + self.main[color]
+            + self.periods[color] * self.control.period_time
+        )
+
+    def press(self, color, now):
+        """End the turn of a player after a move
+
+        Args:
+            color (int): color of the player who moved
+            now (float): current time in seconds
+
+        Returns:
+            bool: False if the player ran out of time before moving
+        """
+        if self.flagged is not None:
+            return False
+        elapsed = 0.0 if self.turn_start is None else now - self.turn_start
+        main, periods, _, flagged = self._charge(color, elapsed)
+        if flagged:
+            self.flagged = color
+            self.turn_start = None
+            return False
+        self.main[color] = main + self.control.increment
+        self.periods[color] = periods
+        self.to_play = -color
+        if self.turn_start is not None:
+            self.turn_start = now
+        return True
+
+    def flag(self, now):
+        """Check whether the player to move ran out of time
+
+        Args:
+            now (float): current time in seconds
+
+        Returns:
+            bool: True if the player to move ran out of time
+        """
+        deadline = self.deadline()
+        if deadline is not None and now >= deadline:
+            self.flagged = self.to_play
+            self.turn_start = None
+        return self.flagged is not None
+
+    def state(self, now):
+        """Get the state of the clock to send to another process
+
+        Args:
+            now (float): current time in seconds
+
+        Returns:
+            tuple: state of the clock, independent of the time source
+        """
+        elapsed = None if self.turn_start is None else now - self.turn_start
+        return (
+            self.control,
+            self.main[BLACK_STONE],
+            self.main[WHITE_STONE],
+            self.periods[BLACK_STONE],
+            self.periods[WHITE_STONE],
+            self.to_play,
+            elapsed,
+            self.flagged,
+        )
+
+    @classmethod
+    def from_state(cls, state, now):
+        """Create a clock from the state of another clock
+
+        Args:
+            state (tuple): state given by state()
+            now (float): current time of the new clock when the state was taken
+
+        Returns:
+            GameClock: copy of the clock following the new time source
+        """
+        control, black_main, white_main, black_periods, white_periods, to_play, elapsed, flagged = state
+        clock = cls(control)
+        clock.main = {BLACK_STONE: black_main, WHITE_STONE: white_main}
+        clock.periods = {BLACK_STONE: black_periods, WHITE_STONE: white_periods}
+        clock.to_play = to_play
+        clock.turn_start = None if elapsed is None else now - elapsed
+        clock.flagged = flagged
+        return clock
+
+
+class TimerHeap:
+    """Class representing the deadlines of many keys in one heap,
+    rescheduled or cancelled deadlines are skipped when they come up
+    """
+
+    def __init__(self):
+        self.heap = []
+        # latest deadline of every key
+        self.deadlines = {}
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def schedule(self, key, deadline):
+        """Set the deadline of a key, replacing its previous one
+
+        Args:
+            key (object): key of the deadline, e.g. a game id
+            deadline (float): deadline in seconds, None to cancel
+        """
+        with self.condition:
+            if deadline is None:
+                self.deadlines.pop(key, None)
+                return
+            self.deadlines[key] = deadline
+            heapq.heappush(self.heap, (deadline, key))
+            if len(self.heap) > 2 * len(self.deadlines) + 64:
+                # too many skipped entries, rebuild from the live deadlines
+                self.heap = [(value, item) for item, value in self.deadlines.items()]
+                heapq.heapify(self.heap)
+            self.condition.notify()
+
+    def cancel(self, key):
+        """Remove the deadline of a key
+
+        Args:
+            key (object): key of the deadline
+        """
+        self.schedule(key, None)
+
+    def pop_expired(self, now):
+        """Remove the deadlines that have passed
+
+        Args:
+            now (float): current time in seconds
+
+        Returns:
+            list: keys whose deadline passed
+        """
+        expired = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                deadline, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key) == deadline:
+                    del self.deadlines[key]
+                    expired.append(key)
+        return expired
+
+    def wait_expired(self, clock=time.monotonic):
+        """Block until at least one deadline passes
+
+        Args:
+            clock (function): time source of the deadlines
+
+        Returns:
+            list: keys whose deadline passed
+        """
+        with self.condition:
+            while True:
+                expired = self.pop_expired(clock())
+                if expired:
+                    return expired
+                timeout = self.heap[0][0] - clock() if self.heap else None
+                self.condition.wait(timeout)
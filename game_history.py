@@ -0,0 +1,181 @@
+"""This module contains the GameHistory class.
+GameHistory objects store the moves of a game plus a checkpoint of
+the position every K moves, so any earlier position is rebuilt by
+replaying at most K moves from the nearest checkpoint.
+"""
+import numpy as np
+
+from game_archive import decode_moves, encode_move
+from go_board import PASS, GoBoard
+from sgf import GameRecord
+
+# approximate memory used by the engine for every intersection and by
+# every move played, measured on 9x9 and 19x19 games
+POINT_BYTES = 150
+MOVE_BYTES = 500
+
+
+class GameHistory:
+    """Class representing the history of a game
+
+    Args:
+        size (int): size of the board
+        interval (int): number of moves between checkpoints, a smaller
+            interval uses more memory but seeks faster
+    """
+
+    def __init__(self, size, interval=16):
+        self.size = size
+        self.interval = interval
+        # engine at the latest move
+        self.engine = GoBoard(size)
+        # (color, position) of every move
+        self.moves = []
+        # compact position every interval moves, starting at move 0
+        self.checkpoints = [self._checkpoint()]
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __getstate__(self):
+        # moves are kept 2 bytes each as in the archive, the engine is
+        # replayed from the last checkpoint instead of pickling its
+        # tables and undo deltas
+        codes = np.array([encode_move(color, pos) for color, pos in self.moves], dtype="<u2")
+        return (self.size, self.interval, codes.tobytes(), self.checkpoints)
+
+    def __setstate__(self, state):
+        self.size, self.interval, codes, self.checkpoints = state
+        self.moves = decode_moves(np.frombuffer(codes, dtype="<u2"))
+        self.engine = self.seek(len(self.moves))
+
+    def nbytes(self):
+        """Estimate the memory used by the history
+
+        Returns:
+            int: approximate size in bytes
+        """
+        return POINT_BYTES * self.engine.area + MOVE_BYTES * len(self.moves)
+
+    def _checkpoint(self):
+        """Take a checkpoint of the latest position
+
+        Returns:
+            tuple: encoded position and captured stone counts
+        """
+        engine = self.engine
+        return (engine.encode(), engine.white_captured, engine.black_captured)
+
+    def play(self, pos):
+        """Play a move at the end of the game
+
+        Args:
+            pos (int): position of the move, or PASS
+
+        Raises:
+            ValueError: if the move is illegal
+        """
+        color = self.engine.to_play
+        self.engine.play(pos)
+        self.moves.append((color, pos))
+        if len(self.moves) % self.interval == 0:
+            self.checkpoints.append(self._checkpoint())
+
+    def follow(self, board):
+        """Record the move that leads to a board one move ahead of the
+        latest position, the history restarts from board if no single
+        move leads to it
+
+        Args:
+            board (np.ndarray): board after the next move
+        """
+        played = len(self.engine.history)
+        self.engine.follow(board)
+        if len(self.engine.history) == played + 1:
+            pos, color, _, _ = self.engine.history[-1]
+            self.moves.append((color, pos))
+            if len(self.moves) % self.interval == 0:
+                self.checkpoints.append(self._checkpoint())
+        else:
+            self.moves = []
+            self.checkpoints = [self._checkpoint()]
+
+    def restart(self, board, to_play, white_captured=0, black_captured=0):
+        """Forget every move and start the history from a board
+
+        Args:
+            board (np.ndarray): board to start from
+            to_play (int): 1 if black is to move, -1 otherwise
+            white_captured (int): white stones captured before the board
+            black_captured (int): black stones captured before the board
+        """
+        self.engine.load(board, to_play)
+        self.engine.white_captured = white_captured
+        self.engine.black_captured = black_captured
+        self.moves = []
+        self.checkpoints = [self._checkpoint()]
+
+    def truncate(self, count):
+        """Drop every move after the first count moves
+
+        Args:
+            count (int): number of moves to keep
+        """
+        if count >= len(self.moves):
+            return
+        dropped = self.moves[count:]
+        recent = self.engine.history[len(self.engine.history) - len(dropped) :]
+        if [(color, pos) for pos, color, _, _ in recent] == dropped:
+            # the engine still has the deltas of the dropped moves
+            for _ in dropped:
+                self.engine.undo()
+        else:
+            self.engine = self.seek(count)
+        del self.moves[count:]
+        del self.checkpoints[count // self.interval + 1 :]
+
+    def seek(self, move):
+        """Rebuild the position after a number of moves
+
+        Args:
+            move (int): number of moves played, clamped to the game length
+
+        Returns:
+            GoBoard: engine at that position
+        """
+        move = max(0, min(move, len(self.moves)))
+        index = move // self.interval
+        data, white_captured, black_captured = self.checkpoints[index]
+        engine = GoBoard.decode(data)
+        engine.white_captured = white_captured
+        engine.black_captured = black_captured
+        for color, pos in self.moves[index * self.interval : move]:
+            if color != engine.to_play:
+                engine.play(PASS)
+            engine.play(pos)
+        return engine
+
+    def board_at(self, move):
+        """Get the stones after a number of moves
+
+        Args:
+            move (int): number of moves played
+
+        Returns:
+            np.ndarray: board with 1 for black, -1 for white, 0 for empty
+        """
+        if move >= len(self.moves):
+            return self.engine.board
+        return self.seek(move).board
+
+    def to_record(self):
+        """Convert the history to a game record
+
+        Returns:
+            GameRecord: record of the game
+        """
+        record = GameRecord(self.size, list(self.moves))
+        # the history may start from a position reached by other means
+        start = GoBoard.decode(self.checkpoints[0][0])
+        record.setup = [(stone, pos) for pos, stone in enumerate(start.cells) if stone]
+        return record
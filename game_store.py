@@ -0,0 +1,199 @@
+"""This module contains the GameStore class used by the server to keep
+its active games. The most recently used games stay in memory, up to a
+budget in bytes. Games left alone for too long, or pushed out by the
+budget, are hibernated to a compressed record on disk and rehydrated
+the next time they are needed, so a server can hold many more slow
+games than fit in memory. Idle games are found whenever the store is
+used and by sweep, which the server calls on a timer.
+"""
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# extension of the records of hibernated games
+RECORD_EXTENSION = ".game"
+
+
+class GameStore:
+    """Class representing the active games of the server by game id,
+    used like a dictionary and safe to share between threads
+
+    Args:
+        directory (str): directory of the records of hibernated games
+        budget (int): bytes of games kept in memory
+        idle (float): seconds after which an unused game is hibernated
+        sizeof (callable): estimate in bytes of the memory used by a game
+    """
+
+    def __init__(self, directory, budget, idle, sizeof):
+        self.directory = directory
+        self.budget = budget
+        self.idle = idle
+        self.sizeof = sizeof
+        # game id -> (game, size, last used), least recently used first
+        self.resident = OrderedDict()
+        self.resident_bytes = 0
+        # ids of the games on disk
+        self.hibernated = set()
+        self.hibernations = 0
+        self.rehydrations = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.resident) + len(self.hibernated)
+
+    def __contains__(self, game_id):
+        with self.lock:
+            return game_id in self.resident or game_id in self.hibernated
+
+    def __getitem__(self, game_id):
+        with self.lock:
+            now = time.monotonic()
+            if game_id in self.hibernated:
+                game = self._rehydrate(game_id)
+                self._keep(game_id, game, now)
+            else:
+                game, size, _ = self.resident[game_id]
+                self.resident[game_id] = (game, size, now)
+                self.resident.move_to_end(game_id)
+            self._evict(now)
+            return game
+
+    def __setitem__(self, game_id, game):
+        with self.lock:
+            now = time.monotonic()
+            self._drop(game_id)
+            self._keep(game_id, game, now)
+            self._evict(now)
+
+    def get(self, game_id, default=None):
+        """Get a game, rehydrating it if it was hibernated
+
+        Args:
+            game_id (int): the game number
+            default (object): returned if there is no such game
+
+        Returns:
+            object: the game
+        """
+        try:
+            return self[game_id]
+        except KeyError:
+            return default
+
+    def pop(self, game_id, default=None):
+        """Take a game out of the store
+
+        Args:
+            game_id (int): the game number
+            default (object): returned if there is no such game
+
+        Returns:
+            object: the game
+        """
+        with self.lock:
+            if game_id in self.hibernated:
+                game = self._rehydrate(game_id)
+            elif game_id in self.resident:
+                game, size, _ = self.resident.pop(game_id)
+                self.resident_bytes -= size
+            else:
+                return default
+            return game
+
+    def sweep(self):
+        """Hibernate the games left idle for too long, even when no
+        game is used
+        """
+        with self.lock:
+            self._evict(time.monotonic())
+
+    def clear(self):
+        """Forget every game, records left by an earlier server are deleted
+        """
+        with self.lock:
+            self.resident.clear()
+            self.resident_bytes = 0
+            self.hibernated.clear()
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.endswith(RECORD_EXTENSION):
+                        os.remove(os.path.join(self.directory, name))
+
+    def _path(self, game_id):
+        """Get the path of the record of a game
+
+        Args:
+            game_id (int): the game number
+
+        Returns:
+            str: path of the record
+        """
+        return os.path.join(self.directory, f"{game_id}{RECORD_EXTENSION}")
+
+    def _keep(self, game_id, game, now):
+        """Keep a game in memory as the most recently used
+
+        Args:
+            game_id (int): the game number
+            game (object): the game
+            now (float): current time in seconds
+        """
+        size = self.sizeof(game)
+        self.resident[game_id] = (game, size, now)
+        self.resident_bytes += size
+
+    def _drop(self, game_id):
+        """Forget a game wherever it is kept
+
+        Args:
+            game_id (int): the game number
+        """
+        if game_id in self.hibernated:
+            self.hibernated.discard(game_id)
+            os.remove(self._path(game_id))
+        elif game_id in self.resident:
+            self.resident_bytes -= self.resident.pop(game_id)[1]
+
+    def _evict(self, now):
+        """Hibernate the least recently used games while memory is over
+        budget or they have been idle for too long
+
+        Args:
+            now (float): current time in seconds
+        """
+        while self.resident:
+            game_id, (game, size, used) = next(iter(self.resident.items()))
+            if self.resident_bytes <= self.budget and now - used < self.idle:
+                break
+            if len(self.resident) == 1 and now - used < self.idle:
+                # the game just used is kept even if it is over budget
+                break
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(game_id), "wb") as file:
+                file.write(zlib.compress(pickle.dumps(game, pickle.HIGHEST_PROTOCOL)))
+            del self.resident[game_id]
+            self.resident_bytes -= size
+            self.hibernated.add(game_id)
+            self.hibernations += 1
+
+    def _rehydrate(self, game_id):
+        """Read a hibernated game back, its record is deleted
+
+        Args:
+            game_id (int): the game number
+
+        Returns:
+            object: the game
+        """
+        path = self._path(game_id)
+        with open(path, "rb") as file:
+            game = pickle.loads(zlib.decompress(file.read()))
+        os.remove(path)
+        self.hibernated.discard(game_id)
+        self.rehydrations += 1
+        return game
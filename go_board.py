@@ -0,0 +1,780 @@
+"""This module contains the GoBoard class.
+GoBoard objects are a headless representation of a Go board that
+keep track of groups, liberties and the legality of every move
+without needing pygame.
+"""
+import random
+
+import numpy as np
+
+EMPTY = 0
+BLACK_STONE = 1
+WHITE_STONE = -1
+# position used to represent a pass
+PASS = -1
+# board sizes that can be played, larger boards have no coordinate letters
+MIN_SIZE = 5
+MAX_SIZE = 25
+
+# neighbour tables are shared between all boards of the same size
+_NEIGHBORS = {}
+_PATTERNS = {}
+_ZOBRIST = {}
+_SYMMETRY = {}
+
+# offsets of the 8 points around an intersection, each point takes
+# 2 bits of a pattern code: 0 empty, 1 black, 2 white, 3 off the board
+PATTERN_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+OFF_BOARD = 3
+
+# the 8 symmetries of the board as functions of (row, col) and the
+# last index n, the first one is the identity
+SYMMETRIES = (
+    lambda row, col, n: (row, col),
+    lambda row, col, n: (col, n - row),
+    lambda row, col, n: (n - row, n - col),
+    lambda row, col, n: (n - col, row),
+    lambda row, col, n: (row, n - col),
+    lambda row, col, n: (col, row),
+    lambda row, col, n: (n - row, col),
+    lambda row, col, n: (n - col, n - row),
+)
+# the hashes of all symmetries are packed in one integer, 64 bits each
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+
+def neighbor_table(size):
+    """Get the orthogonal neighbours of every intersection of a board
+
+    Args:
+        size (int): size of the board
+
+    Returns:
+        tuple: tuple of neighbour positions for every position
+    """
+    if size not in _NEIGHBORS:
+        table = []
+        for pos in range(size * size):
+            row, col = divmod(pos, size)
+            adjacent = []
+            # checking row above
+            if row != 0:
+                adjacent.append(pos - size)
+            # checking row below
+            if row != size - 1:
+                adjacent.append(pos + size)
+            # checking col to the left
+            if col != 0:
+                adjacent.append(pos - 1)
+            # checking col to the right
+            if col != size - 1:
+                adjacent.append(pos + 1)
+            table.append(tuple(adjacent))
+        _NEIGHBORS[size] = tuple(table)
+    return _NEIGHBORS[size]
+
+
+def pattern_table(size):
+    """Get the tables used to keep 3x3 pattern codes up to date
+
+    Args:
+        size (int): size of the board
+
+    Returns:
+        tuple: for every position, the (position, shift) pairs of the
+            patterns it is part of, and the code of every empty
+            position with only its off board points set
+    """
+    if size not in _PATTERNS:
+        links = []
+        edges = []
+        for pos in range(size * size):
+            row, col = divmod(pos, size)
+            link = []
+            edge = 0
+            for slot, (d_row, d_col) in enumerate(PATTERN_OFFSETS):
+                adj_row = row + d_row
+                adj_col = col + d_col
+                if 0 <= adj_row < size and 0 <= adj_col < size:
+                    # pos sits in the opposite slot of the pattern of adj
+                    opposite = PATTERN_OFFSETS.index((-d_row, -d_col))
+                    link.append((adj_row * size + adj_col, opposite * 2))
+                else:
+                    edge |= OFF_BOARD << (slot * 2)
+            links.append(tuple(link))
+            edges.append(edge)
+        _PATTERNS[size] = (tuple(links), tuple(edges))
+    return _PATTERNS[size]
+
+
+def zobrist_table(size):
+    """Get the random keys used to hash positions, the keys are seeded
+    by the board size so hashes are the same in every process and run
+
+    Args:
+        size (int): size of the board
+
+    Returns:
+        tuple: keys of every (position, stone code) pair at index
+            position * 2 + stone code - 1, followed by the key of white
+            to move and the keys of every Ko point
+    """
+    if size not in _ZOBRIST:
+        rng = random.Random(size)
+        area = size * size
+        stones = tuple(rng.getrandbits(64) for _ in range(area * 2))
+        white_to_play = rng.getrandbits(64)
+        ko_points = tuple(rng.getrandbits(64) for _ in range(area))
+        _ZOBRIST[size] = (stones, white_to_play, ko_points)
+    return _ZOBRIST[size]
+
+
+def symmetry_table(size):
+    """Get where every position goes under the 8 symmetries of a board,
+    and the keys used to hash all 8 symmetric positions at once
+
+    Args:
+        size (int): size of the board
+
+    Returns:
+        tuple: positions of every symmetry, positions of its inverse, and
+            the Zobrist keys of the symmetric positions packed 64 bits per
+            symmetry, laid out as in zobrist_table
+    """
+    if size not in _SYMMETRY:
+        area = size * size
+        last = size - 1
+        forward = []
+        for symmetry in SYMMETRIES:
+            table = []
+            for pos in range(area):
+                row, col = symmetry(*divmod(pos, size), last)
+                table.append(row * size + col)
+            forward.append(tuple(table))
+        inverse = []
+        for table in forward:
+            back = [0] * area
+            for pos, image in enumerate(table):
+                back[image] = pos
+            inverse.append(tuple(back))
+
+        stones, white_to_play, ko_points = zobrist_table(size)
+
+        def packed(keys):
+            value = 0
+            for index, key in enumerate(keys):
+                value |= key << (index * HASH_BITS)
+            return value
+
+        packed_stones = tuple(
+            packed(stones[table[index // 2] * 2 + index % 2] for table in forward)
+            for index in range(area * 2)
+        )
+        packed_white = packed([white_to_play] * len(forward))
+        packed_ko = tuple(
+            packed(ko_points[table[pos]] for table in forward) for pos in range(area)
+        )
+        _SYMMETRY[size] = (
+            tuple(forward),
+            tuple(inverse),
+            (packed_stones, packed_white, packed_ko),
+        )
+    return _SYMMETRY[size]
+
+
+def stone_code(color):
+    """Get the pattern code of a stone
+
+    Args:
+        color (int): 1 for black, -1 for white
+
+    Returns:
+        int: 1 for black, 2 for white
+    """
+    return (3 - color) // 2
+
+
+class GoBoard:
+    """Class representing the rules engine of a Go board
+
+    Positions are integers equal to row * size + col, the same
+    encoding GoGui uses for its groups. Every group keeps its set of
+    stones and its set of liberties, so the legality of a move only
+    depends on the neighbours of that move and never needs a trial
+    placement.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.area = size * size
+        self.neighbors = neighbor_table(size)
+        self.pattern_links, edges = pattern_table(size)
+        self.zobrist = zobrist_table(size)
+        self.symmetries, self.inverse_symmetries, self.symmetry_keys = symmetry_table(size)
+
+        self.cells = [EMPTY] * self.area
+        # 3x3 pattern code around every intersection, kept up to date
+        # whenever a stone is placed or captured
+        self.patterns = list(edges)
+        # Zobrist hashes of the stones of the 8 symmetric boards, 64 bits
+        # each, the lowest 64 bits hash the board as it is
+        self.hashes = 0
+        # keeps track of the parent of each group
+        self.pointer = [-1] * self.area
+        # stones and liberties of each group, keyed by parent
+        self.groups = {}
+        self.liberties = {}
+        self.empty_points = set(range(self.area))
+
+        self.to_play = BLACK_STONE
+        # point the side to move cannot play at because of Ko
+        self.ko_point = None
+        self.white_captured = 0
+        self.black_captured = 0
+        # deltas of every move played, used to undo moves
+        self.history = []
+
+        # cached legality of every point for both colors, only the
+        # points in dirty are recomputed when the mask is needed
+        self.legal = {
+            BLACK_STONE: bytearray(b"\x01") * self.area,
+            WHITE_STONE: bytearray(b"\x01") * self.area,
+        }
+        self.dirty = set()
+
+    @classmethod
+    def from_array(cls, board, to_play=BLACK_STONE):
+        """Create an engine from a 2D board array
+
+        Args:
+            board (np.ndarray): board with 1 for black, -1 for white, 0 for empty
+            to_play (int): 1 if black is to move, -1 otherwise
+
+        Returns:
+            GoBoard: engine with the same stones as board
+        """
+        size = len(board)
+        engine = cls(size)
+        engine.load(board, to_play)
+        return engine
+
+    def load(self, board, to_play=BLACK_STONE):
+        """Replace the stones of the engine with the stones of a 2D board,
+        the move history and Ko information are lost
+
+        Args:
+            board (np.ndarray): board with 1 for black, -1 for white, 0 for empty
+            to_play (int): 1 if black is to move, -1 otherwise
+        """
+        self.cells = [int(stone) for stone in np.asarray(board).flat]
+        self.patterns = list(pattern_table(self.size)[1])
+        self.hashes = 0
+        for pos in range(self.area):
+            if self.cells[pos] != EMPTY:
+                self._stone_changed(pos, stone_code(self.cells[pos]))
+        self.pointer = [-1] * self.area
+        self.groups = {}
+        self.liberties = {}
+        self.empty_points = {pos for pos in range(self.area) if not self.cells[pos]}
+        self.to_play = to_play
+        self.ko_point = None
+        self.history = []
+
+        for pos in range(self.area):
+            if self.cells[pos] != EMPTY and self.pointer[pos] == -1:
+                self._build_group(pos)
+        self.dirty = set(range(self.area))
+
+    def copy(self):
+        """Copy the engine, the move history is not copied
+
+        Returns:
+            GoBoard: independent copy of the engine
+        """
+        other = GoBoard.__new__(GoBoard)
+        other.size = self.size
+        other.area = self.area
+        other.neighbors = self.neighbors
+        other.pattern_links = self.pattern_links
+        other.cells = self.cells[:]
+        other.patterns = self.patterns[:]
+        other.zobrist = self.zobrist
+        other.symmetries = self.symmetries
+        other.inverse_symmetries = self.inverse_symmetries
+        other.symmetry_keys = self.symmetry_keys
+        other.hashes = self.hashes
+        other.pointer = self.pointer[:]
+        other.groups = {key: set(group) for key, group in self.groups.items()}
+        other.liberties = {key: set(libs) for key, libs in self.liberties.items()}
+        other.empty_points = set(self.empty_points)
+        other.to_play = self.to_play
+        other.ko_point = self.ko_point
+        other.white_captured = self.white_captured
+        other.black_captured = self.black_captured
+        other.history = []
+        other.legal = {
+            BLACK_STONE: self.legal[BLACK_STONE][:],
+            WHITE_STONE: self.legal[WHITE_STONE][:],
+        }
+        other.dirty = set(self.dirty)
+        return other
+
+    def encode(self):
+        """Encode the position compactly, one byte per intersection plus
+        the side to move and the Ko point, so it is cheap to send to
+        other processes
+
+        Returns:
+            bytes: encoded position
+        """
+        ko_point = self.area if self.ko_point is None else self.ko_point
+        header = bytes([self.size, self.to_play & 0xFF]) + ko_point.to_bytes(2, "little")
+        return header + np.array(self.cells, dtype=np.int8).tobytes()
+
+    @classmethod
+    def decode(cls, data):
+        """Create an engine from a position made by encode
+
+        Args:
+            data (bytes): encoded position
+
+        Returns:
+            GoBoard: engine at the encoded position
+        """
+        size = data[0]
+        to_play = 1 if data[1] == 1 else -1
+        ko_point = int.from_bytes(data[2:4], "little")
+        board = np.frombuffer(data, dtype=np.int8, offset=4).reshape(size, size)
+        engine = cls.from_array(board, to_play)
+        if ko_point != engine.area:
+            engine.ko_point = ko_point
+        return engine
+
+    @property
+    def board(self):
+        """2D array of the stones on the board
+
+        Returns:
+            np.ndarray: board with 1 for black, -1 for white, 0 for empty
+        """
+        return np.array(self.cells, dtype=np.int8).reshape(self.size, self.size)
+
+    @property
+    def hash(self):
+        """int: 64 bit Zobrist hash of the stones on the board"""
+        return self.hashes & HASH_MASK
+
+    def _stone_changed(self, pos, delta):
+        """Update the hashes and the pattern codes around a point whose
+        stone changed
+
+        Args:
+            pos (int): position of the point
+            delta (int): stone code added, negative when a stone is removed
+        """
+        # one xor updates the hashes of all 8 symmetric boards
+        self.hashes ^= self.symmetry_keys[0][pos * 2 + abs(delta) - 1]
+        patterns = self.patterns
+        for adj, shift in self.pattern_links[pos]:
+            patterns[adj] += delta << shift
+
+    def key(self):
+        """Hash of the whole position, including the side to move and
+        the Ko point
+
+        Returns:
+            int: 64 bit hash of the position
+        """
+        key = self.hash
+        if self.to_play == WHITE_STONE:
+            key ^= self.zobrist[1]
+        if self.ko_point is not None:
+            key ^= self.zobrist[2][self.ko_point]
+        return key
+
+    def canonical_key(self):
+        """Hash of the whole position that is the same for all 8
+        rotations and reflections of the board
+
+        Returns:
+            tuple: smallest key() of the 8 symmetric positions, and the
+                index of the symmetry giving it
+        """
+        keys = self.hashes
+        if self.to_play == WHITE_STONE:
+            keys ^= self.symmetry_keys[1]
+        if self.ko_point is not None:
+            keys ^= self.symmetry_keys[2][self.ko_point]
+        best = keys & HASH_MASK
+        best_symmetry = 0
+        for symmetry in range(1, len(SYMMETRIES)):
+            keys >>= HASH_BITS
+            key = keys & HASH_MASK
+            if key < best:
+                best = key
+                best_symmetry = symmetry
+        return best, best_symmetry
+
+    def to_canonical(self, pos, symmetry):
+        """Move a position to the board of a canonical key
+
+        Args:
+            pos (int): position on this board, or PASS
+            symmetry (int): symmetry given by canonical_key
+
+        Returns:
+            int: position on the canonical board, or PASS
+        """
+        return PASS if pos == PASS else self.symmetries[symmetry][pos]
+
+    def from_canonical(self, pos, symmetry):
+        """Move a position from the board of a canonical key to this board
+
+        Args:
+            pos (int): position on the canonical board, or PASS
+            symmetry (int): symmetry given by canonical_key
+
+        Returns:
+            int: position on this board, or PASS
+        """
+        return PASS if pos == PASS else self.inverse_symmetries[symmetry][pos]
+
+    def pattern(self, pos):
+        """Get the 3x3 pattern code around a point
+
+        Args:
+            pos (int): position of the point
+
+        Returns:
+            int: 16 bit code, 2 bits for each of the 8 surrounding points
+        """
+        return self.patterns[pos]
+
+    def _build_group(self, start):
+        """Flood fill the group containing start and record its
+        stones and liberties
+
+        Args:
+            start (int): position of a stone
+        """
+        color = self.cells[start]
+        stones = {start}
+        libs = set()
+        frontier = [start]
+        while frontier:
+            pos = frontier.pop()
+            for adj in self.neighbors[pos]:
+                stone = self.cells[adj]
+                if stone == EMPTY:
+                    libs.add(adj)
+                elif stone == color and adj not in stones:
+                    stones.add(adj)
+                    frontier.append(adj)
+
+        for pos in stones:
+            self.pointer[pos] = start
+        self.groups[start] = stones
+        self.liberties[start] = libs
+
+    def _count_liberties(self, parent):
+        """Recompute the liberties of a group from scratch
+
+        Args:
+            parent (int): parent of the group
+        """
+        cells = self.cells
+        self.liberties[parent] = {
+            adj
+            for pos in self.groups[parent]
+            for adj in self.neighbors[pos]
+            if cells[adj] == EMPTY
+        }
+
+    def _mark_dirty(self, points, parents):
+        """Mark the points whose legality may have changed
+
+        Args:
+            points (iterable): points whose stone changed
+            parents (iterable): groups whose liberties changed
+        """
+        dirty = self.dirty
+        for pos in points:
+            dirty.add(pos)
+            dirty.update(self.neighbors[pos])
+        for parent in parents:
+            if parent in self.liberties:
+                dirty.update(self.liberties[parent])
+
+    def _compute_legal(self, pos, color):
+        """Check whether color may play at pos, ignoring Ko
+
+        Args:
+            pos (int): position of the move
+            color (int): 1 for black, -1 for white
+
+        Returns:
+            bool: True if the move is not occupied and not suicide
+        """
+        if self.cells[pos] != EMPTY:
+            return False
+        for adj in self.neighbors[pos]:
+            stone = self.cells[adj]
+            if stone == EMPTY:
+                return True
+            libs = len(self.liberties[self.pointer[adj]])
+            if stone == color:
+                # joining a group that keeps a liberty
+                if libs > 1:
+                    return True
+            elif libs == 1:
+                # capturing an opponent group
+                return True
+        return False
+
+    def _refresh(self):
+        """Recompute the cached legality of all dirty points
+        """
+        black = self.legal[BLACK_STONE]
+        white = self.legal[WHITE_STONE]
+        for pos in self.dirty:
+            black[pos] = self._compute_legal(pos, BLACK_STONE)
+            white[pos] = self._compute_legal(pos, WHITE_STONE)
+        self.dirty.clear()
+
+    def is_legal(self, pos, color=None):
+        """Check whether a move is legal
+
+        Args:
+            pos (int): position of the move, or PASS
+            color (int, optional): color to check, defaults to the side to move
+
+        Returns:
+            bool: True if the move is legal
+        """
+        if pos == PASS:
+            return True
+        if color is None:
+            color = self.to_play
+        if color == self.to_play and pos == self.ko_point:
+            return False
+        if pos in self.dirty:
+            return self._compute_legal(pos, color)
+        return bool(self.legal[color][pos])
+
+    def legal_moves(self, color=None):
+        """Get the legality of every point as a mask
+
+        Args:
+            color (int, optional): color to check, defaults to the side to move
+
+        Returns:
+            np.ndarray: (size, size) boolean mask, True where color may play
+        """
+        if color is None:
+            color = self.to_play
+        self._refresh()
+        mask = np.frombuffer(self.legal[color], dtype=np.bool_).copy()
+        if color == self.to_play and self.ko_point is not None:
+            mask[self.ko_point] = False
+        return mask.reshape(self.size, self.size)
+
+    def legal_move_list(self, color=None):
+        """Get every legal move, passing is not included
+
+        Args:
+            color (int, optional): color to check, defaults to the side to move
+
+        Returns:
+            list: positions of every legal move
+        """
+        if color is None:
+            color = self.to_play
+        self._refresh()
+        legal = self.legal[color]
+        ko_point = self.ko_point if color == self.to_play else None
+        return [pos for pos in self.empty_points if legal[pos] and pos != ko_point]
+
+    def play(self, pos):
+        """Play a move for the side to move
+
+        Args:
+            pos (int): position of the move, or PASS
+
+        Raises:
+            ValueError: if the move is illegal
+
+        Returns:
+            tuple: positions of the captured stones
+        """
+        color = self.to_play
+        if pos == PASS:
+            self.history.append((PASS, color, self.ko_point, ()))
+            self.ko_point = None
+            self.to_play = -color
+            return ()
+        if not self.is_legal(pos):
+            raise ValueError(f"Illegal move at {pos}")
+
+        cells = self.cells
+        pointer = self.pointer
+        neighbors = self.neighbors
+        prev_ko = self.ko_point
+
+        cells[pos] = color
+        self._stone_changed(pos, stone_code(color))
+        self.empty_points.discard(pos)
+        pointer[pos] = pos
+        self.groups[pos] = {pos}
+        self.liberties[pos] = {adj for adj in neighbors[pos] if cells[adj] == EMPTY}
+        parent = pos
+        touched = set()
+        captured = []
+
+        for adj in neighbors[pos]:
+            stone = cells[adj]
+            if stone == color:
+                other = pointer[adj]
+                if other != parent:
+                    # merge the smaller group into the larger one
+                    if len(self.groups[other]) > len(self.groups[parent]):
+                        parent, other = other, parent
+                    for member in self.groups[other]:
+                        pointer[member] = parent
+                    self.groups[parent] |= self.groups.pop(other)
+                    self.liberties[parent] |= self.liberties.pop(other)
+            elif stone == -color:
+                other = pointer[adj]
+                libs = self.liberties[other]
+                libs.discard(pos)
+                touched.add(other)
+                if not libs:
+                    captured.extend(self._remove_group(other))
+        self.liberties[parent].discard(pos)
+        touched = {key for key in touched if key in self.groups}
+
+        if color == BLACK_STONE:
+            self.white_captured += len(captured)
+        else:
+            self.black_captured += len(captured)
+
+        # a single stone capturing a single stone can be recaptured
+        if (
+            len(captured) == 1
+            and len(self.groups[parent]) == 1
+            and self.liberties[parent] == {captured[0]}
+        ):
+            self.ko_point = captured[0]
+        else:
+            self.ko_point = None
+
+        for stone in captured:
+            for adj in neighbors[stone]:
+                if cells[adj] == color:
+                    touched.add(pointer[adj])
+        touched.add(parent)
+
+        self.history.append((pos, color, prev_ko, tuple(captured)))
+        self.to_play = -color
+        self._mark_dirty([pos] + captured, touched)
+        return tuple(captured)
+
+    def _remove_group(self, parent):
+        """Remove a captured group from the board and give its
+        neighbours their liberties back
+
+        Args:
+            parent (int): parent of the group
+
+        Returns:
+            set: positions of the removed stones
+        """
+        stones = self.groups.pop(parent)
+        del self.liberties[parent]
+        cells = self.cells
+        code = stone_code(cells[parent])
+        for pos in stones:
+            cells[pos] = EMPTY
+            self.pointer[pos] = -1
+            self._stone_changed(pos, -code)
+        self.empty_points |= stones
+        for pos in stones:
+            for adj in self.neighbors[pos]:
+                if cells[adj] != EMPTY:
+                    self.liberties[self.pointer[adj]].add(pos)
+        return stones
+
+    def undo(self):
+        """Take back the last move
+
+        Raises:
+            IndexError: if no moves have been played
+        """
+        pos, color, prev_ko, captured = self.history.pop()
+        self.to_play = color
+        self.ko_point = prev_ko
+        if pos == PASS:
+            return
+
+        cells = self.cells
+        pointer = self.pointer
+        neighbors = self.neighbors
+
+        # take the stone off and forget the group it belonged to
+        parent = pointer[pos]
+        members = self.groups.pop(parent)
+        del self.liberties[parent]
+        for member in members:
+            pointer[member] = -1
+        cells[pos] = EMPTY
+        self._stone_changed(pos, -stone_code(color))
+        self.empty_points.add(pos)
+
+        # put the captured stones back
+        for stone in captured:
+            cells[stone] = -color
+            self._stone_changed(stone, stone_code(-color))
+        self.empty_points.difference_update(captured)
+        if color == BLACK_STONE:
+            self.white_captured -= len(captured)
+        else:
+            self.black_captured -= len(captured)
+
+        for member in members:
+            if member != pos and pointer[member] == -1:
+                self._build_group(member)
+        for stone in captured:
+            if pointer[stone] == -1:
+                self._build_group(stone)
+
+        touched = set()
+        for stone in (pos,) + captured:
+            for adj in neighbors[stone]:
+                if cells[adj] != EMPTY:
+                    touched.add(pointer[adj])
+        for key in touched:
+            self._count_liberties(key)
+        self._mark_dirty((pos,) + captured, touched)
+
+    def follow(self, board):
+        """Bring the engine up to date with a board that is one move
+        ahead of it, falling back to reloading the board otherwise
+
+        Args:
+            board (np.ndarray): board after the opponent's move
+        """
+        flat = np.asarray(board).ravel()
+        next_to_play = -self.to_play
+        placed = [
+            pos
+            for pos in range(self.area)
+            if flat[pos] == self.to_play and self.cells[pos] != self.to_play
+        ]
+        if not placed and all(flat[pos] == self.cells[pos] for pos in range(self.area)):
+            self.play(PASS)
+            return
+        if len(placed) == 1 and self.is_legal(placed[0]):
+            self.play(placed[0])
+            if all(flat[pos] == self.cells[pos] for pos in range(self.area)):
+                return
+        self.load(board, next_to_play)
@@ -0,0 +1,788 @@
+"""This module contains the MCTS bot.
+The bot searches moves with Monte Carlo Tree Search using random
+playouts on the headless GoBoard engine, and can think on a
+background thread so the GUI keeps drawing.
+"""
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from go_board import BLACK_STONE, EMPTY, PASS, WHITE_STONE, GoBoard
+from transposition import TranspositionTable
+
+KOMI = 7.5
+
+
+def is_eye(engine, pos, color):
+    """Checks whether an empty point is surrounded by a single color
+
+    Args:
+        engine (GoBoard): board to check
+        pos (int): position of the empty point
+        color (int): 1 for black, -1 for white
+
+    Returns:
+        bool: True if every neighbour is a stone of color
+    """
+    cells = engine.cells
+    for adj in engine.neighbors[pos]:
+        if cells[adj] != color:
+            return False
+    return True
+
+
+def area_score(engine, komi=KOMI):
+    """Score a finished playout with area scoring, empty points
+    count for a color if all their neighbours are of that color
+
+    Args:
+        engine (GoBoard): board to score
+        komi (float): points given to white
+
+    Returns:
+        float: black score minus white score
+    """
+    cells = engine.cells
+    score = -komi
+    for pos in range(engine.area):
+        stone = cells[pos]
+        if stone != EMPTY:
+            score += stone
+        else:
+            owner = None
+            for adj in engine.neighbors[pos]:
+                if owner is None:
+                    owner = cells[adj]
+                elif cells[adj] != owner:
+                    owner = EMPTY
+                    break
+            if owner:
+                score += owner
+    return score
+
+
+def random_move(engine, rng):
+    """Pick a random legal move that does not fill an own eye
+
+    Args:
+        engine (GoBoard): board to pick a move on
+        rng (random.Random): random number generator
+
+    Returns:
+        int: position of the move, PASS if there are none
+    """
+    color = engine.to_play
+    candidates = list(engine.empty_points)
+    count = len(candidates)
+    # drawing without replacement, stopping at the first good move
+    while count:
+        index = int(rng.random() * count)
+        pos = candidates[index]
+        if engine.is_legal(pos) and not is_eye(engine, pos, color):
+            return pos
+        count -= 1
+        candidates[index] = candidates[count]
+    return PASS
+
+
+def default_pattern_weights():
+    """Build pattern weight tables from simple features of the 3x3
+    neighbourhood, favouring contact moves, hane and cuts and
+    discouraging lone first line moves
+
+    Returns:
+        dict: for each color, a list of weights indexed by pattern code
+    """
+    codes = np.arange(1 << 16)
+    slots = np.stack([(codes >> (slot * 2)) & 3 for slot in range(8)])
+    orth = slots[:4]
+    diag = slots[4:]
+
+    # tables are built for black, own stones are 1 and opponent stones 2
+    own_orth = (orth == 1).sum(axis=0)
+    opp_orth = (orth == 2).sum(axis=0)
+    off_orth = (orth == 3).sum(axis=0)
+    own_diag = (diag == 1).sum(axis=0)
+    stones = ((slots == 1) | (slots == 2)).sum(axis=0)
+
+    weights = np.ones(codes.shape)
+    # contact with the opponent
+    weights += 2.0 * (opp_orth > 0)
+    # hane and extensions next to own stones
+    weights += 2.0 * ((opp_orth > 0) & ((own_orth > 0) | (own_diag > 0)))
+    # cutting or capturing between opponent stones
+    weights += 2.0 * (opp_orth >= 2)
+    # lone moves on the first line
+    weights[(off_orth > 0) & (stones == 0)] = 0.1
+    # filling own eyes
+    weights[own_orth + off_orth == 4] = 0.0
+
+    # white tables see the colors of every point swapped
+    swap = np.array([0, 2, 1, 3])
+    swapped = sum(swap[slots[slot]] << (slot * 2) for slot in range(8))
+    return {
+        BLACK_STONE: weights.tolist(),
+        WHITE_STONE: weights[swapped].tolist(),
+    }
+
+
+class PatternPolicy:
+    """Class representing a playout policy that answers the last move
+    locally, choosing between its 8 surrounding points with a weight
+    table looked up by their 3x3 pattern codes
+
+    Args:
+        weights (dict): for each color, a list of weights indexed by pattern code
+        random_weight (float): weight of playing a random move instead
+    """
+
+    def __init__(self, weights=None, random_weight=4.0):
+        self.weights = weights or default_pattern_weights()
+        self.random_weight = random_weight
+
+    def __call__(self, engine, rng):
+        """Pick a move for the side to move
+
+        Args:
+            engine (GoBoard): board to pick a move on
+            rng (random.Random): random number generator
+
+        Returns:
+            int: position of the move, PASS if there are none
+        """
+        history = engine.history
+        if history and history[-1][0] != PASS:
+            color = engine.to_play
+            table = self.weights[color]
+            patterns = engine.patterns
+            cells = engine.cells
+            candidates = []
+            total = 0.0
+            for adj, _ in engine.pattern_links[history[-1][0]]:
+                if cells[adj] == EMPTY:
+                    weight = table[patterns[adj]]
+                    if weight and engine.is_legal(adj):
+                        total += weight
+                        candidates.append((total, adj))
+
+            target = rng.random() * (total + self.random_weight)
+            for cumulative, adj in candidates:
+                if target < cumulative:
+                    return adj
+        return random_move(engine, rng)
+
+
+# policies are built once per process since pattern tables are large
+_POLICIES = {}
+
+
+def get_policy(name):
+    """Get a playout policy by name
+
+    Args:
+        name (str): "random" or "pattern"
+
+    Returns:
+        function: policy taking an engine and a random number generator
+    """
+    if name == "random":
+        return random_move
+    if name not in _POLICIES:
+        _POLICIES[name] = PatternPolicy()
+    return _POLICIES[name]
+
+
+def playout(engine, rng, komi=KOMI, policy=random_move):
+    """Play moves chosen by a policy until both players pass
+
+    Args:
+        engine (GoBoard): board to play on, it is modified
+        rng (random.Random): random number generator
+        komi (float): points given to white
+        policy (function): picks the next move from an engine and rng
+
+    Returns:
+        int: 1 if black won, -1 if white won
+    """
+    passes = 0
+    max_moves = engine.area * 3
+    for _ in range(max_moves):
+        move = policy(engine, rng)
+        engine.play(move)
+        if move == PASS:
+            passes += 1
+            if passes == 2:
+                break
+        else:
+            passes = 0
+    return 1 if area_score(engine, komi) > 0 else -1
+
+
+class Node:
+    """Class representing a node of the search tree
+
+    Args:
+        move (int): move leading to this node
+        parent (Node): node this node was expanded from
+        to_play (int): color to move at this node
+        key (int, optional): hash of the position at this node
+    """
+
+    __slots__ = (
+        "move",
+        "parent",
+        "to_play",
+        "key",
+        "children",
+        "untried",
+        "visits",
+        "wins",
+    )
+
+    def __init__(self, move, parent, to_play, key=None):
+        self.move = move
+        self.parent = parent
+        self.to_play = to_play
+        # hash of the position at this node
+        self.key = key
+        self.children = {}
+        self.untried = None
+        self.visits = 0
+        # wins of the player who played move
+        self.wins = 0.0
+
+    def expand_moves(self, engine, rng):
+        """Find the moves this node can still be expanded with
+
+        Args:
+            engine (GoBoard): board at this node
+            rng (random.Random): random number generator
+        """
+        color = engine.to_play
+        self.untried = [
+            pos for pos in engine.legal_move_list() if not is_eye(engine, pos, color)
+        ]
+        rng.shuffle(self.untried)
+        # moves are expanded from the back, so passing is tried last
+        self.untried.insert(0, PASS)
+
+    def select(self, exploration):
+        """Select the child with the highest UCT value
+
+        Args:
+            exploration (float): weight of the exploration term
+
+        Returns:
+            Node: selected child
+        """
+        log_visits = math.log(self.visits)
+        best = None
+        best_value = -1.0
+        for child in self.children.values():
+            value = child.wins / child.visits + exploration * math.sqrt(
+                log_visits / child.visits
+            )
+            if value > best_value:
+                best = child
+                best_value = value
+        return best
+
+
+class MCTS:
+    """Class representing a Monte Carlo Tree Search
+
+    Args:
+        playouts (int, optional): number of playouts per move
+        seconds (float, optional): time to think per move, used when
+            playouts is not given
+        komi (float): points given to white
+        exploration (float): weight of the exploration term of UCT
+        policy (str): playout policy, "random" or "pattern"
+        table (TranspositionTable, optional): statistics shared by every
+            node reaching the same position
+        seed (int, optional): seed of the random number generator
+        stop_event (multiprocessing.Event, optional): stops the search
+            when set from another process
+    """
+
+    def __init__(
+        self,
+        playouts=None,
+        seconds=1.0,
+        komi=KOMI,
+        exploration=1.0,
+        policy="pattern",
+        table=None,
+        seed=None,
+        stop_event=None,
+    ):
+        self.playouts = playouts
+        self.seconds = seconds
+        self.komi = komi
+        self.exploration = exploration
+        self.policy = get_policy(policy)
+        self.table = table
+        self.rng = random.Random(seed)
+        self.root = None
+        self.root_engine = None
+        self.stopped = False
+        self.stop_event = stop_event
+        # playouts run by the last search
+        self.last_playouts = 0
+
+    def advance(self, move):
+        """Move the root of the tree along a played move, keeping the
+        statistics of the subtree below it
+
+        Args:
+            move (int): position of the move played, or PASS
+        """
+        if self.root is None:
+            return
+        if not self.root_engine.is_legal(move):
+            # the game left the tree, start over on the next search
+            self.root = None
+            return
+        self.root_engine.play(move)
+        child = self.root.children.get(move)
+        if child is None:
+            child = Node(move, None, self.root_engine.to_play, self.root_engine.key())
+        child.parent = None
+        self.root = child
+
+    def reuse_tree(self, engine):
+        """Keep the tree of the previous search if its root is at the
+        position to search, otherwise start a new tree
+
+        Args:
+            engine (GoBoard): board to search
+        """
+        if self.root is None or self.root_engine.key() != engine.key():
+            self.root = Node(None, None, engine.to_play, engine.key())
+            self.root_engine = engine.copy()
+
+    def run_playout(self, engine):
+        """Run one selection, expansion, playout and backpropagation
+
+        Args:
+            engine (GoBoard): board at the root, it is modified
+        """
+        node = self.root
+        # selection
+        while node.untried is not None and not node.untried and node.children:
+            node = node.select(self.exploration)
+            engine.play(node.move)
+
+        # expansion
+        if node.untried is None:
+            node.expand_moves(engine, self.rng)
+        if node.untried:
+            move = node.untried.pop()
+            color = engine.to_play
+            engine.play(move)
+            child = Node(move, node, -color, engine.key())
+            if self.table is not None:
+                # start from what is known about the position through
+                # other move orders
+                entry = self.table.get(child.key)
+                if entry is not None:
+                    child.visits = entry.visits
+                    child.wins = entry.wins
+            node.children[move] = child
+            node = child
+
+        winner = playout(engine, self.rng, self.komi, self.policy)
+
+        # backpropagation
+        while node is not None:
+            node.visits += 1
+            won = node.parent is not None and winner == node.parent.to_play
+            if won:
+                node.wins += 1
+            if self.table is not None and node.parent is not None:
+                # the root has no mover to win for, its statistics
+                # would only record losses
+                self.table.update(node.key, won)
+            node = node.parent
+
+    def search(self, engine):
+        """Search the best move of a position
+
+        Args:
+            engine (GoBoard): board to search, it is not modified
+
+        Returns:
+            int: position of the best move, or PASS
+        """
+        self.reuse_tree(engine)
+
+        count = 0
+        deadline = time.perf_counter() + self.seconds
+        while not self.stopped:
+            if self.stop_event is not None and self.stop_event.is_set():
+                break
+            if self.playouts is not None:
+                if count >= self.playouts:
+                    break
+            elif time.perf_counter() >= deadline:
+                break
+            self.run_playout(self.root_engine.copy())
+            count += 1
+
+        self.last_playouts = count
+        return self.best_move()
+
+    def best_move(self):
+        """Get the most visited move of the root
+
+        Returns:
+            int: position of the best move, or PASS
+        """
+        if not self.root.children:
+            return PASS
+        return max(self.root.children.values(), key=lambda child: child.visits).move
+
+    def root_stats(self):
+        """Get the statistics of the children of the root
+
+        Returns:
+            dict: visits and wins of every move searched from the root
+        """
+        return {
+            move: (child.visits, child.wins) for move, child in self.root.children.items()
+        }
+
+    def stop(self):
+        """Stop the current search as soon as possible, searches stay
+        stopped until resume is called
+        """
+        self.stopped = True
+
+    def resume(self):
+        """Let the next search run, called before it is started so a
+        stop arriving while it starts is not lost
+        """
+        self.stopped = False
+
+    def close(self):
+        """Release the resources of the search
+        """
+
+
+# transposition table of a worker process, kept between searches
+_WORKER_TABLE = None
+# event set by the parent process to stop the searches of the workers
+_WORKER_STOP = None
+
+
+def _init_worker(stop_event):
+    """Keep the stop event of the parent process in a worker process
+
+    Args:
+        stop_event (multiprocessing.Event): event set to stop searching
+    """
+    global _WORKER_STOP
+    _WORKER_STOP = stop_event
+
+
+def _search_worker(args):
+    """Search an encoded position in a worker process
+
+    Args:
+        args (tuple): encoded position, playouts, seconds, komi, policy,
+            transposition table size in bytes and seed
+
+    Returns:
+        tuple: statistics of the root children and number of playouts
+    """
+    global _WORKER_TABLE
+    data, playouts, seconds, komi, policy, table_bytes, seed = args
+    table = None
+    if table_bytes:
+        if _WORKER_TABLE is None or _WORKER_TABLE.max_bytes != table_bytes:
+            _WORKER_TABLE = TranspositionTable(table_bytes)
+        table = _WORKER_TABLE
+    search = MCTS(
+        playouts=playouts,
+        seconds=seconds,
+        komi=komi,
+        policy=policy,
+        table=table,
+        seed=seed,
+        stop_event=_WORKER_STOP,
+    )
+    search.search(GoBoard.decode(data))
+    return search.root_stats(), search.last_playouts
+
+
+class ParallelMCTS:
+    """Class representing a root parallel Monte Carlo Tree Search.
+    Every worker process grows its own tree from the same position and
+    the visit counts of the root children are merged, only the encoded
+    position and the root statistics cross process boundaries. Workers
+    do not keep their trees between moves, so there is nothing to
+    advance, but a search can be stopped
+
+    Args:
+        workers (int, optional): number of processes, defaults to the core count
+        playouts (int, optional): total number of playouts per move
+        seconds (float, optional): time to think per move, used when
+            playouts is not given
+        komi (float): points given to white
+        policy (str): playout policy, "random" or "pattern"
+        table_bytes (int): memory of the transposition table every
+            worker keeps between searches, 0 for none
+        seed (int, optional): seed of the random number generator
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        playouts=None,
+        seconds=1.0,
+        komi=KOMI,
+        policy="pattern",
+        table_bytes=0,
+        seed=None,
+    ):
+        self.workers = workers or os.cpu_count()
+        self.playouts = playouts
+        self.seconds = seconds
+        self.komi = komi
+        self.policy = policy
+        self.table_bytes = table_bytes
+        self.rng = random.Random(seed)
+        self.pool = None
+        self.stop_event = None
+        # kept until the pool and its event exist
+        self.stopped = False
+        self.stats = {}
+        self.last_playouts = 0
+
+    def search(self, engine):
+        """Search the best move of a position on every worker
+
+        Args:
+            engine (GoBoard): board to search, it is not modified
+
+        Returns:
+            int: position of the best move, or PASS
+        """
+        if self.pool is None:
+            # spawn so workers do not inherit the GUI or bot threads
+            context = multiprocessing.get_context("spawn")
+            self.stop_event = context.Event()
+            self.pool = context.Pool(
+                self.workers, initializer=_init_worker, initargs=(self.stop_event,)
+            )
+            if self.stopped:
+                self.stop_event.set()
+
+        data = engine.encode()
+        playouts = None
+        if self.playouts is not None:
+            playouts = -(-self.playouts // self.workers)
+        tasks = [
+            (
+                data,
+                playouts,
+                self.seconds,
+                self.komi,
+                self.policy,
+                self.table_bytes,
+                self.rng.getrandbits(32),
+            )
+            for _ in range(self.workers)
+        ]
+
+        self.stats = {}
+        self.last_playouts = 0
+        for stats, count in self.pool.imap_unordered(_search_worker, tasks):
+            self.last_playouts += count
+            for move, (visits, wins) in stats.items():
+                total_visits, total_wins = self.stats.get(move, (0, 0.0))
+                self.stats[move] = (total_visits + visits, total_wins + wins)
+
+        if not self.stats:
+            return PASS
+        return max(self.stats, key=lambda move: self.stats[move][0])
+
+    def advance(self, move):
+        """Trees are not kept between moves by the workers
+
+        Args:
+            move (int): position of the move played, or PASS
+        """
+
+    def stop(self):
+        """Stop the searches of every worker as soon as possible,
+        searches stay stopped until resume is called
+        """
+        self.stopped = True
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    def resume(self):
+        """Let the next search run, called before it is started so a
+        stop arriving while it starts is not lost
+        """
+        self.stopped = False
+        if self.stop_event is not None:
+            self.stop_event.clear()
+
+    def close(self):
+        """Shut the worker processes down
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+class BotPlayer:
+    """Class running a search on a background thread so the GUI
+    loop keeps running while the bot thinks
+
+    Args:
+        search (MCTS): search used to find moves
+        color (int): color the bot plays, 1 for black, -1 for white
+        book (OpeningBook, optional): moves played instead of searching
+            while the game is in the book
+    """
+
+    def __init__(self, search, color, book=None):
+        self.search = search
+        self.color = color
+        self.book = book
+        self.thread = None
+        self.move = None
+        # moves played since the last search, used to reuse the tree
+        self.pending = []
+        # incremented whenever a result becomes stale
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    @property
+    def thinking(self):
+        """bool: True while a search is running"""
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, engine):
+        """Start thinking about the position of engine
+
+        Args:
+            engine (GoBoard): board to think about, it is copied
+        """
+        with self.lock:
+            self.move = None
+            generation = self.generation
+        # a cancel from here on stops the search, even before it starts
+        self.search.resume()
+        position = engine.copy()
+        self.thread = threading.Thread(
+            target=self._think, args=[position, generation], daemon=True
+        )
+        self.thread.start()
+
+    def observe(self, move):
+        """Tell the bot about a move played on the board
+
+        Args:
+            move (int): position of the move, or PASS
+        """
+        with self.lock:
+            self.pending.append(move)
+
+    def _think(self, engine, generation):
+        """Search a move and store it unless it became stale
+
+        Args:
+            engine (GoBoard): board to search
+            generation (int): generation the search was started in
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for move in pending:
+            self.search.advance(move)
+        move = None
+        if self.book is not None:
+            move = self.book.suggest(engine)
+        if move is None:
+            move = self.search.search(engine)
+        with self.lock:
+            if generation == self.generation:
+                self.move = move
+
+    def poll(self):
+        """Get the move found by the bot
+
+        Returns:
+            int: position of the move, None if not found yet
+        """
+        with self.lock:
+            move, self.move = self.move, None
+        return move
+
+    def cancel(self):
+        """Stop thinking and forget the result, used when the position
+        changes under the bot
+        """
+        with self.lock:
+            self.generation += 1
+            self.move = None
+        self.search.stop()
+
+    def close(self):
+        """Stop thinking and release the search
+        """
+        self.cancel()
+        if self.thread is not None:
+            self.thread.join()
+        self.search.close()
+
+
+def new_bot(
+    color, playouts=None, seconds=2.0, workers=1, table_bytes=32 * 1024 * 1024, book=None
+):
+    """Create a bot playing a color
+
+    Args:
+        color (int): 1 for black, -1 for white
+        playouts (int, optional): number of playouts per move
+        seconds (float): time to think per move, used when playouts is not given
+        workers (int): number of processes searching in parallel
+        table_bytes (int): memory of the transposition table of each
+            process, 0 for none
+        book (OpeningBook, optional): opening moves played without searching
+
+    Returns:
+        BotPlayer: bot ready to think
+    """
+    if workers > 1:
+        search = ParallelMCTS(
+            workers=workers,
+            playouts=playouts,
+            seconds=seconds,
+            table_bytes=table_bytes,
+        )
+    else:
+        table = TranspositionTable(table_bytes) if table_bytes else None
+        search = MCTS(playouts=playouts, seconds=seconds, table=table)
+    return BotPlayer(search, color, book)
+
+
+if __name__ == "__main__":
+    board = GoBoard(9)
+    bot = MCTS(seconds=1.0)
+    passes = 0
+    while passes < 2:
+        move = bot.search(board)
+        board.play(move)
+        bot.advance(move)
+        passes = passes + 1 if move == PASS else 0
+        print(board.board, end="\n\n")
+    print("BLACK WON" if area_score(board) > 0 else "WHITE WON")
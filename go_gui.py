@@ -2,14 +2,25 @@
 GoGui objects contain a representation of the
 Chinese strategy board game Go.
 """
+import math
 import os
-import string
-from collections import deque, namedtuple
+import sys
+import time
+from collections import namedtuple
 
 import numpy as np
 import pygame
 from pygame import gfxdraw
 
+import assets
+from game_history import GameHistory
+from go_board import BLACK_STONE, MAX_SIZE, MIN_SIZE, PASS
+from go_bot import KOMI, new_bot
+from opening_book import OpeningBook
+from scoring import AREA, TERRITORY, OwnershipWorker, score_game
+from sgf import save_game
+from transposition import TranspositionTable
+
 BOARD_WIDTH = 612
 WIDTH = 740
 HEIGHT = int(WIDTH * 1.2)
@@ -21,6 +32,31 @@ BLACK = Color(0, 0, 0)
 GREY = Color(150, 150, 150)
 BLUE = Color(160, 180, 220)
 
+# Go coordinates skip the letter I
+COLUMNS = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+
+
+def star_points(size):
+    """Find the star points of a board
+
+    Args:
+        size (int): size of the board
+
+    Returns:
+        list: (row, col) of every star point
+    """
+    middle = size // 2
+    if size < 7:
+        return [(middle, middle)] if size % 2 else []
+    near = 2 if size < 12 else 3
+    far = size - 1 - near
+    points = [(row, col) for row in (near, far) for col in (near, far)]
+    if size % 2:
+        points.append((middle, middle))
+        if size >= 19:
+            points += [(near, middle), (far, middle), (middle, near), (middle, far)]
+    return points
+
 
 class GoGui:
     """Class representing the GUI of a Go board
@@ -39,237 +75,110 @@ class GoGui:
     but_width = 85
     but_height = 35
     but1_y = but0_y + but_height + 5
+    but2_y = but1_y + but_height + 5
+    # scrub bar to review earlier moves
+    bar_y = height - 18
+    bar_height = 8
+
+    # whether a computer opponent can be selected
+    has_bot = True
+    # most frames drawn per second, only reached while there is input
+    fps = 60
+    # milliseconds between checks on background work while idle
+    busy_wait = 100
+    # rules used to score the game, AREA or TERRITORY
+    scoring = AREA
+    komi = KOMI
+    # scores of scored positions, shared by every board
+    score_table = TranspositionTable(4 * 1024 * 1024)
+    # surfaces that only depend on the board size, keyed by size
+    board_surfaces = {}
+    stone_imgs = {}
+    # opening books are read from this folder, one file per board size
+    book_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+    books = {}
+    # processes the bot searches with, a single process keeps its tree
+    # between moves
+    bot_workers = 1
 
     def __init__(self, size):
+        if not MIN_SIZE <= size <= MAX_SIZE:
+            raise ValueError(f"board size must be between {MIN_SIZE} and {MAX_SIZE}")
         self.size = size
         self.spacing = self.board_width // (size - 1)
+        # the grid is narrower than the board when spacing is rounded down
+        self.grid_width = self.spacing * (size - 1)
         self.buffer = self.spacing // 2
         self.stone_width = self.spacing // 2 - 1
 
-        self.board = np.zeros((self.size, self.size), dtype=int)
-        # keeps track of the parent of each group
-        self.pointer = np.empty((self.size, self.size), dtype=int)
-        self.pointer.fill(-1)
-        self.white_groups = {}
-        self.black_groups = {}
-        self.newest_stone = None
-        self.states = deque()
+        # moves of the game with checkpoints, its engine holds the board
+        # shown and decides which moves are legal
+        self.history = GameHistory(size)
+        # histories of the games cleared from the board, brought back by undo
+        self.cleared = []
+        # move shown while reviewing the game, None shows the latest move
+        self.view_move = None
+        self.view_board = None
+        self.scrubbing = False
+        # computer opponent, None for hot-seat play
+        self.bot = None
 
         self.running = False
         self.display = None
         self.black_stone_img = None
         self.white_stone_img = None
+        self.black_ghost_img = None
+        self.white_ghost_img = None
         self.clock = None
         self.time_elapsed = 0
-        pygame.mixer.music.load(os.path.join(os.getcwd(), "assets", "sound", "tap.mp3"))
+        self.start_ticks = 0
+        # whether the board must be drawn again
+        self.dirty = True
+        # clocks of both players, None when the game is not timed
+        self.game_clock = None
 
-        # True for black, False for white
-        self.color = True
-        self.white_captured = 0
-        self.black_captured = 0
         self.white_score = 0
         self.black_score = 0
         self.show_ter = False
-        self.empty_groups = {}
         self.territory = None
-
-    def check_liberty(self, row, col):
-        """Checks the liberty of a stone
-
-        Args:
-            row (int): row of the stone
-            col (int): column of the stone
-
-        Returns:
-            bool: True if stone has liberty, False otherwise
-        """
-        # checking row above
-        if row != 0 and self.board[row - 1, col] == 0:
-            return True
-        # checking row below
-        if row != self.size - 1 and self.board[row + 1, col] == 0:
-            return True
-        # checking col to the left
-        if col != 0 and self.board[row, col - 1] == 0:
-            return True
-        # checking col to the right
-        if col != self.size - 1 and self.board[row, col + 1] == 0:
-            return True
-
-        return False
-
-    def check_board(self):
-        """Checks the entire board for any stones that should be removed
-        because they lack liberty
-        """
-        # checking white stones
-        white_to_del = []
-        check_again = None
-        for key, group in self.white_groups.items():
-            for pos in group:
-                if pos == self.newest_stone:
-                    # do not check newest placed stone yet
-                    check_again = key
-                    break
-                if self.check_liberty(pos // self.size, pos % self.size):
-                    break
-            else:
-                # if no stones in a group has liberty, remove entire group
-                white_to_del.append(key)
-                for pos in group:
-                    self.white_captured += 1
-                    row = pos // self.size
-                    col = pos % self.size
-                    self.board[row, col] = 0
-                    self.pointer[row, col] = 0
-
-        # remove group representation
-        for to_del in white_to_del:
-            del self.white_groups[to_del]
-
-        # checking black stones
-        black_to_del = []
-        for key, group in self.black_groups.items():
-            for pos in group:
-                if pos == self.newest_stone:
-                    # do not check newest placed stone yet
-                    check_again = key
-                    break
-                if self.check_liberty(pos // self.size, pos % self.size):
-                    break
-            else:
-                # if no stones in a group has liberty, remove entire group
-                black_to_del.append(key)
-                for pos in group:
-                    self.black_captured += 1
-                    row = pos // self.size
-                    col = pos % self.size
-                    self.board[row, col] = 0
-                    self.pointer[row, col] = 0
-
-        # remove group representation
-        for to_del in black_to_del:
-            del self.black_groups[to_del]
-
-        if check_again is not None:
-            # checking newest placed stone and removing it if necessary
-            if self.color:
-                for pos in self.black_groups[check_again]:
-                    if self.check_liberty(pos // self.size, pos % self.size):
-                        break
-                else:
-                    for pos in self.black_groups[check_again]:
-                        self.black_captured += 1
-                        row = pos // self.size
-                        col = pos % self.size
-                        self.board[row, col] = 0
-                        self.pointer[row, col] = 0
-                    del self.black_groups[check_again]
-            else:
-                for pos in self.white_groups[check_again]:
-                    if self.check_liberty(pos // self.size, pos % self.size):
-                        break
-                else:
-                    for pos in self.white_groups[check_again]:
-                        self.white_captured += 1
-                        row = pos // self.size
-                        col = pos % self.size
-                        self.board[row, col] = 0
-                        self.pointer[row, col] = 0
-                    del self.white_groups[check_again]
-
-    def add_group(self, row, col, color_num):
-        """Updating stones to form correct groups
-
-        Args:
-            row (int): row of the stone
-            col (int): column of the stone
-            color_num (int): 1 for black, -1 for white
-        """
-        group = self.black_groups if color_num == 1 else self.white_groups
-        setted = False
-
-        # checking whether stone above is of same color
-        if row != 0 and self.board[row - 1, col] == color_num:
-            parent = self.pointer[row - 1, col]
-            self.pointer[row, col] = parent
-            # adding stone to group of above stone
-            group[parent] = group[parent].union({row * self.size + col})
-            setted = True
-
-        # checking whether stone below is of same color
-        if row != self.size - 1 and self.board[row + 1, col] == color_num:
-            if setted:
-                # adding group of below stone to group newest stone belongs to
-                prev_parent = self.pointer[row + 1, col]
-                if prev_parent != parent:
-                    for pos in group[prev_parent]:
-                        self.pointer[pos // self.size, pos % self.size] = parent
-                    group[parent] = group[parent].union(group[prev_parent])
-                    del group[prev_parent]
-            else:
-                parent = self.pointer[row + 1, col]
-                self.pointer[row, col] = parent
-                # adding stone to group of below stone
-                group[parent] = group[parent].union({row * self.size + col})
-                setted = True
-
-        # checking whether left stone is of same color
-        if col != 0 and self.board[row, col - 1] == color_num:
-            if setted:
-                # adding left group to group newest stone belongs to
-                prev_parent = self.pointer[row, col - 1]
-                if prev_parent != parent:
-                    for pos in group[prev_parent]:
-                        self.pointer[pos // self.size, pos % self.size] = parent
-                    group[parent] = group[parent].union(group[prev_parent])
-                    del group[prev_parent]
-            else:
-                parent = self.pointer[row, col - 1]
-                self.pointer[row, col] = parent
-                # adding stone to left group
-                group[parent] = group[parent].union({row * self.size + col})
-                setted = True
-
-        # checking whether right stone is of same color
-        if col != self.size - 1 and self.board[row, col + 1] == color_num:
-            if setted:
-                # adding right group to group newest stone belongs to
-                prev_parent = self.pointer[row, col + 1]
-                if prev_parent != parent:
-                    for pos in group[prev_parent]:
-                        self.pointer[pos // self.size, pos % self.size] = parent
-                    group[parent] = group[parent].union(group[prev_parent])
-                    del group[prev_parent]
-            else:
-                parent = self.pointer[row, col + 1]
-                self.pointer[row, col] = parent
-                # adding stone to right group
-                group[parent] = group[parent].union({row * self.size + col})
-                setted = True
-
-        # create new group of stone if there are no adjacent same color stones
-        if not setted:
-            parent = row * self.size + col
-            self.pointer[row, col] = parent
-            group[parent] = {parent}
-
-    def check_ko(self):
-        """Checking whether newest move violates Ko rule
-
-        Returns:
-            bool: True if violated, False otherwise
-        """
-        if len(self.states) > 2:
-            _ = self.states.pop()
-            board_2, pointer_2, white_2, black_2, w_cap_2, b_cap_2 = self.states.pop()
-
-            self.states.append((board_2, pointer_2, white_2, black_2, w_cap_2, b_cap_2))
-            self.states.append(_)
-
-            return (board_2 == self.board).all()
-        else:
-            return False
+        # ownership heatmap, estimated on a background thread when shown
+        self.show_heatmap = False
+        self.heatmap_worker = None
+        self.heatmap_key = None
+        self.heatmap_version = None
+        self.heatmap_img = None
+        # (position key, move) suggested by the opening book
+        self.suggestion = None
+
+    @property
+    def engine(self):
+        """GoBoard: rules engine at the latest move"""
+        return self.history.engine
+
+    @property
+    def human_turn(self):
+        """bool: True if the player at the board is to move"""
+        return self.bot is None or self.bot.color != self.engine.to_play
+
+    @property
+    def board(self):
+        """np.ndarray: stones at the latest move, 1 for black, -1 for white"""
+        return self.engine.board
+
+    @property
+    def color(self):
+        """bool: True if black is to move, False for white"""
+        return self.engine.to_play == BLACK_STONE
+
+    @property
+    def white_captured(self):
+        """int: white stones captured so far"""
+        return self.engine.white_captured
+
+    @property
+    def black_captured(self):
+        """int: black stones captured so far"""
+        return self.engine.black_captured
 
     def fill_stone(self, pos):
         """Fill stone in position according to mouse click
@@ -279,63 +188,23 @@ class GoGui:
         """
         if (
             pos[0] > self.hor_pad - self.buffer
-            and pos[0] < self.width - self.hor_pad + self.buffer
+            and pos[0] < self.hor_pad + self.grid_width + self.buffer
             and pos[1] > self.top_pad + self.bot_pad - self.buffer
-            and pos[1] < self.height - self.bot_pad + self.buffer
+            and pos[1] < self.top_pad + self.bot_pad + self.grid_width + self.buffer
         ):
             # getting row and col from x and y positino
             row = round((pos[1] - self.top_pad - self.bot_pad) / self.spacing)
             col = round((pos[0] - self.hor_pad) / self.spacing)
-            if self.board[row, col] == 0:
-                # if board position is unfilled
-                # save state of game
-                self.states.append(
-                    (
-                        self.board.copy(),
-                        self.pointer.copy(),
-                        self.white_groups.copy(),
-                        self.black_groups.copy(),
-                        self.white_captured,
-                        self.black_captured,
-                    )
-                )
-
-                # updating board
-                color_num = 1 if self.color else -1
-                if self.color:
-                    self.board[row, col] = color_num
-                else:
-                    self.board[row, col] = color_num
-
-                self.newest_stone = row * self.size + col
-
-                # adding to group
-                self.add_group(row, col, color_num)
-                # remove captured stones
-                self.check_board()
-
-                # checking for Ko, prevent illegal move
-                if self.check_ko() or self.board[row, col] == 0:
-                    # violated Ko, move prevented
-                    (
-                        self.board,
-                        self.pointer,
-                        self.white_groups,
-                        self.black_groups,
-                        self.white_captured,
-                        self.black_captured,
-                    ) = self.states.pop()
-                else:
-                    pygame.mixer.music.play()
-                    # did not violate Ko, move on
-                    self.color = not self.color
+            if self.human_turn:
+                self.place_stone(row * self.size + col)
         elif (
             pos[0] > self.but_x
             and pos[0] < self.but_x + self.but_width
             and pos[1] > self.but0_y
             and pos[1] < self.but0_y + self.but_height
         ):
-            self.pass_turn()
+            if self.human_turn:
+                self.pass_turn()
         elif (
             pos[0] > self.but_x
             and pos[0] < self.but_x + self.but_width
@@ -343,54 +212,206 @@ class GoGui:
             and pos[1] < self.but1_y + self.but_height
         ):
             self.clear_board()
+        elif (
+            pos[0] > self.but_x
+            and pos[0] < self.but_x + self.but_width
+            and pos[1] > self.but2_y
+            and pos[1] < self.but2_y + self.but_height
+        ):
+            self.toggle_bot()
+
+    def place_stone(self, move):
+        """Place a stone for the side to move if the move is legal
+
+        Args:
+            move (int): position of the stone, row * size + col
+
+        Returns:
+            bool: True if the stone was placed
+        """
+        if not self.engine.is_legal(move):
+            # move is either occupied, suicide or a Ko violation
+            return False
+
+        # the engine removes captured stones
+        self.history.play(move)
+        self.notify_bot(move)
+
+        assets.play_tap()
+        return True
+
+    def notify_bot(self, move):
+        """Tell the bot about a move played, a search or result for the
+        position before it is dropped
+
+        Args:
+            move (int): position of the move, or PASS
+        """
+        if self.bot is not None:
+            self.bot.cancel()
+            self.bot.observe(move)
+
+    def toggle_bot(self):
+        """Turn the computer opponent on or off, the bot plays the
+        color that is not to move
+        """
+        if self.bot is None:
+            self.bot = new_bot(
+                -self.engine.to_play, workers=self.bot_workers, book=self.opening_book()
+            )
+        else:
+            self.bot.close()
+            self.bot = None
+
+    def update_bot(self):
+        """Start the bot when it is its turn and play its move once found
+        """
+        if self.bot is None or self.bot.color != self.engine.to_play:
+            return
+        move = self.bot.poll()
+        if move is not None:
+            self.dirty = True
+            if move == PASS:
+                self.pass_turn()
+            else:
+                self.place_stone(move)
+        elif not self.bot.thinking:
+            self.bot.start(self.engine)
 
     def pass_turn(self):
         """Pass turn to opponent
         """
-        # save state of game
-        self.states.append(
-            (
-                self.board.copy(),
-                self.pointer.copy(),
-                self.white_groups.copy(),
-                self.black_groups.copy(),
-                self.white_captured,
-                self.black_captured,
-            )
-        )
-        self.color = not self.color
+        self.history.play(PASS)
+        self.notify_bot(PASS)
 
     def clear_board(self):
         """Clears the entire board
         """
-        self.states.append(
-            (
-                self.board.copy(),
-                self.pointer.copy(),
-                self.white_groups.copy(),
-                self.black_groups.copy(),
-                self.white_captured,
-                self.black_captured,
-            )
+        # kept so clearing the board can be undone
+        self.cleared.append(self.history)
+        self.history = GameHistory(self.size)
+        self.set_view(None)
+        if self.bot is not None:
+            self.bot.cancel()
+
+    def undo(self):
+        """Take back the last move
+        """
+        if len(self.history):
+            # the engine takes the move back with its deltas
+            self.history.truncate(len(self.history) - 1)
+        elif self.cleared:
+            # the board was cleared, bringing the game back
+            self.history = self.cleared.pop()
+        else:
+            return
+
+        if self.bot is not None:
+            self.bot.cancel()
+        self.set_view(None)
+
+    def save_sgf(self):
+        """Save the moves played so far as an SGF file
+
+        Returns:
+            str: path of the saved file
+        """
+        folder = os.path.join(os.getcwd(), "games")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, time.strftime("%Y%m%d-%H%M%S") + ".sgf")
+        save_game(self.history.to_record(), path)
+        print(f"Game saved to {path}")
+        return path
+
+    def set_view(self, move):
+        """Show the board after a number of moves
+
+        Args:
+            move (int): number of moves played, None for the latest move
+        """
+        if move is None or move >= len(self.history):
+            self.view_move = None
+            self.view_board = None
+        else:
+            self.view_move = max(0, move)
+            self.view_board = self.history.board_at(self.view_move)
+
+    def on_scrub_bar(self, pos):
+        """Checks whether a mouse position is on the scrub bar
+
+        Args:
+            pos (tuple): pos[0] is x position, pos[1] is y position
+
+        Returns:
+            bool: True if on the scrub bar
+        """
+        return (
+            self.hor_pad <= pos[0] <= self.hor_pad + self.grid_width
+            and self.bar_y - self.bar_height <= pos[1] <= self.bar_y + self.bar_height * 2
         )
-        self.board = np.zeros((self.size, self.size), dtype=int)
-        # keeps track of the parent of each group
-        self.pointer = np.empty((self.size, self.size), dtype=int)
-        self.pointer.fill(-1)
-        self.white_groups = {}
-        self.black_groups = {}
-        self.white_captured = 0
-        self.black_captured = 0
-        self.color = True
+
+    def scrub(self, x_pos):
+        """Show the move under a position of the scrub bar
+
+        Args:
+            x_pos (int): x position of the mouse
+        """
+        length = self.grid_width
+        fraction = min(max((x_pos - self.hor_pad) / length, 0), 1)
+        self.set_view(round(fraction * len(self.history)))
+
+    def handle_review(self, event):
+        """Handle the mouse and keys used to review earlier moves
+
+        Args:
+            event (pygame event): event to handle
+
+        Returns:
+            bool: True if the event was used for reviewing
+        """
+        if event.type == pygame.MOUSEBUTTONDOWN and self.on_scrub_bar(event.pos):
+            self.scrubbing = True
+            self.scrub(event.pos[0])
+            return True
+        if event.type == pygame.MOUSEMOTION and self.scrubbing:
+            self.scrub(event.pos[0])
+            return True
+        if event.type == pygame.MOUSEBUTTONUP and self.scrubbing:
+            self.scrubbing = False
+            return True
+        if event.type == pygame.KEYDOWN and event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+            current = len(self.history) if self.view_move is None else self.view_move
+            step = -1 if event.key == pygame.K_LEFT else 1
+            self.set_view(current + step)
+            return True
+        if event.type == pygame.MOUSEBUTTONDOWN and self.view_move is not None:
+            # clicking anywhere else goes back to the latest move
+            self.set_view(None)
+            return True
+        return False
+
+    def hovered_move(self):
+        """Get the intersection the mouse is over
+
+        Returns:
+            int: position of the intersection, None if not over the board
+        """
+        pos = pygame.mouse.get_pos()
+        row = round((pos[1] - self.top_pad - self.bot_pad) / self.spacing)
+        col = round((pos[0] - self.hor_pad) / self.spacing)
+        if 0 <= row < self.size and 0 <= col < self.size:
+            return row * self.size + col
+        return None
 
     def update_stones(self):
         """Update the stones on GUI
         """
         top_bot_padding = self.top_pad + self.bot_pad
+        board = self.board if self.view_board is None else self.view_board
 
         for row in range(self.size):
             for col in range(self.size):
-                if self.board[row, col] == 1:
+                if board[row, col] == 1:
                     gfxdraw.aacircle(
                         self.display,
                         self.hor_pad + col * self.spacing,
@@ -405,7 +426,7 @@ class GoGui:
                         self.stone_width,
                         BLACK,
                     )
-                elif self.board[row, col] == -1:
+                elif board[row, col] == -1:
                     gfxdraw.aacircle(
                         self.display,
                         self.hor_pad + col * self.spacing,
@@ -426,8 +447,8 @@ class GoGui:
         """
         thin_line = 1
         top_bot_padding = self.top_pad + self.bot_pad
-        end_x = self.width - self.hor_pad
-        end_y = self.height - self.bot_pad
+        end_x = self.hor_pad + self.grid_width
+        end_y = top_bot_padding + self.grid_width
 
         for i in range(self.size):
             # horizontal lines
@@ -452,34 +473,18 @@ class GoGui:
         """
         top_bot_padding = self.top_pad + self.bot_pad
 
-        for i in range(3, self.size, 6):
-            for j in range(3, self.size, 6):
-                gfxdraw.aacircle(
-                    self.display,
-                    self.hor_pad + j * self.spacing,
-                    top_bot_padding + i * self.spacing,
-                    3,
-                    BLACK,
-                )
-                gfxdraw.filled_circle(
-                    self.display,
-                    self.hor_pad + j * self.spacing,
-                    top_bot_padding + i * self.spacing,
-                    3,
-                    BLACK,
-                )
-        if self.size == 13:
+        for row, col in star_points(self.size):
             gfxdraw.aacircle(
                 self.display,
-                self.hor_pad + 6 * self.spacing,
-                top_bot_padding + 6 * self.spacing,
+                self.hor_pad + col * self.spacing,
+                top_bot_padding + row * self.spacing,
                 3,
                 BLACK,
             )
             gfxdraw.filled_circle(
                 self.display,
-                self.hor_pad + 6 * self.spacing,
-                top_bot_padding + 6 * self.spacing,
+                self.hor_pad + col * self.spacing,
+                top_bot_padding + row * self.spacing,
                 3,
                 BLACK,
             )
@@ -488,34 +493,36 @@ class GoGui:
         """Drawing the numbers on the side of the board
         """
         font = pygame.font.SysFont("calibri", 20)
-        upper_case = string.ascii_uppercase
+        bottom = self.top_pad + self.bot_pad + self.grid_width
+        # small boards have wide spacing, keep the labels near the grid
+        gap = min(self.buffer, 17)
 
         for i in range(self.size):
             num = font.render(str(i + 1), True, BLACK)
-            letter = font.render(upper_case[i], True, BLACK)
+            letter = font.render(COLUMNS[i], True, BLACK)
             increment = i * self.spacing
             letter_x = self.hor_pad + increment - letter.get_width() // 2
-            height = self.height - self.bot_pad - num.get_height() // 2 - increment
+            height = bottom - num.get_height() // 2 - increment
 
             # drawing nums on left side
             self.display.blit(
-                num, (self.hor_pad - self.buffer - num.get_width(), height),
+                num, (self.hor_pad - gap - num.get_width(), height),
             )
             # drawing nums on right side
             self.display.blit(
-                num, (self.width - self.hor_pad + self.buffer, height),
+                num, (self.hor_pad + self.grid_width + gap, height),
             )
             # drawing letters on top
             self.display.blit(
                 letter,
                 (
                     letter_x,
-                    self.top_pad + self.bot_pad - self.buffer - letter.get_height(),
+                    self.top_pad + self.bot_pad - gap - letter.get_height(),
                 ),
             )
             # drawing letters on bottom
             self.display.blit(
-                letter, (letter_x, self.height - self.bot_pad + self.buffer,),
+                letter, (letter_x, bottom + gap,),
             )
 
     def draw_captured(self, font):
@@ -584,6 +591,28 @@ class GoGui:
         text = font.render(color, True, BLACK)
         self.display.blit(text, (self.width // 2 - text.get_width() // 2, 15))
 
+    def draw_clocks(self, font):
+        """Drawing the time left of both players
+
+        Args:
+            font (pygame font): font to use to draw
+        """
+        if self.game_clock is None:
+            return
+        now = time.monotonic()
+        for i, (name, color) in enumerate((("BLACK", 1), ("WHITE", -1))):
+            main, periods, period = self.game_clock.remaining(color, now)
+            if main > 0 or not periods:
+                seconds = math.ceil(main)
+                left = f"{seconds // 60:02}:{seconds % 60:02}"
+            else:
+                # byo-yomi, seconds of the period and periods left
+                left = f"{math.ceil(period)}s ({periods})"
+            text = font.render(f"{name} {left}", True, BLACK)
+            self.display.blit(
+                text, (self.width // 2 - text.get_width() // 2, 55 + i * 40)
+            )
+
     def draw_buttons(self):
         """Drawing the buttons
         """
@@ -593,6 +622,11 @@ class GoGui:
         self.display.fill(
             BLUE, pygame.Rect(self.but_x, self.but1_y, self.but_width, self.but_height)
         )
+        if self.has_bot:
+            self.display.fill(
+                BLUE,
+                pygame.Rect(self.but_x, self.but2_y, self.but_width, self.but_height),
+            )
 
         font = pygame.font.SysFont("timesnewroman", 22)
         text = font.render("PASS", True, BLACK)
@@ -603,6 +637,26 @@ class GoGui:
         self.display.blit(
             text, (20, self.but1_y + (self.but_height - text.get_height()) // 2,),
         )
+        if self.has_bot:
+            text = font.render("BOT" if self.bot is None else "HUMAN", True, BLACK)
+            self.display.blit(
+                text, (20, self.but2_y + (self.but_height - text.get_height()) // 2,),
+            )
+
+    def draw_scrub_bar(self):
+        """Drawing the bar used to review earlier moves
+        """
+        length = self.grid_width
+        self.display.fill(
+            GREY, pygame.Rect(self.hor_pad, self.bar_y, length, self.bar_height)
+        )
+        moves = len(self.history)
+        shown = moves if self.view_move is None else self.view_move
+        knob_x = self.hor_pad + (length * shown // moves if moves else length)
+        self.display.fill(
+            BLACK,
+            pygame.Rect(knob_x - 3, self.bar_y - 4, 6, self.bar_height + 8),
+        )
 
     def draw_territory(self):
         """Drawing the territory of both colors
@@ -632,24 +686,99 @@ class GoGui:
                         ),
                     )
 
+    def toggle_heatmap(self):
+        """Show or hide the ownership heatmap
+        """
+        self.show_heatmap = not self.show_heatmap
+        if self.heatmap_worker is None:
+            self.heatmap_worker = OwnershipWorker()
+
+    def draw_heatmap(self):
+        """Drawing who owns every point, the estimate is refined in the
+        background and drawn as one translucent surface
+        """
+        key = self.engine.key()
+        if key != self.heatmap_key:
+            self.heatmap_key = key
+            self.heatmap_worker.request(self.engine)
+        owned, version = self.heatmap_worker.result()
+        if owned is None or owned.shape != (self.size, self.size):
+            return
+        if version != self.heatmap_version:
+            # one pixel per point, scaled up to one square per point
+            self.heatmap_version = version
+            rgba = np.zeros((self.size, self.size, 4), dtype=np.uint8)
+            rgba[..., :3] = np.where(owned[..., None] > 0, BLACK, WHITE)
+            rgba[..., 3] = (np.abs(owned) * 150).astype(np.uint8)
+            img = pygame.image.frombuffer(rgba.tobytes(), (self.size, self.size), "RGBA")
+            side = self.size * self.spacing
+            self.heatmap_img = pygame.transform.scale(img, (side, side))
+        self.display.blit(
+            self.heatmap_img,
+            (
+                self.hor_pad - self.spacing // 2,
+                self.top_pad + self.bot_pad - self.spacing // 2,
+            ),
+        )
+
+    def opening_book(self):
+        """Get the opening book of the board size, read once
+
+        Returns:
+            OpeningBook: the book, None if there is none for this size
+        """
+        if self.size not in self.books:
+            path = os.path.join(self.book_dir, f"book{self.size}.npz")
+            self.books[self.size] = OpeningBook.load(path) if os.path.exists(path) else None
+        return self.books[self.size]
+
+    def suggest(self):
+        """Suggest the most played move of the opening book
+        """
+        book = self.opening_book()
+        move = book.suggest(self.engine) if book is not None else None
+        self.suggestion = (self.engine.key(), move)
+        if move is None:
+            print("Position not in the opening book")
+        elif move == PASS:
+            print("Opening book suggests passing")
+
+    def draw_suggestion(self):
+        """Drawing a ring on the suggested move while it is still the
+        position it was suggested for
+        """
+        key, move = self.suggestion
+        if move is None or move == PASS or key != self.engine.key():
+            return
+        row, col = divmod(move, self.size)
+        for width in range(3):
+            gfxdraw.aacircle(
+                self.display,
+                self.hor_pad + col * self.spacing,
+                self.top_pad + self.bot_pad + row * self.spacing,
+                self.stone_width - width,
+                BLUE,
+            )
+
     def update_gui(self):
         """Update Go board GUI
         """
         self.display.fill(GREY, pygame.Rect(0, 0, self.width, self.top_pad))
-        self.display.fill(YELLOW, pygame.Rect(0, self.top_pad, self.width, self.width))
-
-        # drawing grid
-        self.draw_lines()
 
-        # drawing dots
-        self.draw_dots()
+        # drawing grid, dots and nums on the sides of board
+        self.display.blit(self.board_surface(), (0, self.top_pad))
 
         font = pygame.font.SysFont("timesnewroman", 30)
         # drawing stones
         self.update_stones()
 
-        # drawing nums on the sides of board
-        self.draw_nums()
+        # drawing who owns every point
+        if self.show_heatmap and self.view_board is None:
+            self.draw_heatmap()
+
+        # drawing the move suggested by the opening book
+        if self.suggestion is not None and self.view_board is None:
+            self.draw_suggestion()
 
         # indicate the time elapsed since the game has started
         text = font.render(
@@ -667,169 +796,212 @@ class GoGui:
         # whose turn it is
         self.draw_turn(font)
 
+        # time left of both players
+        self.draw_clocks(font)
+
         # drawing stones captured
         self.draw_captured(font)
 
         # drawing pass button
         self.draw_buttons()
 
+        # drawing bar to review earlier moves
+        self.draw_scrub_bar()
+
         if self.show_ter:
             self.draw_territory()
 
         mouse_x = pygame.mouse.get_pos()[0] - self.stone_width
         mouse_y = pygame.mouse.get_pos()[1] - self.stone_width
         if pygame.mouse.get_focused():
+            # faded stone when hovering over an illegal move
+            move = self.hovered_move()
+            legal = move is None or self.engine.is_legal(move)
             if self.color:
-                self.display.blit(self.black_stone_img, (mouse_x, mouse_y))
+                img = self.black_stone_img if legal else self.black_ghost_img
             else:
-                self.display.blit(self.white_stone_img, (mouse_x, mouse_y))
+                img = self.white_stone_img if legal else self.white_ghost_img
+            self.display.blit(img, (mouse_x, mouse_y))
 
-    def check_zero_liberty(self, row, col):
-        """Checks the liberty of a stone
+    def score(self):
+        """Score the game, dead stones are estimated with playouts
+        """
+        # the result only depends on the position, rules and captures
+        key = (
+            self.engine.hash,
+            self.scoring,
+            self.komi,
+            self.white_captured,
+            self.black_captured,
+        )
+        entry = self.score_table.get(key)
+        if entry is not None and entry.score is not None:
+            self.black_score, self.white_score, territory, _ = entry.score
+        else:
+            result = score_game(
+                self.engine,
+                self.scoring,
+                self.komi,
+                self.white_captured,
+                self.black_captured,
+            )
+            self.black_score = result["black"]
+            self.white_score = result["white"]
+            territory = result["territory"]
+            self.score_table.store_score(
+                key,
+                (self.black_score, self.white_score, territory, tuple(result["dead"])),
+            )
+        self.territory = territory.copy()
 
-        Args:
-            row (int): row of the stone
-            col (int): column of the stone
+        print(
+            f"{self.scoring.upper()} SCORING, "
+            f"BLACK SCORE: {self.black_score}, WHITE SCORE: {self.white_score}"
+        )
+        if self.black_score > self.white_score:
+            print("BLACK WON")
+        elif self.white_score > self.black_score:
+            print("WHITE WON")
+        else:
+            print("TIE")
+
+    def board_surface(self):
+        """Get the empty board with its grid, dots and nums, it is only
+        drawn once for each size
 
         Returns:
-            bool: True if stone has liberty, False otherwise
-        """
-        surrounded_by = set()
-        # checking row above
-        if row != 0 and self.board[row - 1, col] == 1:
-            surrounded_by.add(1)
-        elif row != 0 and self.board[row - 1, col] == -1:
-            surrounded_by.add(-1)
-        # checking row below
-        if row != self.size - 1 and self.board[row + 1, col] == 1:
-            surrounded_by.add(1)
-        elif row != self.size - 1 and self.board[row + 1, col] == -1:
-            surrounded_by.add(-1)
-        # checking col to the left
-        if col != 0 and self.board[row, col - 1] == 1:
-            surrounded_by.add(1)
-        elif col != 0 and self.board[row, col - 1] == -1:
-            surrounded_by.add(-1)
-        # checking col to the right
-        if col != self.size - 1 and self.board[row, col + 1] == 1:
-            surrounded_by.add(1)
-        elif col != self.size - 1 and self.board[row, col + 1] == -1:
-            surrounded_by.add(-1)
-
-        return surrounded_by
-
-    def check_territory(self):
-        """Checking whether each group of empty intersections is part of
-        a color's territory
-        """
-        for group in self.empty_groups.values():
-            surrounded_by = set()
-            for pos in group:
-                new = self.check_zero_liberty(pos // self.size, pos % self.size)
-                surrounded_by = surrounded_by.union(new)
-                if len(surrounded_by) >= 2:
-                    break
-            else:
-                try:
-                    color = surrounded_by.pop()
-                    for pos in group:
-                        self.territory[pos // self.size, pos % self.size] = color
-                    if color == 1:
-                        self.black_score += len(group)
-                    else:
-                        self.white_score += len(group)
-                except KeyError:
-                    pass
-
-    def group_empty(self, row, col):
-        """Group all empty intersections
+            pygame.Surface: board below the top area
+        """
+        surface = self.board_surfaces.get(self.size)
+        if surface is None:
+            surface = pygame.Surface((self.width, self.height)).convert()
+            surface.fill(YELLOW)
+            # drawing on the surface with the usual window coordinates
+            display, self.display = self.display, surface
+            self.draw_lines()
+            self.draw_dots()
+            self.draw_nums()
+            self.display = display
+            surface = surface.subsurface(
+                pygame.Rect(0, self.top_pad, self.width, self.height - self.top_pad)
+            )
+            self.board_surfaces[self.size] = surface
+        return surface
 
-        Args:
-            row (int): row of target intersection
-            col (int): column of target intersection
-        """
-        group = self.empty_groups
-        setted = False
-
-        # checking whether stone above is of same color
-        if row != 0 and self.board[row - 1, col] == 0:
-            parent = self.pointer[row - 1, col]
-            self.pointer[row, col] = parent
-            # adding stone to group of above stone
-            group[parent] = group[parent].union({row * self.size + col})
-            setted = True
-
-        # checking whether left stone is of same color
-        if col != 0 and self.board[row, col - 1] == 0:
-            if setted:
-                # adding left group to group newest stone belongs to
-                prev_parent = self.pointer[row, col - 1]
-                if prev_parent != parent:
-                    for pos in group[prev_parent]:
-                        self.pointer[pos // self.size, pos % self.size] = parent
-                    group[parent] = group[parent].union(group[prev_parent])
-                    del group[prev_parent]
-            else:
-                parent = self.pointer[row, col - 1]
-                self.pointer[row, col] = parent
-                # adding stone to left group
-                group[parent] = group[parent].union({row * self.size + col})
-                setted = True
-
-        # create new group of stone if there are no adjacent same color stones
-        if not setted:
-            parent = row * self.size + col
-            self.pointer[row, col] = parent
-            group[parent] = {parent}
+    def load_stone_imgs(self):
+        """Load the stone images scaled to the board size, with faded
+        copies for illegal moves
+        """
+        imgs = self.stone_imgs.get(self.size)
+        if imgs is None:
+            diameter = self.stone_width * 2 + 1
+            imgs = []
+            for name in ("black_stone.png", "white_stone.png"):
+                img = pygame.transform.smoothscale(assets.image(name), (diameter, diameter))
+                ghost = img.copy()
+                ghost.set_alpha(90)
+                imgs += [img, ghost]
+            self.stone_imgs[self.size] = imgs
+        (
+            self.black_stone_img,
+            self.black_ghost_img,
+            self.white_stone_img,
+            self.white_ghost_img,
+        ) = imgs
+
+    def busy(self):
+        """Checks whether background work may change the board
 
-    def score(self):
-        """Score the game
+        Returns:
+            bool: True while the bot thinks or the heatmap is refined
         """
-        self.empty_groups = {}
-        self.territory = np.zeros((self.size, self.size), dtype=int)
+        if self.bot is not None and self.bot.thinking:
+            return True
+        return self.show_heatmap and self.heatmap_worker.busy
 
-        self.black_score = self.white_captured
-        self.white_score = self.black_captured
+    def next_redraw(self):
+        """Get the time until a timer shown on the board changes
 
-        for row in range(self.size):
-            for col in range(self.size):
-                if self.board[row, col] == 0:
-                    self.group_empty(row, col)
+        Returns:
+            int: milliseconds until the next change
+        """
+        ticks = pygame.time.get_ticks() - self.start_ticks
+        wait = 1000 - ticks % 1000
+        clock = self.game_clock
+        if clock is not None and clock.turn_start is not None:
+            main, periods, period = clock.remaining(clock.to_play, time.monotonic())
+            left = main if main > 0 or not periods else period
+            wait = min(wait, int(left % 1 * 1000) + 1)
+        return wait
+
+    def next_events(self):
+        """Wait for the next events, the loop sleeps while nothing
+        happens and runs at most fps frames per second otherwise
 
-        self.check_territory()
+        Returns:
+            list: events to handle, empty if woken up by a timer
+        """
+        self.clock.tick(self.fps)
+        events = pygame.event.get()
+        if events or self.dirty:
+            return events
+        redraw = self.next_redraw()
+        timeout = min(redraw, self.busy_wait) if self.busy() else redraw
+        event = pygame.event.wait(max(timeout, 1))
+        if event.type != pygame.NOEVENT:
+            return [event] + pygame.event.get()
+        if timeout == redraw:
+            # a timer shown on the board changed
+            self.dirty = True
+        return []
+
+    def check_redraw(self, events):
+        """Decide whether the board must be drawn again
 
-        print(f"BLACK SCORE: {self.black_score}, WHITE SCORE: {self.white_score}")
-        if self.black_score > self.white_score:
-            print("BLACK WON")
-        elif self.white_score > self.black_score:
-            print("WHITE WON")
-        else:
-            print("TIE")
+        Args:
+            events (list): events handled this frame
+        """
+        if events:
+            self.dirty = True
+        if self.show_heatmap and self.heatmap_worker.result()[1] != self.heatmap_version:
+            self.dirty = True
+
+    def draw_frame(self):
+        """Draw the board if anything changed since the last frame
+        """
+        if self.dirty:
+            self.dirty = False
+            self.update_gui()
+            pygame.display.update()
 
     def start_game(self):
         """Start game of Go
         """
         self.running = True
         self.display = pygame.display.set_mode((self.width, self.height))
-        self.black_stone_img = pygame.image.load(
-            os.path.join(os.getcwd(), "assets", "img", "black_stone.png")
-        ).convert_alpha()
-        self.white_stone_img = pygame.image.load(
-            os.path.join(os.getcwd(), "assets", "img", "white_stone.png")
-        ).convert_alpha()
+        self.load_stone_imgs()
+        # decoding the placement sound before the first move
+        assets.sound("tap.mp3")
         self.clock = pygame.time.Clock()
         pygame.mouse.set_visible(False)
         pygame.display.set_caption("GO")
-        start_time = pygame.time.get_ticks()
+        self.start_ticks = pygame.time.get_ticks()
 
         # main loop of Go
         while self.running:
-            self.time_elapsed = int((pygame.time.get_ticks() - start_time) / 1000)
+            events = self.next_events()
+            self.time_elapsed = int((pygame.time.get_ticks() - self.start_ticks) / 1000)
 
-            for event in pygame.event.get():
+            for event in events:
+                if self.handle_review(event):
+                    continue
                 # enable closing of display
                 if event.type == pygame.QUIT:
                     self.running = False
+                    if self.bot is not None:
+                        self.bot.close()
+                    if self.heatmap_worker is not None:
+                        self.heatmap_worker.close()
                     self.score()
                     return
                 # getting position of mouse
@@ -839,36 +1011,40 @@ class GoGui:
                     self.fill_stone(mouse_pos)
                 if event.type == pygame.KEYDOWN:
                     keys = pygame.key.get_pressed()
-                    if keys[pygame.K_p]:
+                    if keys[pygame.K_p] and self.human_turn:
                         self.pass_turn()
                     if keys[pygame.K_LCTRL] and keys[pygame.K_z]:
                         self.show_ter = False
-                        try:
-                            (
-                                self.board,
-                                self.pointer,
-                                self.white_groups,
-                                self.black_groups,
-                                self.white_captured,
-                                self.black_captured,
-                            ) = self.states.pop()
-                            self.color = not self.color
-                        except IndexError:
-                            pass
+                        self.undo()
                     if keys[pygame.K_LSHIFT] and keys[pygame.K_c]:
                         self.clear_board()
+                    if keys[pygame.K_LCTRL] and keys[pygame.K_s]:
+                        self.save_sgf()
                     if keys[pygame.K_SPACE]:
                         self.show_ter = True
                         self.score()
+                    if keys[pygame.K_h]:
+                        self.toggle_heatmap()
+                    if keys[pygame.K_g]:
+                        self.suggest()
+                    if keys[pygame.K_t]:
+                        # switching between area and territory scoring
+                        self.scoring = TERRITORY if self.scoring == AREA else AREA
+                        if self.show_ter:
+                            self.score()
 
-            self.clock.tick(60)
-            self.update_gui()
-            pygame.display.update()
+            # bot thinks on its own thread, this only checks on it
+            self.update_bot()
+
+            self.check_redraw(events)
+            self.draw_frame()
 
 
 if __name__ == "__main__":
     pygame.mixer.init(22050, -16, 2, 64)
     pygame.init()
-    go_gui = GoGui(19)
+    go_gui = GoGui(int(sys.argv[1]) if len(sys.argv) > 1 else 19)
+    if len(sys.argv) > 2:
+        go_gui.bot_workers = int(sys.argv[2])
     go_gui.start_game()
     pygame.quit()
@@ -2,12 +2,14 @@
 GoGuiOnline objects contain a representation of the
 Chinese strategy board game Go and is played online.
 """
-import os
-import pickle
-from collections import namedtuple
+import time
+from collections import deque, namedtuple
 
 import pygame
 
+import assets
+from game_clock import GameClock
+from go_board import BLACK_STONE, PASS, WHITE_STONE
 from go_gui import GoGui
 
 Color = namedtuple("Color", ["r", "g", "b"])
@@ -15,6 +17,9 @@ BLACK = Color(0, 0, 0)
 GREY = Color(150, 150, 150)
 BLUE = Color(160, 180, 220)
 
+# posted by the network thread so the game loop wakes up for replies
+NETWORK_EVENT = pygame.event.custom_type()
+
 
 class GoGuiOnline(GoGui):
     """Class representing GUI for Go online
@@ -23,11 +28,11 @@ class GoGuiOnline(GoGui):
         GoGui: Base class for GUI of Go
     """
 
-    def __init__(self, conn, size, player):
+    has_bot = False
+
+    def __init__(self, channel, size, player):
         super().__init__(size)
         self.player = player
-        self.conn = conn
-        self.color = self.player == 0
         if self.color:
             self.my_color = "BLACK"
             self.op_color = "WHITE"
@@ -36,6 +41,27 @@ class GoGuiOnline(GoGui):
             self.op_color = "BLACK"
         self.my_turn = False
         self.started = False
+        # requests are answered on a background thread, on the channel
+        # of this game
+        self.network = channel
+        channel.notify = self.notify_network
+        # POST requests queued, replies sent before the latest one are stale
+        self.posts = 0
+        # moves shown before the server accepted them, as
+        # (sequence number, moves before it)
+        self.pending = deque()
+        self.seq = 0
+        # boards received from the server, keyed by number of moves,
+        # None while asked for
+        self.positions = {}
+        # moves the server had played when our history started
+        self.first_move = 0
+
+    @property
+    def color(self):
+        """bool: True if this player is black, the stone under the mouse
+        is always of our color"""
+        return self.player == 0
 
     def fill_stone(self, pos):
         """Fill stone in position according to mouse click
@@ -45,72 +71,24 @@ class GoGuiOnline(GoGui):
         """
         if (
             pos[0] > self.hor_pad - self.buffer
-            and pos[0] < self.width - self.hor_pad + self.buffer
+            and pos[0] < self.hor_pad + self.grid_width + self.buffer
             and pos[1] > self.top_pad + self.bot_pad - self.buffer
-            and pos[1] < self.height - self.bot_pad + self.buffer
+            and pos[1] < self.top_pad + self.bot_pad + self.grid_width + self.buffer
         ):
             # getting row and col from x and y positino
             row = round((pos[1] - self.top_pad - self.bot_pad) / self.spacing)
             col = round((pos[0] - self.hor_pad) / self.spacing)
-            if self.board[row, col] == 0:
-                # if board position is unfilled
-                # save state of game
-                self.states.append(
-                    (
-                        self.board.copy(),
-                        self.pointer.copy(),
-                        self.white_groups.copy(),
-                        self.black_groups.copy(),
-                        self.white_captured,
-                        self.black_captured,
-                    )
-                )
-
-                # updating board
-                color_num = 1 if self.color else -1
-                if self.color:
-                    self.board[row, col] = color_num
-                else:
-                    self.board[row, col] = color_num
-
-                self.newest_stone = row * self.size + col
-
-                # adding to group
-                self.add_group(row, col, color_num)
-                # remove captured stones
-                self.check_board()
-
-                # checking for Ko, prevent illegal move
-                if self.check_ko() or self.board[row, col] == 0:
-                    # violated Ko, move prevented
-                    (
-                        self.board,
-                        self.pointer,
-                        self.white_groups,
-                        self.black_groups,
-                        self.white_captured,
-                        self.black_captured,
-                    ) = self.states.pop()
-                else:
-                    pygame.mixer.music.play()
-                    # did not violate Ko, move on
-                    state = (
-                        self.board.copy(),
-                        self.pointer.copy(),
-                        self.white_groups.copy(),
-                        self.black_groups.copy(),
-                        self.white_captured,
-                        self.black_captured,
-                    )
-                    self.states.append(state)
-
-                    state = list(state)
-                    state.insert(0, self.op_color)
-                    state = tuple(state)
-                    # send the new state of game
-                    self.my_turn = False
-                    self.conn.sendall(str.encode("POST"))
-                    self.conn.sendall(pickle.dumps(state))
+            move = row * self.size + col
+            if self.engine.is_legal(move):
+                # if move is neither occupied, suicide nor a Ko violation
+                # the engine removes captured stones
+                self.history.play(move)
+
+                assets.play_tap()
+                # send the move, it is shown before the server accepts
+                # it and rolled back if the server rejects it
+                self.my_turn = False
+                self.post(move)
 
         elif (
             pos[0] > self.but_x
@@ -130,19 +108,161 @@ class GoGuiOnline(GoGui):
     def pass_turn(self):
         """Pass turn to opponent
         """
+        if not self.my_turn:
+            return
         self.my_turn = False
         # passing the turn
-        state = (
-            self.op_color,
-            self.board.copy(),
-            self.pointer.copy(),
-            self.white_groups.copy(),
-            self.black_groups.copy(),
-            self.white_captured,
-            self.black_captured,
-        )
-        self.conn.sendall(str.encode("POST"))
-        self.conn.sendall(pickle.dumps(state))
+        self.history.play(PASS)
+        self.post(PASS)
+
+    def post(self, move):
+        """Send a move already played locally to the server
+
+        Args:
+            move (int): position of the move, or PASS
+        """
+        self.seq += 1
+        self.posts += 1
+        self.pending.append((self.seq, len(self.history) - 1))
+        self.network.send(("POST", self.seq, move))
+        if self.game_clock is not None:
+            # the server stops our clock when the move arrives
+            color = BLACK_STONE if self.player == 0 else WHITE_STONE
+            self.game_clock.press(color, time.monotonic())
+
+    def reconcile(self, seq, accepted):
+        """Settle a move on the answer of the server, a rejected move
+        and any move played after it are taken back
+
+        Args:
+            seq (int): sequence number of the move
+            accepted (bool): whether the server accepted the move
+        """
+        # the server answers moves in the order they were sent
+        while self.pending and self.pending[0][0] <= seq:
+            pending_seq, moves = self.pending.popleft()
+            if pending_seq == seq and not accepted:
+                print("Move rejected by server")
+                # the history takes the moves back, the board and the
+                # captured stones shown are read from its engine
+                self.history.truncate(moves)
+                self.pending.clear()
+                self.set_view(None)
+                self.my_turn = True
+                self.dirty = True
+
+    def fetch_position(self, move):
+        """Ask the server for the board after a number of moves, the
+        board is put in positions when the reply arrives
+
+        Args:
+            move (int): number of moves played
+        """
+        if move not in self.positions:
+            self.positions[move] = None
+            self.network.send(("SEEK", move))
+
+    def set_view(self, move):
+        """Show the board after a number of moves, earlier boards come
+        from the server, which keeps the game of record, and our history
+        is shown until the server answers
+
+        Args:
+            move (int): number of moves played, None for the latest move
+        """
+        super().set_view(move)
+        if self.view_move is not None:
+            board = self.positions.get(self.first_move + self.view_move)
+            if board is None:
+                self.fetch_position(self.first_move + self.view_move)
+            else:
+                self.view_board = board
+
+    @staticmethod
+    def notify_network():
+        """Wake the game loop up, called by the network thread for
+        every reply
+        """
+        try:
+            pygame.event.post(pygame.event.Event(NETWORK_EVENT))
+        except pygame.error:
+            # the event queue is full, the loop is awake anyway
+            pass
+
+    def handle_network(self):
+        """Apply the replies the network thread received since the last frame
+        """
+        for request, posts, reply, answered in self.network.poll():
+            if request[0] == "LOST":
+                print(f"Lost connection to server: {reply}")
+                self.started = True
+                self.running = False
+            elif request[0] == "SEEK":
+                if reply is None:
+                    # the server was busy, asked again when next shown
+                    self.positions.pop(request[1], None)
+                    continue
+                self.positions[request[1]] = reply
+                if self.view_move is not None and self.first_move + self.view_move == request[1]:
+                    self.view_board = reply
+                    self.dirty = True
+            elif reply is None:
+                print("Game closed by the server")
+                self.started = True
+                self.running = False
+            elif request[0] == "POST":
+                self.reconcile(*reply)
+            elif request[0] == "START":
+                continue
+            elif posts < self.posts:
+                # the game was polled before our latest move reached the server
+                continue
+            elif reply is False:
+                # player 0 has not sent the game or player 1 has not
+                # joined yet, the channel keeps polling
+                continue
+            else:
+                # the server only answers with the game once it started
+                self.started = True
+                state, clock, version = reply
+                was_flagged = self.game_clock is not None and self.game_clock.flagged is not None
+                if clock is not None:
+                    # the clock runs on from when the server answered,
+                    # a busy server leaves it out and ours keeps running
+                    self.game_clock = GameClock.from_state(clock, answered)
+                if state is not None:
+                    # the server only sends the game again once it has
+                    # changed, a busy server sends no game and the poll
+                    # keeps asking for the one we have
+                    self.network.poll_request = ("GET", version)
+                if self.game_clock is not None and self.game_clock.flagged is not None:
+                    self.my_turn = False
+                    self.dirty = self.dirty or not was_flagged
+                elif state is None:
+                    continue
+                elif state[0] == self.my_color and not self.my_turn:
+                    # receiving game after opponent has moved
+                    self.my_turn = True
+                    self.dirty = True
+                    self.apply_state(state)
+
+    def apply_state(self, state):
+        """Bring the game up to date with the game kept by the server,
+        the opponent's move is played on our engine when it follows our
+        history, the server's board is taken as is otherwise
+
+        Args:
+            state (tuple): color to move, number of moves, last move,
+                board and captured white and black stones
+        """
+        to_move, moves, last, board, white_captured, black_captured = state
+        if moves == self.first_move + len(self.history) + 1 and self.engine.is_legal(last):
+            self.history.play(last)
+        else:
+            to_play = BLACK_STONE if to_move == "BLACK" else WHITE_STONE
+            self.history.restart(board, to_play, white_captured, black_captured)
+            self.first_move = moves
+            self.set_view(None)
 
     def draw_turn(self, font):
         """Drawing which player's turn it is
@@ -151,6 +271,9 @@ class GoGuiOnline(GoGui):
             font (pygame font): font to use to draw
         """
         color = f"{self.my_color} TURN" if self.my_turn else f"{self.op_color} TURN"
+        if self.game_clock is not None and self.game_clock.flagged is not None:
+            loser = "BLACK" if self.game_clock.flagged == BLACK_STONE else "WHITE"
+            color = f"{loser} LOST ON TIME"
         text = font.render(color, True, BLACK)
         self.display.blit(text, (self.width // 2 - text.get_width() // 2, 15))
 
@@ -174,12 +297,9 @@ class GoGuiOnline(GoGui):
         """
         self.running = True
         self.display = pygame.display.set_mode((self.width, self.height))
-        self.black_stone_img = pygame.image.load(
-            os.path.join(os.getcwd(), "assets", "img", "black_stone.png")
-        ).convert_alpha()
-        self.white_stone_img = pygame.image.load(
-            os.path.join(os.getcwd(), "assets", "img", "white_stone.png")
-        ).convert_alpha()
+        self.load_stone_imgs()
+        # decoding the placement sound before the first move
+        assets.sound("tap.mp3")
         self.clock = pygame.time.Clock()
         self.wait_gui()
         pygame.display.set_caption("GO online")
@@ -187,62 +307,37 @@ class GoGuiOnline(GoGui):
         if self.player == 0:
             # if player 0, then send relevant game information to server
             self.my_turn = True
-            state = (
-                "BLACK",
-                self.board,
-                self.pointer,
-                self.white_groups,
-                self.black_groups,
-                self.white_captured,
-                self.black_captured,
-            )
-            self.conn.sendall(pickle.dumps(state))
+            self.network.send(("START",))
         else:
             # if player 1, then start the game
             self.started = True
+        self.network.start()
 
+        pygame.display.update()
         while not self.started:
-            # wait until player 1 (opponent) has connected
-            self.conn.sendall(str.encode("GET"))
-            response = pickle.loads(self.conn.recv(4096))
-
-            if response:
-                self.started = True
-
-            for event in pygame.event.get():
+            # wait until player 1 (opponent) has connected, the screen
+            # does not change so the loop only wakes up for events
+            for event in [pygame.event.wait()] + pygame.event.get():
                 # enable closing of display
                 if event.type == pygame.QUIT:
                     self.started = True
                     self.running = False
                     break
+            self.handle_network()
 
-            self.wait_gui()
-
-            self.clock.tick(60)
-            pygame.display.update()
-
-        start_time = pygame.time.get_ticks()
+        self.start_ticks = pygame.time.get_ticks()
+        self.dirty = True
         pygame.mouse.set_visible(False)
         # loop for main game
         while self.running:
-            self.time_elapsed = int((pygame.time.get_ticks() - start_time) / 1000)
-            self.conn.sendall(str.encode("GET"))
-            response = pickle.loads(self.conn.recv(4096))
-
-            if response[0] == self.my_color:
-                # receiving game after opponent has moved
-                self.my_turn = True
-                (
-                    _,
-                    self.board,
-                    self.pointer,
-                    self.white_groups,
-                    self.black_groups,
-                    self.white_captured,
-                    self.black_captured,
-                ) = response
-
-            for event in pygame.event.get():
+            events = self.next_events()
+            self.time_elapsed = int((pygame.time.get_ticks() - self.start_ticks) / 1000)
+            # the network thread polls the game, this only reads its replies
+            self.handle_network()
+
+            for event in events:
+                if self.handle_review(event):
+                    continue
                 # enable closing of display
                 if event.type == pygame.QUIT:
                     self.running = False
@@ -260,8 +355,13 @@ class GoGuiOnline(GoGui):
                     if keys[pygame.K_SPACE]:
                         self.show_ter = True
                         self.score()
+                    if keys[pygame.K_h]:
+                        self.toggle_heatmap()
 
-            self.update_gui()
+            # replies only cause a redraw if they changed the game
+            self.check_redraw([event for event in events if event.type != NETWORK_EVENT])
+            self.draw_frame()
 
-            self.clock.tick(60)
-            pygame.display.update()
+        self.network.close()
+        if self.heatmap_worker is not None:
+            self.heatmap_worker.close()
@@ -0,0 +1,281 @@
+"""This module contains the Multiplexer and Channel classes.
+A Multiplexer owns the connection of an online client and carries any
+number of games over it, each game on its own Channel. One background
+thread sends the requests of every channel and another receives the
+replies, so the game loops never wait on the network and the number of
+sockets and threads does not grow with the number of games.
+
+Every request is sent as (channel, sequence number, request) and
+answered as (channel, sequence number, reply). A channel has at most
+a window of requests in flight, later ones wait their turn, so one busy
+game can not fill the connection. The game loops and the threads only
+share deques, whose append and popleft are atomic.
+"""
+import pickle
+import threading
+import time
+from collections import deque
+
+from protocol import recv_message, send_message
+
+
+class Channel:
+    """Class representing one game carried by a Multiplexer, it is
+    created by Multiplexer.open
+
+    Args:
+        mux (Multiplexer): connection carrying the channel
+        channel_id (int): id of the channel on the connection
+        window (int): most requests in flight at once
+    """
+
+    def __init__(self, mux, channel_id, window):
+        self.mux = mux
+        self.channel_id = channel_id
+        self.window = window
+        self.notify = None
+        # requests from the game loop waiting to be sent
+        self.outbox = deque()
+        # (request, posts sent before it, reply, time) read by the game loop
+        self.inbox = deque()
+        # (sequence number, request, posts sent before it, time sent) of
+        # the requests waiting for their reply, oldest first
+        self.in_flight = deque()
+        self.seq = 0
+        # whether the game is polled when nothing else is sent
+        self.polling = False
+        # request polling the game, carries the version the game loop has
+        self.poll_request = ("GET",)
+        self.last_sent = 0.0
+        self.closed = False
+        # POST requests sent so far, tags the replies sent after them
+        self.posts = 0
+        # seconds taken by the last round trip
+        self.latency = 0.0
+
+    def start(self):
+        """Start polling the game
+        """
+        self.polling = True
+        self.mux.wake.set()
+
+    def send(self, request):
+        """Queue a request for the server, never blocks
+
+        Args:
+            request (tuple): name of the request followed by its arguments
+        """
+        if self.closed:
+            return
+        self.outbox.append(request)
+        self.mux.wake.set()
+
+    def poll(self):
+        """Take the replies received since the last call, never blocks
+
+        Returns:
+            list: (request, posts sent before it, reply, time) of every
+                reply, time is when the server most likely answered on
+                time.monotonic, a ("LOST",) request means the connection is gone
+        """
+        replies = []
+        while self.inbox:
+            replies.append(self.inbox.popleft())
+        return replies
+
+    def _next_request(self, now):
+        """Take the next request to send if the window allows it
+
+        Args:
+            now (float): current time in seconds
+
+        Returns:
+            tuple: sequence number and request, None if nothing is due
+        """
+        if self.outbox and (self.closed or len(self.in_flight) < self.window):
+            # leaving the game does not wait for the window
+            request = self.outbox.popleft()
+        elif self.polling and not self.in_flight and now - self.last_sent >= self.mux.heartbeat:
+            request = self.poll_request
+        else:
+            return None
+        self.seq += 1
+        self.last_sent = now
+        if request[0] == "POST":
+            self.posts += 1
+        self.in_flight.append((self.seq, request, self.posts, now))
+        return self.seq, request
+
+    def _receive(self, seq, reply):
+        """Hand a reply to the game loop
+
+        Args:
+            seq (int): sequence number of the reply
+            reply (object): the reply
+
+        Raises:
+            ConnectionError: if the reply is not for the oldest request
+        """
+        if not self.in_flight or self.in_flight[0][0] != seq:
+            raise ConnectionError(f"reply {seq} out of order on channel {self.channel_id}")
+        _, request, posts, start = self.in_flight.popleft()
+        end = time.monotonic()
+        self.latency = end - start
+        # the reply was made about half way through the round trip
+        self.inbox.append((request, posts, reply, (start + end) / 2))
+        if self.notify is not None:
+            self.notify()
+
+    def _lost(self, error):
+        """Tell the game loop the connection is gone
+
+        Args:
+            error (str): why the connection was lost
+        """
+        self.inbox.append((("LOST",), self.posts, error, time.monotonic()))
+        if self.notify is not None:
+            self.notify()
+
+    def close(self):
+        """Leave the game, requests still queued are dropped
+        """
+        if self.closed:
+            return
+        self.polling = False
+        self.closed = True
+        self.outbox.clear()
+        # the close request is the last one sent on the channel
+        self.outbox.append(("CLOSE",))
+        self.mux.wake.set()
+
+
+class Multiplexer:
+    """Class representing the connection to the server, carrying the
+    requests of every channel on two background threads
+
+    Args:
+        conn (socket): connection to the server
+        heartbeat (float): seconds between polls of a game when nothing
+            else is sent on its channel, the polls also tell the server
+            the client is alive
+        timeout (float): seconds to wait for a reply before the server
+            is considered lost
+        window (int): most requests in flight on every channel
+    """
+
+    def __init__(self, conn, heartbeat=0.1, timeout=10.0, window=4):
+        self.conn = conn
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.window = window
+        self.channels = {}
+        self.next_channel = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = True
+        conn.settimeout(timeout)
+        self.sender = threading.Thread(target=self._send_loop, daemon=True)
+        self.receiver = threading.Thread(target=self._receive_loop, daemon=True)
+        self.sender.start()
+        self.receiver.start()
+
+    def open(self, size, name=""):
+        """Ask the server for a game on a new channel, waiting for the reply
+
+        Args:
+            size (int): size of the board
+            name (str): name of the player, empty if anonymous
+
+        Raises:
+            ConnectionError: if the server refused or the connection is gone
+
+        Returns:
+            tuple: the channel, then the player number, game id and board
+                size given by the server
+        """
+        with self.lock:
+            channel = Channel(self, self.next_channel, self.window)
+            self.channels[channel.channel_id] = channel
+            self.next_channel += 1
+        answered = threading.Event()
+        channel.notify = answered.set
+        channel.send(("OPEN", size, name))
+        answered.wait(self.timeout)
+        channel.notify = None
+        replies = channel.poll()
+        if not replies or replies[0][0][0] != "OPEN" or replies[0][2] is None:
+            error = replies[0][2] if replies and replies[0][0][0] == "LOST" else "refused"
+            with self.lock:
+                self.channels.pop(channel.channel_id, None)
+            raise ConnectionError(f"could not open a game: {error}")
+        return (channel,) + tuple(replies[0][2])
+
+    def _send_loop(self):
+        """Send the requests of every channel until stopped
+        """
+        try:
+            while self.running:
+                self.wake.wait(self.heartbeat)
+                self.wake.clear()
+                now = time.monotonic()
+                with self.lock:
+                    channels = list(self.channels.values())
+                for channel in channels:
+                    while True:
+                        request = channel._next_request(now)
+                        if request is None:
+                            break
+                        seq, request = request
+                        send_message(self.conn, (channel.channel_id, seq, request))
+                        if request[0] == "CLOSE":
+                            # replies still in flight are dropped
+                            with self.lock:
+                                self.channels.pop(channel.channel_id, None)
+                            break
+        except OSError as error:
+            self._fail(str(error))
+
+    def _receive_loop(self):
+        """Receive the replies of every channel until stopped
+        """
+        try:
+            while self.running:
+                channel_id, seq, reply = recv_message(self.conn)
+                with self.lock:
+                    channel = self.channels.get(channel_id)
+                if channel is not None:
+                    channel._receive(seq, reply)
+                # a free slot in the window may let a request through
+                self.wake.set()
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError) as error:
+            # timeouts are OSErrors too
+            self._fail(str(error))
+
+    def _fail(self, error):
+        """Tell every channel the connection is gone
+
+        Args:
+            error (str): why the connection was lost
+        """
+        if not self.running:
+            return
+        self.running = False
+        with self.lock:
+            channels = list(self.channels.values())
+        for channel in channels:
+            channel._lost(error)
+
+    def close(self):
+        """Close every channel and stop the threads
+        """
+        with self.lock:
+            channels = list(self.channels.values())
+        for channel in channels:
+            channel.close()
+        # giving the close requests a moment to go out
+        deadline = time.monotonic() + self.heartbeat
+        while self.channels and self.running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.running = False
+        self.wake.set()
+        self.sender.join(self.heartbeat)
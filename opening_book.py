@@ -0,0 +1,196 @@
+"""This module contains the OpeningBook class.
+An opening book keeps the moves played from every early position of
+archived games. Positions are keyed by their canonical key, so the
+8 rotations and reflections of a position share one entry, and moves
+are stored on the canonical board then turned back to the board asked
+about. Finding the moves of a position is a single dictionary lookup.
+"""
+import sys
+import time
+
+import numpy as np
+
+from game_archive import GameArchive, decode_moves
+from go_board import PASS, GoBoard
+
+# moves of every game added to the book
+DEFAULT_DEPTH = 30
+
+
+class OpeningBook:
+    """Class representing the moves played from the early positions
+    of many games
+
+    Args:
+        size (int): size of the board
+        depth (int): moves of every game added to the book
+    """
+
+    def __init__(self, size, depth=DEFAULT_DEPTH):
+        self.size = size
+        self.depth = depth
+        # canonical key -> canonical move -> [times played, times won]
+        self.entries = {}
+        self.games = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_game(self, moves, winner=0):
+        """Add the opening of a game to the book
+
+        Args:
+            moves (list): (color, position) of every move of the game
+            winner (int): 1 if black won, -1 if white won, 0 otherwise
+
+        Raises:
+            ValueError: if a move is illegal
+        """
+        engine = GoBoard(self.size)
+        played = 0
+        for color, pos in moves:
+            if played >= self.depth:
+                break
+            if color != engine.to_play:
+                engine.play(PASS)
+            key, symmetry = engine.canonical_key()
+            move = engine.to_canonical(pos, symmetry)
+            stats = self.entries.setdefault(key, {}).setdefault(move, [0, 0])
+            stats[0] += 1
+            if winner == color:
+                stats[1] += 1
+            engine.play(pos)
+            played += 1
+        self.games += 1
+
+    @classmethod
+    def build(cls, archive, size, depth=DEFAULT_DEPTH):
+        """Build a book from the games of an archive, games with setup
+        stones or illegal moves are skipped
+
+        Args:
+            archive (GameArchive): archive to read
+            size (int): size of the board, games of other sizes are skipped
+            depth (int): moves of every game added to the book
+
+        Returns:
+            OpeningBook: the book
+        """
+        book = cls(size, depth)
+        for game_id in archive.filter(size=size):
+            game = archive[game_id]
+            if len(game.setup):
+                continue
+            try:
+                book.add_game(decode_moves(game.moves), game.winner)
+            except (ValueError, IndexError):
+                continue
+        return book
+
+    def moves(self, engine):
+        """Get the moves played from a position
+
+        Args:
+            engine (GoBoard): position to look up
+
+        Returns:
+            dict: (times played, times won) of every move, positions are
+                on the board of engine
+        """
+        key, symmetry = engine.canonical_key()
+        stats = self.entries.get(key)
+        if not stats:
+            return {}
+        return {
+            engine.from_canonical(move, symmetry): tuple(counts)
+            for move, counts in stats.items()
+        }
+
+    def suggest(self, engine, min_count=1):
+        """Get the most played legal move of a position
+
+        Args:
+            engine (GoBoard): position to look up
+            min_count (int): times a move must have been played
+
+        Returns:
+            int: position of the move, or PASS, None if the position is
+                not in the book
+        """
+        best = None
+        best_stats = None
+        for move, stats in self.moves(engine).items():
+            if stats[0] < min_count or not engine.is_legal(move):
+                continue
+            if best_stats is None or stats > best_stats:
+                best = move
+                best_stats = stats
+        return best
+
+    def save(self, path):
+        """Write the book to a file
+
+        Args:
+            path (str): path of the file
+        """
+        keys = []
+        moves = []
+        counts = []
+        for key, stats in self.entries.items():
+            for move, (played, won) in stats.items():
+                keys.append(key)
+                moves.append(move)
+                counts.append((played, won))
+        with open(path, "wb") as file:
+            np.savez(
+                file,
+                info=np.array([self.size, self.depth, self.games], dtype="<u4"),
+                keys=np.array(keys, dtype="<u8"),
+                moves=np.array(moves, dtype="<i2"),
+                counts=np.array(counts, dtype="<u4").reshape(-1, 2),
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Read a book written by save
+
+        Args:
+            path (str): path of the file
+
+        Returns:
+            OpeningBook: the book
+        """
+        with np.load(path) as data:
+            size, depth, games = data["info"].tolist()
+            keys = data["keys"].tolist()
+            moves = data["moves"].tolist()
+            counts = data["counts"].tolist()
+        book = cls(size, depth)
+        book.games = games
+        for key, move, stats in zip(keys, moves, counts):
+            book.entries.setdefault(key, {})[move] = stats
+        return book
+
+
+def main():
+    """Builds a book from an archive with
+    "build <archive> <book> [size] [depth]"
+    """
+    if len(sys.argv) in (4, 5, 6) and sys.argv[1] == "build":
+        size = int(sys.argv[4]) if len(sys.argv) > 4 else 19
+        depth = int(sys.argv[5]) if len(sys.argv) > 5 else DEFAULT_DEPTH
+        start = time.perf_counter()
+        with GameArchive(sys.argv[2]) as archive:
+            book = OpeningBook.build(archive, size, depth)
+        book.save(sys.argv[3])
+        moves = sum(len(stats) for stats in book.entries.values())
+        print(
+            f"{book.games} games, {len(book)} positions, {moves} moves "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+    else:
+        print("usage: opening_book.py build <archive> <book> [size] [depth]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+"""This module contains the PositionIndex class.
+A position index maps the canonical key of every position reached in
+archived games, and optionally the key of every corner pattern, to the
+games and move numbers that reached it. Entries are kept on disk in
+segments sorted by key and memory-mapped, so a query is a binary search
+in every segment. New games go to a new small segment, and the newest
+segments are merged once enough of them have a similar size, so an
+entry is rewritten once for every time the size of its segment grows
+by MERGE_RATIO rather than on every merge.
+
+Segment layout:
+    header: magic, version, number of position entries, number of
+        pattern entries
+    positions: keys, 8 bytes each, then game ids, 4 bytes each, then
+        move numbers, 2 bytes each
+    patterns: laid out as positions
+"""
+import math
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from game_archive import GameArchive, decode_moves
+from go_board import HASH_BITS, HASH_MASK, PASS, GoBoard, stone_code
+from sgf import iter_games
+
+MAGIC = b"GOIX"
+VERSION = 1
+# magic, version, number of position entries, number of pattern entries
+SEGMENT_HEADER = struct.Struct("<4sHxxQQ")
+# side of the square of points in a corner pattern
+CORNER_EXTENT = 7
+# segments are in the same tier when their number of entries has the
+# same whole logarithm in base MERGE_RATIO, MERGE_FACTOR segments of a
+# tier are merged into one of a higher tier
+MERGE_FACTOR = 4
+MERGE_RATIO = 4
+
+# corner tables are shared between all indexes with the same board size
+_CORNERS = {}
+
+
+def corner_table(size, extent=CORNER_EXTENT):
+    """Get the keys used to hash the corner patterns of a board, a
+    pattern has the same key in every corner and once reflected along
+    the diagonal, whatever the board size
+
+    Args:
+        size (int): size of the board
+        extent (int): side of the square of points in a corner
+
+    Returns:
+        tuple: for every position * 2 + stone code - 1, the (corner, key)
+            pairs of the corners the position is in, every key holds the
+            keys of the pattern and of its reflection packed 64 bits each
+    """
+    if (size, extent) not in _CORNERS:
+        # seeded so keys are the same in every process and run
+        rng = random.Random("corner")
+        keys = [rng.getrandbits(HASH_BITS) for _ in range(extent * extent * 2)]
+        last = size - 1
+        table = []
+        for pos in range(size * size):
+            row, col = divmod(pos, size)
+            corners = []
+            for corner, (local_row, local_col) in enumerate(
+                ((row, col), (row, last - col), (last - row, col), (last - row, last - col))
+            ):
+                if local_row < extent and local_col < extent:
+                    point = local_row * extent + local_col
+                    mirror = local_col * extent + local_row
+                    corners.append((corner, point, mirror))
+            for code in (1, 2):
+                entry = []
+                for corner, point, mirror in corners:
+                    key = keys[point * 2 + code - 1] | keys[mirror * 2 + code - 1] << HASH_BITS
+                    entry.append((corner, key))
+                table.append(tuple(entry))
+        _CORNERS[(size, extent)] = tuple(table)
+    return _CORNERS[(size, extent)]
+
+
+def pattern_key(hashes):
+    """Get the key of a corner pattern from its packed hashes
+
+    Args:
+        hashes (int): hashes of the pattern and its reflection
+
+    Returns:
+        int: the smaller of the two hashes, 0 for an empty corner
+    """
+    return min(hashes & HASH_MASK, hashes >> HASH_BITS)
+
+
+def corner_hashes(engine, extent=CORNER_EXTENT):
+    """Hash the 4 corner patterns of a position
+
+    Args:
+        engine (GoBoard): position to hash
+        extent (int): side of the square of points in a corner
+
+    Returns:
+        list: packed hashes of every corner
+    """
+    table = corner_table(engine.size, extent)
+    hashes = [0, 0, 0, 0]
+    for pos, stone in enumerate(engine.cells):
+        if stone:
+            for corner, key in table[pos * 2 + stone_code(stone) - 1]:
+                hashes[corner] ^= key
+    return hashes
+
+
+def game_keys(size, moves, extent=CORNER_EXTENT):
+    """Replay a game and hash every position it reaches
+
+    Args:
+        size (int): size of the board
+        moves (list): (color, position) of every move
+        extent (int): side of the square of points in a corner, 0 to
+            skip the corner patterns
+
+    Raises:
+        ValueError: if a move is illegal
+
+    Yields:
+        tuple: move number, canonical key of the position after the move,
+            and the keys of the corner patterns that changed
+    """
+    engine = GoBoard(size)
+    table = corner_table(size, extent) if extent else None
+    hashes = [0, 0, 0, 0]
+    for number, (color, pos) in enumerate(moves, 1):
+        if color != engine.to_play:
+            engine.play(PASS)
+        captured = engine.play(pos)
+        changed = set()
+        if table is not None and pos != PASS:
+            # only the corners holding a changed point have a new pattern
+            for corner, key in table[pos * 2 + stone_code(color) - 1]:
+                hashes[corner] ^= key
+                changed.add(corner)
+            for stone in captured:
+                for corner, key in table[stone * 2 + stone_code(-color) - 1]:
+                    hashes[corner] ^= key
+                    changed.add(corner)
+        patterns = [pattern_key(hashes[corner]) for corner in changed if hashes[corner]]
+        yield number, engine.canonical_key()[0], patterns
+
+
+class Segment:
+    """Class representing one sorted segment of an index, read
+    through a memory map
+
+    Args:
+        path (str): path of the segment
+
+    Raises:
+        ValueError: if the file is not a segment
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, positions, patterns = SEGMENT_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an index segment")
+        offset = SEGMENT_HEADER.size
+        self.positions, offset = self._table(positions, offset)
+        self.patterns, _ = self._table(patterns, offset)
+        self.entries = positions + patterns
+
+    def _table(self, count, offset):
+        """Read the keys, game ids and move numbers of a table
+
+        Args:
+            count (int): number of entries
+            offset (int): offset of the table in the file
+
+        Returns:
+            tuple: views of the keys, game ids and move numbers, and the
+                offset after the table
+        """
+        keys = np.frombuffer(self.map, dtype="<u8", count=count, offset=offset)
+        offset += count * 8
+        games = np.frombuffer(self.map, dtype="<u4", count=count, offset=offset)
+        offset += count * 4
+        moves = np.frombuffer(self.map, dtype="<u2", count=count, offset=offset)
+        return (keys, games, moves), offset + count * 2
+
+    @staticmethod
+    def lookup(table, key):
+        """Find the entries of a key with a binary search
+
+        Args:
+            table (tuple): keys, game ids and move numbers
+            key (int): key to find
+
+        Returns:
+            list: (game id, move number) of every entry
+        """
+        keys, games, moves = table
+        start = np.searchsorted(keys, np.uint64(key), side="left")
+        end = np.searchsorted(keys, np.uint64(key), side="right")
+        return list(zip(games[start:end].tolist(), moves[start:end].tolist()))
+
+    def close(self):
+        """Release the memory map
+        """
+        # views into the map must be released before it can be closed
+        self.positions = None
+        self.patterns = None
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+
+
+def write_segment(path, positions, patterns):
+    """Write the entries of a segment sorted by key
+
+    Args:
+        path (str): path of the segment
+        positions (tuple): arrays of keys, game ids and move numbers
+        patterns (tuple): arrays of keys, game ids and move numbers
+    """
+    # written next to the segment then renamed, so readers never see half of it
+    temp = path + ".tmp"
+    with open(temp, "wb") as file:
+        file.write(SEGMENT_HEADER.pack(MAGIC, VERSION, len(positions[0]), len(patterns[0])))
+        for keys, games, moves in (positions, patterns):
+            order = np.argsort(keys, kind="stable")
+            file.write(np.asarray(keys, dtype="<u8")[order].tobytes())
+            file.write(np.asarray(games, dtype="<u4")[order].tobytes())
+            file.write(np.asarray(moves, dtype="<u2")[order].tobytes())
+    os.replace(temp, path)
+
+
+class PositionIndex:
+    """Class representing an on-disk index from positions and corner
+    patterns to the games that reached them, used as a context manager
+
+    Args:
+        directory (str): folder of the segments, created if needed
+        extent (int): side of the square of points in a corner pattern,
+            0 to index positions only
+    """
+
+    def __init__(self, directory, extent=CORNER_EXTENT):
+        self.directory = directory
+        self.extent = extent
+        os.makedirs(directory, exist_ok=True)
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".idx"))
+        self.segments = [Segment(os.path.join(directory, name)) for name in names]
+        self.next_segment = int(names[-1][:-4]) + 1 if names else 0
+        # entries added since the last flush, kept in compact arrays
+        self.pending = self._empty(), self._empty()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _empty():
+        """Create empty arrays of keys, game ids and move numbers
+
+        Returns:
+            tuple: the arrays
+        """
+        return array("Q"), array("I"), array("H")
+
+    def add_game(self, game_id, size, moves):
+        """Add the positions of a game, they can be found once flushed
+
+        Args:
+            game_id (int): id of the game in the archive
+            size (int): size of the board
+            moves (list): (color, position) of every move
+
+        Raises:
+            ValueError: if a move is illegal, nothing is added then
+        """
+        entries = list(game_keys(size, moves, self.extent))
+        positions, patterns = self.pending
+        for number, key, corners in entries:
+            positions[0].append(key)
+            positions[1].append(game_id)
+            positions[2].append(number)
+            for corner in corners:
+                patterns[0].append(corner)
+                patterns[1].append(game_id)
+                patterns[2].append(number)
+
+    def flush(self):
+        """Write the pending entries to a new segment, merging the
+        newest segments once enough of them have a similar size
+        """
+        positions, patterns = self.pending
+        if not positions[0] and not patterns[0]:
+            return
+        path = os.path.join(self.directory, f"{self.next_segment:08}.idx")
+        self.next_segment += 1
+        write_segment(path, positions, patterns)
+        self.segments.append(Segment(path))
+        self.pending = self._empty(), self._empty()
+        while True:
+            tiers = {}
+            for segment in self.segments:
+                tier = int(math.log(max(1, segment.entries), MERGE_RATIO))
+                tiers.setdefault(tier, []).append(segment)
+            full = [tier for tier in sorted(tiers) if len(tiers[tier]) >= MERGE_FACTOR]
+            if not full:
+                break
+            # the merged segment can fill the tier above
+            self._merge(tiers[full[0]][:MERGE_FACTOR])
+
+    def compact(self):
+        """Merge every segment into one
+        """
+        if len(self.segments) >= 2:
+            self._merge(self.segments)
+
+    def _merge(self, merged):
+        """Merge segments into one, the order of the segments does not
+        matter as matches are sorted
+
+        Args:
+            merged (list): segments to merge
+        """
+        merged = list(merged)
+        tables = []
+        for name in ("positions", "patterns"):
+            parts = [getattr(segment, name) for segment in merged]
+            tables.append(tuple(np.concatenate([part[i] for part in parts]) for i in range(3)))
+        parts = None
+        path = os.path.join(self.directory, f"{self.next_segment:08}.idx")
+        self.next_segment += 1
+        write_segment(path, *tables)
+        tables = None
+        self.segments = [segment for segment in self.segments if segment not in merged]
+        self.segments.append(Segment(path))
+        for segment in merged:
+            segment.close()
+            os.remove(segment.path)
+
+    def _find(self, name, index, key):
+        """Find the entries of a key in the segments and pending entries
+
+        Args:
+            name (str): "positions" or "patterns"
+            index (int): 0 for positions, 1 for patterns
+            key (int): key to find
+
+        Returns:
+            list: sorted (game id, move number) of every entry
+        """
+        found = []
+        for segment in self.segments:
+            found.extend(Segment.lookup(getattr(segment, name), key))
+        keys, games, moves = self.pending[index]
+        found.extend((games[i], moves[i]) for i, value in enumerate(keys) if value == key)
+        return sorted(found)
+
+    def find(self, engine):
+        """Find the games that reached a position or any of its
+        rotations and reflections
+
+        Args:
+            engine (GoBoard): position to find
+
+        Returns:
+            list: sorted (game id, move number) of every match
+        """
+        return self._find("positions", 0, engine.canonical_key()[0])
+
+    def find_pattern(self, engine, corner):
+        """Find the games that had the same stones in a corner, in any
+        corner and reflected along the diagonal
+
+        Args:
+            engine (GoBoard): position holding the pattern
+            corner (int): 0 top left, 1 top right, 2 bottom left,
+                3 bottom right
+
+        Returns:
+            list: sorted (game id, move number) of every match
+        """
+        key = pattern_key(corner_hashes(engine, self.extent)[corner])
+        if not key:
+            return []
+        return self._find("patterns", 1, key)
+
+    def close(self):
+        """Release the segments, pending entries are not written
+        """
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+
+def build_index(archive_path, directory, extent=CORNER_EXTENT):
+    """Index every game of an archive into one segment, games with
+    setup stones or illegal moves are skipped
+
+    Args:
+        archive_path (str): path of the archive
+        directory (str): folder of the index
+        extent (int): side of the square of points in a corner pattern
+
+    Returns:
+        dict: number of games, indexed games and elapsed seconds
+    """
+    start = time.perf_counter()
+    indexed = 0
+    with GameArchive(archive_path) as archive, PositionIndex(directory, extent) as index:
+        games = len(archive)
+        for game_id, game in enumerate(archive):
+            if len(game.setup):
+                continue
+            try:
+                index.add_game(game_id, game.size, decode_moves(game.moves))
+            except (ValueError, IndexError):
+                continue
+            indexed += 1
+        # the last game is a view into the map, release it before closing
+        game = None
+        index.flush()
+        index.compact()
+    return {"games": games, "indexed": indexed, "seconds": time.perf_counter() - start}
+
+
+def main():
+    """Builds an index of an archive with "build <archive> <index>",
+    or finds the games reaching the position of the first game of an
+    SGF file with "find <index> <sgf> [moves]"
+    """
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        stats = build_index(sys.argv[2], sys.argv[3])
+        print(f"Indexed {stats['indexed']} of {stats['games']} games in {stats['seconds']:.2f}s")
+    elif len(sys.argv) in (4, 5) and sys.argv[1] == "find":
+        record = next(iter_games(sys.argv[3]))
+        if len(sys.argv) == 5:
+            record.moves = record.moves[: int(sys.argv[4])]
+        engine = record.replay()
+        with PositionIndex(sys.argv[2]) as index:
+            start = time.perf_counter()
+            found = index.find(engine)
+            elapsed = (time.perf_counter() - start) * 1000
+        for game_id, move in found:
+            print(f"game {game_id} move {move}")
+        print(f"{len(found)} matches in {elapsed:.2f}ms")
+    else:
+        print("usage: position_index.py build <archive> <index> | find <index> <sgf> [moves]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""This module contains the framing of the messages exchanged by the
+Go online clients and the server. Every message is a pickled object
+prefixed by its length, so a message arrives whole however TCP splits
+or joins the bytes that were sent.
+"""
+import pickle
+import struct
+
+# length of the pickled message that follows
+HEADER = struct.Struct("!I")
+# larger messages mean a broken or hostile peer
+MAX_MESSAGE = 16 * 1024 * 1024
+
+
+def send_message(sock, message):
+    """Send one message
+
+    Args:
+        sock (socket): connection to send on
+        message (object): picklable message
+    """
+    send_frame(sock, pickle.dumps(message))
+
+
+def recv_exactly(sock, count):
+    """Receive an exact number of bytes
+
+    Args:
+        sock (socket): connection to receive from
+        count (int): number of bytes
+
+    Raises:
+        ConnectionError: if the connection closes first
+
+    Returns:
+        bytes: the received bytes
+    """
+    data = bytearray()
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def send_frame(sock, data):
+    """Send one message that is already pickled
+
+    Args:
+        sock (socket): connection to send on
+        data (bytes): pickled message
+    """
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_frame(sock):
+    """Receive one message without unpickling it
+
+    Args:
+        sock (socket): connection to receive from
+
+    Raises:
+        ConnectionError: if the connection closes or the message is too large
+
+    Returns:
+        bytes: the pickled message
+    """
+    (length,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    if length > MAX_MESSAGE:
+        raise ConnectionError(f"message of {length} bytes is too large")
+    return recv_exactly(sock, length)
+
+
+def recv_message(sock):
+    """Receive one message
+
+    Args:
+        sock (socket): connection to receive from
+
+    Raises:
+        ConnectionError: if the connection closes or the message is too large
+
+    Returns:
+        object: the unpickled message
+    """
+    return pickle.loads(recv_frame(sock))
@@ -0,0 +1,82 @@
+"""This module contains the TokenBucket and Counters classes used by
+the server to hold back clients that send too much. A token bucket
+lets a client send in bursts up to its capacity but no faster than its
+rate on average, a request over the limit is delayed until the bucket
+has refilled enough.
+"""
+import threading
+
+
+class TokenBucket:
+    """Class representing a token bucket, safe to share between threads
+
+    Args:
+        rate (float): tokens added per second
+        capacity (float): most tokens held, the largest burst allowed
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = None
+        self.lock = threading.Lock()
+
+    def reserve(self, now, cost=1.0):
+        """Take tokens from the bucket, going into debt if it is empty
+
+        Args:
+            now (float): current time in seconds
+            cost (float): tokens taken
+
+        Returns:
+            float: seconds to wait before acting, 0 if within the limit
+        """
+        with self.lock:
+            if self.updated is not None:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= cost
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class Counters:
+    """Class representing named counters shared between threads
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        """Add to a counter
+
+        Args:
+            name (str): name of the counter
+            amount (float): amount added, negative to take away
+        """
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+    def get(self, name):
+        """Get the value of a counter
+
+        Args:
+            name (str): name of the counter
+
+        Returns:
+            float: value of the counter, 0 if never added to
+        """
+        with self.lock:
+            return self.values.get(name, 0)
+
+    def snapshot(self):
+        """Get every counter at once
+
+        Returns:
+            dict: value of every counter
+        """
+        with self.lock:
+            return dict(self.values)
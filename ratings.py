@@ -0,0 +1,364 @@
+"""This module rates players with the Glicko-2 system.
+Ratings are updated after every finished game, and can be recomputed
+from a whole game archive in rating periods, every period being rated
+at once with numpy. Ratings are kept in an SQLite database with the
+most used ones cached in memory for the matchmaker.
+"""
+import math
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from go_board import BLACK_STONE, WHITE_STONE
+from sgf import iter_games
+
+Rating = namedtuple("Rating", ["rating", "deviation", "volatility"])
+
+DEFAULT_RATING = 1500.0
+DEFAULT_DEVIATION = 350.0
+DEFAULT_VOLATILITY = 0.06
+# ratings are converted to the Glicko-2 scale with this factor
+SCALE = 173.7178
+# how much the volatility may change between rating periods
+TAU = 0.5
+# games of every rating period when recomputing from an archive
+PERIOD_GAMES = 10000
+NEW_PLAYER = Rating(DEFAULT_RATING, DEFAULT_DEVIATION, DEFAULT_VOLATILITY)
+
+
+def _volatility(phi, sigma, delta, v, tau=TAU, epsilon=1e-6):
+    """Find the new volatility of players with the Illinois algorithm,
+    every player is solved at once
+
+    Args:
+        phi (np.ndarray): deviations on the Glicko-2 scale
+        sigma (np.ndarray): volatilities
+        delta (np.ndarray): estimated improvements
+        v (np.ndarray): estimated variances of the ratings
+        tau (float): constraint on the change of volatility
+        epsilon (float): tolerance of the solution
+
+    Returns:
+        np.ndarray: new volatilities
+    """
+    a = np.log(sigma ** 2)
+    spread = phi ** 2 + v
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta ** 2 - spread - ex) / (2 * (spread + ex) ** 2) - (x - a) / tau ** 2
+
+    large = delta ** 2 > spread
+    low = np.where(large, np.log(np.maximum(delta ** 2 - spread, 1e-300)), a - tau)
+    # stepping down until f changes sign
+    lower = ~large & (f(low) < 0)
+    while lower.any():
+        low = np.where(lower, low - tau, low)
+        lower &= f(low) < 0
+
+    high, f_high = a, f(a)
+    f_low = f(low)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(100):
+            active = np.abs(low - high) > epsilon
+            if not active.any():
+                break
+            mid = high + (high - low) * f_high / (f_low - f_high)
+            f_mid = f(mid)
+            crossed = f_mid * f_low <= 0
+            high = np.where(active & crossed, low, high)
+            f_high = np.where(active, np.where(crossed, f_low, f_high / 2), f_high)
+            low = np.where(active, mid, low)
+            f_low = np.where(active, f_mid, f_low)
+    return np.exp(high / 2)
+
+
+def rate_period(ratings, deviations, volatilities, player, opponent, score, tau=TAU):
+    """Rate one rating period of many players at once
+
+    Args:
+        ratings (np.ndarray): rating of every player
+        deviations (np.ndarray): rating deviation of every player
+        volatilities (np.ndarray): volatility of every player
+        player (np.ndarray): player of every result
+        opponent (np.ndarray): opponent of every result
+        score (np.ndarray): 1 for a win, 0.5 for a draw, 0 for a loss
+        tau (float): constraint on the change of volatility
+
+    Returns:
+        tuple: new ratings, deviations and volatilities of every player,
+            the deviation of players without results grows
+    """
+    mu = (ratings - DEFAULT_RATING) / SCALE
+    phi = deviations / SCALE
+    count = len(mu)
+
+    g = 1 / np.sqrt(1 + 3 * phi[opponent] ** 2 / math.pi ** 2)
+    expected = 1 / (1 + np.exp(-g * (mu[player] - mu[opponent])))
+    inverse_v = np.bincount(player, g * g * expected * (1 - expected), minlength=count)
+    total = np.bincount(player, g * (score - expected), minlength=count)
+
+    played = inverse_v > 0
+    new_mu = mu.copy()
+    new_sigma = volatilities.copy()
+    new_phi = np.minimum(np.sqrt(phi ** 2 + volatilities ** 2), DEFAULT_DEVIATION / SCALE)
+
+    v = 1 / inverse_v[played]
+    sigma = _volatility(phi[played], volatilities[played], v * total[played], v, tau)
+    phi_star = np.sqrt(phi[played] ** 2 + sigma ** 2)
+    phi_new = 1 / np.sqrt(1 / phi_star ** 2 + 1 / v)
+    new_mu[played] = mu[played] + phi_new ** 2 * total[played]
+    new_phi[played] = phi_new
+    new_sigma[played] = sigma
+    return new_mu * SCALE + DEFAULT_RATING, new_phi * SCALE, new_sigma
+
+
+def rate_game(black, white, score):
+    """Update the ratings of the players of one game, the game is
+    their rating period
+
+    Args:
+        black (Rating): rating of black
+        white (Rating): rating of white
+        score (float): 1 if black won, 0.5 for a draw, 0 if white won
+
+    Returns:
+        tuple: new ratings of black and white
+    """
+    ratings, deviations, volatilities = (
+        np.array(values, dtype=float) for values in zip(black, white)
+    )
+    ratings, deviations, volatilities = rate_period(
+        ratings,
+        deviations,
+        volatilities,
+        np.array([0, 1]),
+        np.array([1, 0]),
+        np.array([score, 1 - score]),
+    )
+    return (
+        Rating(float(ratings[0]), float(deviations[0]), float(volatilities[0])),
+        Rating(float(ratings[1]), float(deviations[1]), float(volatilities[1])),
+    )
+
+
+def recompute(black, white, scores, players, period=PERIOD_GAMES):
+    """Rate every game from scratch, in rating periods of a fixed
+    number of games
+
+    Args:
+        black (np.ndarray): black player of every game, in playing order
+        white (np.ndarray): white player of every game
+        scores (np.ndarray): 1 if black won, 0.5 for a draw, 0 if white won
+        players (int): number of players
+        period (int): games of every rating period
+
+    Returns:
+        tuple: rating, deviation and volatility of every player
+    """
+    ratings = np.full(players, DEFAULT_RATING)
+    deviations = np.full(players, DEFAULT_DEVIATION)
+    volatilities = np.full(players, DEFAULT_VOLATILITY)
+    for start in range(0, len(scores), period):
+        end = start + period
+        ratings, deviations, volatilities = rate_period(
+            ratings,
+            deviations,
+            volatilities,
+            np.concatenate((black[start:end], white[start:end])),
+            np.concatenate((white[start:end], black[start:end])),
+            np.concatenate((scores[start:end], 1 - scores[start:end])),
+        )
+    return ratings, deviations, volatilities
+
+
+def game_score(result):
+    """Get the score of black from an SGF result
+
+    Args:
+        result (str): result such as "B+R", "W+3.5" or "0" for a draw
+
+    Returns:
+        float: 1 if black won, 0.5 for a draw, 0 if white won, None if
+            the game was not finished
+    """
+    if result.startswith("B+"):
+        return 1.0
+    if result.startswith("W+"):
+        return 0.0
+    if result in ("0", "Draw"):
+        return 0.5
+    return None
+
+
+class RatingStore:
+    """Class representing the ratings of every player, stored in an
+    SQLite database with a cache of the most used ratings, used as a
+    context manager
+
+    Args:
+        path (str): path of the database
+        cache_entries (int): ratings kept in memory
+    """
+
+    def __init__(self, path, cache_entries=4096):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ratings "
+            "(name TEXT PRIMARY KEY, rating REAL, deviation REAL, volatility REAL)"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.cache_entries = cache_entries
+        # most recently used ratings last
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, name):
+        """Get the rating of a player, new players get the default rating
+
+        Args:
+            name (str): name of the player
+
+        Returns:
+            Rating: rating of the player
+        """
+        with self.lock:
+            rating = self.cache.get(name)
+            if rating is not None:
+                self.hits += 1
+                self.cache.move_to_end(name)
+                return rating
+            self.misses += 1
+            row = self.db.execute(
+                "SELECT rating, deviation, volatility FROM ratings WHERE name = ?", (name,)
+            ).fetchone()
+            rating = Rating(*row) if row else NEW_PLAYER
+            self._cache(name, rating)
+            return rating
+
+    def _cache(self, name, rating):
+        """Keep a rating in the cache, evicting the least recently used
+
+        Args:
+            name (str): name of the player
+            rating (Rating): rating of the player
+        """
+        self.cache[name] = rating
+        self.cache.move_to_end(name)
+        while len(self.cache) > self.cache_entries:
+            self.cache.popitem(last=False)
+
+    def record_game(self, black, white, winner):
+        """Update the ratings of the players of a finished game
+
+        Args:
+            black (str): name of black
+            white (str): name of white
+            winner (int): 1 if black won, -1 if white won, 0 for a draw
+
+        Returns:
+            tuple: new ratings of black and white
+        """
+        score = {BLACK_STONE: 1.0, WHITE_STONE: 0.0}.get(winner, 0.5)
+        new_black, new_white = rate_game(self.get(black), self.get(white), score)
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?)",
+                [(black,) + tuple(new_black), (white,) + tuple(new_white)],
+            )
+            self.db.commit()
+            self._cache(black, new_black)
+            self._cache(white, new_white)
+        return new_black, new_white
+
+    def recompute(self, records, period=PERIOD_GAMES):
+        """Replace every rating with ratings computed from game records,
+        unfinished games and games without both player names are skipped
+
+        Args:
+            records (iterable): GameRecord of every game, in playing order
+            period (int): games of every rating period
+
+        Returns:
+            int: number of games rated
+        """
+        ids = {}
+        black = []
+        white = []
+        scores = []
+        for record in records:
+            score = game_score(record.result)
+            if score is None or not record.black or not record.white:
+                continue
+            black.append(ids.setdefault(record.black, len(ids)))
+            white.append(ids.setdefault(record.white, len(ids)))
+            scores.append(score)
+        ratings = recompute(
+            np.array(black, dtype=np.int64),
+            np.array(white, dtype=np.int64),
+            np.array(scores, dtype=float),
+            len(ids),
+            period,
+        )
+        rows = [
+            (name, float(ratings[0][index]), float(ratings[1][index]), float(ratings[2][index]))
+            for name, index in ids.items()
+        ]
+        with self.lock:
+            self.db.execute("DELETE FROM ratings")
+            self.db.executemany("INSERT INTO ratings VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+            self.cache.clear()
+        return len(scores)
+
+    def top(self, count=10):
+        """Get the best rated players
+
+        Args:
+            count (int): number of players
+
+        Returns:
+            list: (name, Rating) of the best players
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM ratings ORDER BY rating DESC LIMIT ?", (count,)
+            ).fetchall()
+        return [(row[0], Rating(*row[1:])) for row in rows]
+
+    def close(self):
+        """Close the database
+        """
+        with self.lock:
+            self.db.close()
+
+
+def main():
+    """Recomputes every rating from an SGF collection with
+    "recompute <sgf> <database>"
+    """
+    if len(sys.argv) == 4 and sys.argv[1] == "recompute":
+        start = time.perf_counter()
+        with RatingStore(sys.argv[3]) as store:
+            games = store.recompute(iter_games(sys.argv[2]))
+            print(f"Rated {games} games in {time.perf_counter() - start:.2f}s")
+            for name, rating in store.top():
+                print(f"{name:20} {rating.rating:7.1f} ±{2 * rating.deviation:.0f}")
+    else:
+        print("usage: ratings.py recompute <sgf> <database>")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""This module scores finished games.
+Dead stones are estimated from Monte Carlo ownership: many fast
+playouts are run from the final position and a group that the
+opponent ends up owning in most of them is dead. Games are then
+scored with area (Chinese) or territory (Japanese) rules and komi.
+"""
+import random
+import threading
+
+import numpy as np
+
+from go_board import BLACK_STONE, EMPTY, WHITE_STONE
+from go_bot import KOMI, get_policy, playout
+from transposition import TranspositionTable
+
+AREA = "area"
+TERRITORY = "territory"
+# a group is dead if its mean ownership is this far on the opponent's side
+DEAD_MARGIN = 0.4
+
+
+def point_owners(engine):
+    """Find the owner of every point of a finished playout, empty
+    points belong to a color if all their neighbours are of that color
+
+    Args:
+        engine (GoBoard): board to check
+
+    Returns:
+        list: 1 for black, -1 for white, 0 for no one, for every position
+    """
+    cells = engine.cells
+    owners = list(cells)
+    for pos in range(engine.area):
+        if cells[pos] == EMPTY:
+            owner = None
+            for adj in engine.neighbors[pos]:
+                if owner is None:
+                    owner = cells[adj]
+                elif cells[adj] != owner:
+                    owner = EMPTY
+                    break
+            owners[pos] = owner or EMPTY
+    return owners
+
+
+def ownership(engine, playouts=64, seed=None, policy="random"):
+    """Estimate who owns every point by playing the game out many times
+
+    Args:
+        engine (GoBoard): position to estimate, it is not modified
+        playouts (int): number of playouts
+        seed (int, optional): seed of the random number generator
+        policy (str): playout policy, "random" or "pattern"
+
+    Returns:
+        np.ndarray: (size, size) mean owner, from -1 for white to 1 for black
+    """
+    rng = random.Random(seed)
+    policy = get_policy(policy)
+    total = np.zeros(engine.area)
+    for _ in range(playouts):
+        board = engine.copy()
+        playout(board, rng, policy=policy)
+        total += point_owners(board)
+    return (total / playouts).reshape(engine.size, engine.size)
+
+
+def influence(board, spread=4):
+    """Estimate who controls every point from the stones around it,
+    a vectorized stand-in for ownership while playouts run
+
+    Args:
+        board (np.ndarray): board with 1 for black, -1 for white, 0 for empty
+        spread (int): how many points away a stone has influence
+
+    Returns:
+        np.ndarray: (size, size) control, from -1 for white to 1 for black
+    """
+    field = board.astype(float)
+    for _ in range(spread):
+        padded = np.pad(field, 1)
+        field = field + 0.5 * (
+            padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+        )
+    return np.where(board != EMPTY, board, np.tanh(field / 2))
+
+
+def dead_stones(engine, owned):
+    """Find the groups the opponent owns in most playouts
+
+    Args:
+        engine (GoBoard): position to check
+        owned (np.ndarray): ownership of every point
+
+    Returns:
+        list: positions of the dead stones
+    """
+    flat = owned.ravel()
+    dead = []
+    for stones in engine.groups.values():
+        stones = list(stones)
+        color = engine.cells[stones[0]]
+        if flat[stones].mean() * color < -DEAD_MARGIN:
+            dead.extend(stones)
+    return sorted(dead)
+
+
+def regions(engine, board):
+    """Find the owner of every empty region of a board
+
+    Args:
+        engine (GoBoard): engine giving the neighbours of every point
+        board (list): color of every position
+
+    Returns:
+        list: 1 for black, -1 for white, 0 for no one, for every empty
+            position, None for stones
+    """
+    owners = [None] * engine.area
+    for start in range(engine.area):
+        if board[start] != EMPTY or owners[start] is not None:
+            continue
+        region = [start]
+        owners[start] = EMPTY
+        bordering = set()
+        for pos in region:
+            for adj in engine.neighbors[pos]:
+                if board[adj] == EMPTY:
+                    if owners[adj] is None:
+                        owners[adj] = EMPTY
+                        region.append(adj)
+                else:
+                    bordering.add(board[adj])
+        if len(bordering) == 1:
+            owner = bordering.pop()
+            for pos in region:
+                owners[pos] = owner
+    return owners
+
+
+def score_game(
+    engine,
+    mode=AREA,
+    komi=KOMI,
+    white_captured=None,
+    black_captured=None,
+    playouts=64,
+    seed=None,
+):
+    """Score a finished game, dead stones are removed first
+
+    Args:
+        engine (GoBoard): final position
+        mode (str): AREA counts stones and territory, TERRITORY counts
+            territory and prisoners
+        komi (float): points given to white
+        white_captured (int, optional): white stones captured during the
+            game, taken from the engine if not given
+        black_captured (int, optional): black stones captured during the
+            game, taken from the engine if not given
+        playouts (int): playouts used to find dead stones
+        seed (int, optional): seed of the playouts
+
+    Returns:
+        dict: black and white scores, territory with 1 for black, -1 for
+            white and 0 for no one, and the positions of the dead stones
+    """
+    if white_captured is None:
+        white_captured = engine.white_captured
+    if black_captured is None:
+        black_captured = engine.black_captured
+
+    owned = ownership(engine, playouts, seed)
+    dead = dead_stones(engine, owned)
+    board = list(engine.cells)
+    for pos in dead:
+        # dead stones are prisoners of the opponent
+        if board[pos] == BLACK_STONE:
+            black_captured += 1
+        else:
+            white_captured += 1
+        board[pos] = EMPTY
+
+    owners = regions(engine, board)
+    territory = np.array([owner or 0 for owner in owners]).reshape(engine.size, engine.size)
+    black_territory = int((territory == BLACK_STONE).sum())
+    white_territory = int((territory == WHITE_STONE).sum())
+
+    if mode == AREA:
+        black = black_territory + board.count(BLACK_STONE)
+        white = white_territory + board.count(WHITE_STONE) + komi
+    elif mode == TERRITORY:
+        black = black_territory + white_captured
+        white = white_territory + black_captured + komi
+    else:
+        raise ValueError(f"unknown scoring mode {mode}")
+    return {"black": black, "white": white, "territory": territory, "dead": dead}
+
+
+class OwnershipWorker:
+    """Class estimating ownership on a background thread, a quick
+    influence estimate is published first then refined with playouts,
+    and finished estimates are kept by position
+
+    Args:
+        playouts (int): playouts run for every position
+        batch (int): playouts run between two published estimates
+        max_bytes (int): memory used to keep finished estimates
+    """
+
+    def __init__(self, playouts=64, batch=8, max_bytes=8 * 1024 * 1024):
+        self.playouts = playouts
+        self.batch = batch
+        self.table = TranspositionTable(max_bytes)
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.position = None
+        # incremented for every new position, stale estimates are dropped
+        self.generation = 0
+        self.owned = None
+        # incremented for every published estimate
+        self.version = 0
+        # True until the requested position is fully estimated
+        self.busy = False
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def request(self, engine):
+        """Start estimating a position, the previous one is abandoned
+
+        Args:
+            engine (GoBoard): position to estimate, it is copied
+        """
+        position = engine.copy()
+        with self.lock:
+            self.position = position
+            self.generation += 1
+            self.busy = True
+        self.wake.set()
+
+    def result(self):
+        """Get the latest estimate
+
+        Returns:
+            tuple: (size, size) ownership or None, and its version
+        """
+        with self.lock:
+            return self.owned, self.version
+
+    def _publish(self, owned, generation):
+        """Publish an estimate unless a newer position was requested
+
+        Args:
+            owned (np.ndarray): ownership estimate
+            generation (int): generation of the estimated position
+
+        Returns:
+            bool: False if the estimate is stale
+        """
+        with self.lock:
+            if generation != self.generation:
+                return False
+            self.owned = owned
+            self.version += 1
+            return True
+
+    def _run(self):
+        """Estimate every requested position until closed
+        """
+        rng = random.Random()
+        policy = get_policy("random")
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if not self.running:
+                return
+            with self.lock:
+                engine, generation = self.position, self.generation
+            self._estimate(engine, generation, rng, policy)
+            with self.lock:
+                if generation == self.generation:
+                    self.busy = False
+
+    def _estimate(self, engine, generation, rng, policy):
+        """Publish better and better estimates of a position until
+        done or a newer position is requested
+
+        Args:
+            engine (GoBoard): position to estimate
+            generation (int): generation of the position
+            rng (random.Random): random number generator of the playouts
+            policy (function): playout policy
+        """
+        key = engine.key()
+        entry = self.table.get(key)
+        if entry is not None and entry.score is not None:
+            self._publish(entry.score[0], generation)
+            return
+        if not self._publish(influence(engine.board), generation):
+            return
+        total = np.zeros(engine.area)
+        done = 0
+        while done < self.playouts:
+            for _ in range(self.batch):
+                board = engine.copy()
+                playout(board, rng, policy=policy)
+                total += point_owners(board)
+            done += self.batch
+            owned = (total / done).reshape(engine.size, engine.size)
+            if not self._publish(owned, generation):
+                return
+        self.table.store_score(key, (owned,))
+
+    def close(self):
+        """Stop the thread once its current batch is done
+        """
+        self.running = False
+        self.wake.set()
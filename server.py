@@ -1,106 +1,710 @@
 """Server for Go online
 """
+import os
 import pickle
+import queue
 import socket
+import sys
 import threading
+import time
+
+from game_archive import winner_of
+from game_clock import BYOYOMI, GameClock, TimeControl, TimerHeap
+from game_history import GameHistory
+from game_store import GameStore
+from go_board import BLACK_STONE, MAX_SIZE, MIN_SIZE, PASS, WHITE_STONE
+from go_bot import KOMI
+from position_index import PositionIndex
+from protocol import recv_frame, send_message
+from rate_limit import Counters, TokenBucket
+from ratings import DEFAULT_RATING, RatingStore
+from scoring import AREA, score_game
+from sgf import iter_game_texts, save_game
+from traffic import TrafficCapture
 
 HOST = socket.gethostbyname(socket.gethostname())
 PORT = 5000
+# board size used when a client does not ask for a valid one
+DEFAULT_SIZE = 19
+# clients poll several times a second, one silent this long is gone
+CLIENT_TIMEOUT = 30
+# time given to each player, can be changed on the command line
+TIME_CONTROL = TimeControl(BYOYOMI, 600, periods=5, period_time=30)
+# finished games are appended to this SGF collection
+ARCHIVE_PATH = os.path.join(os.getcwd(), "archive", "games.sgf")
+# positions of the archived games, updated as games finish
+INDEX_PATH = os.path.join(os.getcwd(), "archive", "index")
+# archived games are indexed in batches of up to this many games, a
+# game waits at most INDEX_INTERVAL seconds for its batch
+INDEX_BATCH = 64
+INDEX_INTERVAL = 5.0
+# ratings of the players, updated as games finish
+RATINGS_PATH = os.path.join(os.getcwd(), "archive", "ratings.db")
+# players are paired when their ratings are this close, the gap
+# allowed grows by MATCH_WIDEN points for every second waited
+MATCH_WINDOW = 200
+MATCH_WIDEN = 10
+# longest player name kept
+MAX_NAME = 40
+# most games a single connection can play at once
+MAX_CHANNELS = 64
+# requests per second and largest burst of a connection and of an address
+CONNECTION_RATE = 100
+CONNECTION_BURST = 200
+ADDRESS_RATE = 400
+ADDRESS_BURST = 800
+# a client further behind its limit than this many seconds is dropped
+MAX_THROTTLE = 5.0
+# most connections at once, in total and from one address
+MAX_CONNECTIONS = 1000
+MAX_ADDRESS_CONNECTIONS = 32
+# False to lift the limits of an address, every connection of a replay
+# comes from the address of the replaying machine, set by "--replay"
+ADDRESS_LIMITS = True
+# bytes the kernel buffers for a client, a client not taking a reply
+# within SEND_TIMEOUT seconds is dropped as too slow
+SEND_BUFFER = 256 * 1024
+SEND_TIMEOUT = 5.0
+# requests handled at once above which optional work is shed
+SHED_LOAD = 64
+# games unused for this many seconds, or pushed out of the bytes of
+# games kept in memory, are hibernated to disk until used again
+HIBERNATE_AFTER = 600
+RESIDENT_BYTES = 256 * 1024 * 1024
+# seconds between sweeps for idle games to hibernate
+SWEEP_INTERVAL = 60
+HIBERNATE_PATH = os.path.join(os.getcwd(), "archive", "hibernated")
 
-# Contains actual informatino of each active game
-GAMES = {}
+# Contains the history of each active game, played on the server's own
+# rules engine, idle games are hibernated, opened by main
+GAMES = None
+# Contains the board size of each active game
+GAMES_SIZE = {}
 # Contains meta-information of each active game
 GAMES_STATUS = {}
+# Contains the clocks of each active game, the server's clock is the real one
+GAMES_CLOCK = {}
+# Contains the names of the black and white players of each active game
+GAMES_PLAYERS = {}
+# Contains the number of moves accepted in each active game, so a
+# client that has the latest game is not sent it again
+GAMES_VERSION = {}
+# deadline of every running clock, watched by a single thread
+TIMERS = TimerHeap()
+CLOCK_LOCK = threading.Lock()
+ARCHIVE_LOCK = threading.Lock()
+# games waiting for their second player for every board size, as
+# (game number, rating of player 0, time waited from)
+WAITING = {}
+# counts how many games have been created
+GAME_COUNT = 0
+MATCH_LOCK = threading.Lock()
+# open connections and request bucket of every client address
+ADDRESSES = {}
+ADDRESS_LOCK = threading.Lock()
+# throttled, shed and refused traffic, answered by the STATS request
+STATS = Counters()
+# index of the archived positions, opened by main and written by a
+# single thread
+INDEX = None
+# archived games waiting to be indexed, as (archive id, size, moves),
+# None stops the thread
+INDEX_QUEUE = queue.Queue()
+# ratings of the players, opened by main
+RATINGS = None
+# capture of the traffic received, opened by main when asked for
+CAPTURE = None
+# number of games in the archive, the id of the next archived game
+ARCHIVE_COUNT = 0
 
 
-def threaded_client(serve, num, game_id):
-    """For each player connected, manage which game the player
-    plays, and determine whether game has started. Also facilitate
-    the communication of game state between players
+def game_result(history, clock):
+    """Get the result of a game that ended
+
+    Args:
+        history (GameHistory): moves of the game
+        clock (GameClock): clock of the game, None if it has none
+
+    Returns:
+        str: SGF result, empty if the game was abandoned
+    """
+    moves = history.moves
+    if len(moves) >= 2 and moves[-1][1] == PASS and moves[-2][1] == PASS:
+        # both players passed, the clock may have run on after that
+        score = score_game(history.engine, AREA, KOMI)
+        margin = score["black"] - score["white"]
+        if margin > 0:
+            return f"B+{margin:g}"
+        if margin < 0:
+            return f"W+{-margin:g}"
+        return "0"
+    if clock is not None and clock.flagged is not None:
+        return "W+T" if clock.flagged == BLACK_STONE else "B+T"
+    return ""
+
+
+def archive_game(game_id, history, clock=None):
+    """Append the moves of a finished game to the archive and rate
+    its players
+
+    Args:
+        game_id (int): the game number
+        history (GameHistory): moves of the game, None if it never started
+        clock (GameClock, optional): clock of the game
+    """
+    global ARCHIVE_COUNT
+    black, white = (name or "" for name in GAMES_PLAYERS.pop(game_id, ("", "")))
+    if history is None or not len(history):
+        return
+    record = history.to_record()
+    record.komi = KOMI
+    record.black = black
+    record.white = white
+    record.result = game_result(history, clock)
+    with ARCHIVE_LOCK:
+        os.makedirs(os.path.dirname(ARCHIVE_PATH), exist_ok=True)
+        save_game(record, ARCHIVE_PATH)
+        if INDEX is not None:
+            # games are indexed by their place in the archive
+            INDEX_QUEUE.put((ARCHIVE_COUNT, history.size, list(history.moves)))
+        ARCHIVE_COUNT += 1
+        if RATINGS is not None and record.result and black and white and black != white:
+            RATINGS.record_game(black, white, winner_of(record.result))
+
+
+def index_games():
+    """Index the archived games in batches, this single thread writes
+    the index so a finishing game never waits for it
+    """
+    running = True
+    while running:
+        batch = [INDEX_QUEUE.get()]
+        deadline = time.monotonic() + INDEX_INTERVAL
+        while batch[-1] is not None and len(batch) < INDEX_BATCH:
+            try:
+                batch.append(INDEX_QUEUE.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        if batch[-1] is None:
+            batch.pop()
+            running = False
+        for game_id, size, moves in batch:
+            try:
+                INDEX.add_game(game_id, size, moves)
+            except ValueError:
+                # the moves were checked when played, skipped all the same
+                continue
+        # one segment for the whole batch
+        INDEX.flush()
+
+
+def game_size(game):
+    """Estimate the memory used by an active game
+
+    Args:
+        game (GameHistory): history of the game
+
+    Returns:
+        int: approximate size in bytes
+    """
+    return game.nbytes()
+
+
+def game_view(history):
+    """Get the state of a game to send to a client, read from the
+    server's rules engine so a client cannot show its opponent a
+    board of its own making
+
+    Args:
+        history (GameHistory): moves of the game
+
+    Returns:
+        tuple: color to move, number of moves, last move (None before
+            the first), board and captured white and black stones
+    """
+    engine = history.engine
+    return (
+        "BLACK" if engine.to_play == BLACK_STONE else "WHITE",
+        len(history),
+        history.moves[-1][1] if history.moves else None,
+        engine.board,
+        engine.white_captured,
+        engine.black_captured,
+    )
+
+
+def server_stats():
+    """Get the traffic counters and the games held by the server
+
+    Returns:
+        dict: value of every counter
+    """
+    stats = STATS.snapshot()
+    stats["resident_games"] = len(GAMES.resident)
+    stats["resident_bytes"] = GAMES.resident_bytes
+    stats["hibernated_games"] = len(GAMES.hibernated)
+    stats["hibernations"] = GAMES.hibernations
+    stats["rehydrations"] = GAMES.rehydrations
+    return stats
+
+
+def find_match(waiting, rating, now):
+    """Find the waiting game whose player is closest in rating
+
+    Args:
+        waiting (list): (game id, rating, time waited from) of every
+            game waiting for a second player
+        rating (float): rating of the player looking for a game
+        now (float): current time in seconds
+
+    Returns:
+        int: index of the game in waiting, None if no player is close enough
+    """
+    best = None
+    best_gap = None
+    for index, (_, other, since) in enumerate(waiting):
+        gap = abs(other - rating)
+        if gap > MATCH_WINDOW + MATCH_WIDEN * (now - since):
+            continue
+        if best_gap is None or gap < best_gap:
+            best = index
+            best_gap = gap
+    return best
+
+
+def watch_clocks():
+    """Flag the players who run out of time, this single thread
+    watches the clocks of every game
+    """
+    while True:
+        for game_id in TIMERS.wait_expired():
+            with CLOCK_LOCK:
+                clock = GAMES_CLOCK.get(game_id)
+                if clock is not None and clock.flag(time.monotonic()):
+                    color = "BLACK" if clock.flagged == BLACK_STONE else "WHITE"
+                    print(f"{color} ran out of time in game {game_id}")
+
+
+def sweep_games():
+    """Hibernate idle games on a timer, the store only finds them by
+    itself when a game is used
+    """
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        GAMES.sweep()
+
+
+def start_clock(game_id):
+    """Start the clock of a game once both players are connected
+
+    Args:
+        game_id (int): the game number
+    """
+    with CLOCK_LOCK:
+        clock = GAMES_CLOCK[game_id]
+        clock.start(time.monotonic())
+        TIMERS.schedule(game_id, clock.deadline())
+
+
+def clock_state(game_id):
+    """Get the state of the clock of a game to send to a client
+
+    Args:
+        game_id (int): the game number
+
+    Returns:
+        tuple: state of the clock
+    """
+    with CLOCK_LOCK:
+        return GAMES_CLOCK[game_id].state(time.monotonic())
+
+
+def play_move(game_id, history, num, move):
+    """Validate a move with the rules engine and the clock, then play it
+
+    Args:
+        game_id (int): the game number
+        history (GameHistory): moves of the game
+        num (int): the player number (0 and 1)
+        move (int): position of the move, or PASS
+
+    Returns:
+        bool: True if the move was played
+    """
+    color = BLACK_STONE if num == 0 else WHITE_STONE
+    if not GAMES_STATUS[game_id] or history.engine.to_play != color:
+        return False
+    if not isinstance(move, int) or not PASS <= move < history.engine.area:
+        return False
+    if move != PASS and not history.engine.is_legal(move):
+        return False
+    with CLOCK_LOCK:
+        clock = GAMES_CLOCK[game_id]
+        if not clock.press(color, time.monotonic()):
+            # the move came in after the player ran out of time
+            TIMERS.cancel(game_id)
+            return False
+        TIMERS.schedule(game_id, clock.deadline())
+    history.play(move)
+    return True
+
+
+def open_game(size, name):
+    """Put a player in a game, pairing players asking for the same
+    size and close in rating
+
+    Args:
+        size (int): size of the board asked for
+        name (str): name of the player, empty if anonymous
+
+    Returns:
+        tuple: player number (0 and 1) and game number
+    """
+    global GAME_COUNT
+    rating = RATINGS.get(name).rating if RATINGS is not None and name else DEFAULT_RATING
+    with MATCH_LOCK:
+        games = WAITING.setdefault(size, [])
+        match = find_match(games, rating, time.monotonic())
+        if match is None:
+            game_id = GAME_COUNT
+            GAME_COUNT += 1
+            games.append((game_id, rating, time.monotonic()))
+            # since only player 0 has connected, do not start game yet
+            GAMES_STATUS[game_id] = False
+            GAMES_SIZE[game_id] = size
+            GAMES_PLAYERS[game_id] = [name, None]
+            print(f"Player 0 started game {game_id}")
+            return 0, game_id
+        game_id = games.pop(match)[0]
+        GAMES_PLAYERS[game_id][1] = name
+        print(f"Player 1 connected to game {game_id}")
+        if game_id in GAMES:
+            start_game(game_id)
+        return 1, game_id
+
+
+def start_game(game_id):
+    """Start a game once player 0 sent it and player 1 joined,
+    called with MATCH_LOCK held
+
+    Args:
+        game_id (int): the game number
+    """
+    GAMES_STATUS[game_id] = True
+    start_clock(game_id)
+
+
+def create_game(game_id):
+    """Start managing the game of player 0 on an empty board
+
+    Args:
+        game_id (int): the game number
+    """
+    with MATCH_LOCK:
+        if game_id not in GAMES_STATUS or game_id in GAMES:
+            return
+        GAMES[game_id] = GameHistory(GAMES_SIZE[game_id])
+        GAMES_VERSION[game_id] = 0
+        GAMES_CLOCK[game_id] = GameClock(TIME_CONTROL)
+        if GAMES_PLAYERS[game_id][1] is not None:
+            start_game(game_id)
+
+
+def handle_request(num, game_id, request, shed=False):
+    """Answer a request of a player about its game
 
     Args:
-        serve (client connection): the connection to the client/player
         num (int): the player number (0 and 1)
         game_id (int): the game number
+        request (tuple): name of the request followed by its arguments
+        shed (bool): True when the server is overloaded, optional work
+            is skipped
+
+    Raises:
+        KeyError: if the game was deleted
+
+    Returns:
+        object: the reply
     """
-    connected = True
-    try:
-        with serve:
-            # sending player number
-            serve.send(str.encode(str(num)))
-            # sending game id
-            serve.send(str.encode(str(game_id)))
-
-            if num == 0:
-                # if player 0, then receive the Go game to manage it
-                GAMES[game_id] = pickle.loads(serve.recv(4096))
-                print(f"Player {num} started game {game_id}")
-                # since only player 0 has connected, do not start game yet
-                GAMES_STATUS[game_id] = False
-            else:
-                print(f"Player {num} connected to game {game_id}")
-                # if player 1, check whether player 0 has left game
-                if game_id in GAMES_STATUS:
-                    # if player 0 present, start game
-                    GAMES_STATUS[game_id] = True
-                else:
-                    connected = False
+    if request[0] == "GET":
+        # sending information of the game, also the heartbeat, the
+        # client may give the version of the game it already has
+        if not GAMES_STATUS[game_id]:
+            return False
+        version = GAMES_VERSION[game_id]
+        if shed:
+            # nothing new, the client keeps running its own clock and
+            # asks again for the version it has
+            STATS.add("shed")
+            return (None, None, request[1] if len(request) > 1 else None)
+        if len(request) > 1 and request[1] == version:
+            return (None, clock_state(game_id), version)
+        return (game_view(GAMES[game_id]), clock_state(game_id), version)
+    if request[0] == "POST":
+        # receiving a move, the client already shows it and
+        # takes it back if it is rejected
+        _, seq, move = request
+        history = GAMES[game_id]
+        accepted = play_move(game_id, history, num, move)
+        if accepted:
+            # stored again so the store sees the game grow
+            GAMES[game_id] = history
+            GAMES_VERSION[game_id] += 1
+        return (seq, accepted)
+    if request[0] == "SEEK":
+        # sending the board after the requested move
+        history = GAMES.get(game_id)
+        if history is None or shed:
+            STATS.add("shed", int(shed))
+            return None
+        return history.board_at(request[1])
+    if request[0] == "START" and num == 0:
+        create_game(game_id)
+        return True
+    return None
 
-            while connected:
-                # game is running
-                data = serve.recv(4096).decode()
 
-                if not data:
-                    connected = False
-                else:
-                    if data == "GET":
-                        # sending information of the game
-                        if GAMES_STATUS[game_id]:
-                            serve.sendall(pickle.dumps(GAMES[game_id]))
-                        else:
-                            serve.sendall(pickle.dumps(False))
-                    elif data == "POST":
-                        # receiving information of the game
-                        request_obj = pickle.loads(serve.recv(4096))
-                        GAMES[game_id] = request_obj
-                    else:
-                        connected = False
-
-        # first player to leave deleting the game
-        print(f"Player {num} lost connection")
-        del GAMES[game_id]
+def leave_game(num, game_id):
+    """Take a player out of its game, the first player to leave
+    deletes the game
+
+    Args:
+        num (int): the player number (0 and 1)
+        game_id (int): the game number
+    """
+    print(f"Player {num} lost connection")
+    with MATCH_LOCK:
+        if game_id not in GAMES_STATUS:
+            # if cannot delete game, that means game already deleted
+            return
+        for games in WAITING.values():
+            games[:] = [game for game in games if game[0] != game_id]
+        history = GAMES.pop(game_id, None)
+        GAMES_VERSION.pop(game_id, None)
+        GAMES_SIZE.pop(game_id, None)
         del GAMES_STATUS[game_id]
-    except KeyError:
-        # if cannot delete game, that means game already deleted
-        print(f"Player {num} lost connection")
+        TIMERS.cancel(game_id)
+        clock = GAMES_CLOCK.pop(game_id, None)
+    archive_game(game_id, history, clock)
 
 
-def main():
-    """Starts the server and waits for players to connect
+def admit(address):
+    """Let a new connection in unless the server or its address has
+    too many already
+
+    Args:
+        address (str): address of the client
+
+    Returns:
+        TokenBucket: request bucket shared by the connections of the
+            address, None if the connection is refused
     """
-    # counts how many players have connected to server
-    id_count = 0
+    with ADDRESS_LOCK:
+        entry = ADDRESSES.get(address)
+        if STATS.get("connections") >= MAX_CONNECTIONS or (
+            ADDRESS_LIMITS and entry is not None and entry[0] >= MAX_ADDRESS_CONNECTIONS
+        ):
+            STATS.add("refused")
+            return None
+        if entry is None:
+            entry = ADDRESSES[address] = [0, TokenBucket(ADDRESS_RATE, ADDRESS_BURST)]
+        entry[0] += 1
+        STATS.add("connections")
+        return entry[1]
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
-        server.settimeout(300)
-        server.bind((HOST, PORT))
-        server.listen()
-        print("Server started, listening for connections")
 
-        while True:
-            conn, addr = server.accept()
-            print(f"Connected to: {addr}")
+def release(address):
+    """Forget a closed connection of an address
 
-            # every two player means one game
-            game_id = id_count // 2
-            player_num = id_count % 2
+    Args:
+        address (str): address of the client
+    """
+    with ADDRESS_LOCK:
+        entry = ADDRESSES[address]
+        entry[0] -= 1
+        if not entry[0]:
+            del ADDRESSES[address]
+        STATS.add("connections", -1)
+
+
+def throttle(buckets):
+    """Hold a request back until every bucket allows it, so a client
+    sending too much only slows itself down
+
+    Args:
+        buckets (list): request buckets of the connection and its address
+
+    Raises:
+        ConnectionError: if the client is too far over its limit
+    """
+    now = time.monotonic()
+    delay = max([bucket.reserve(now) for bucket in buckets])
+    if delay > 0:
+        STATS.add("throttled")
+        STATS.add("throttled_seconds", delay)
+        if delay > MAX_THROTTLE:
+            STATS.add("dropped")
+            raise ConnectionError("client over its request limit")
+        time.sleep(delay)
+
+
+def send_reply(serve, message):
+    """Send a reply, dropping a client too slow to take it
+
+    Args:
+        serve (client connection): the connection to the client/player
+        message (object): the reply
+
+    Raises:
+        socket.timeout: if the client did not take the reply in time
+    """
+    serve.settimeout(SEND_TIMEOUT)
+    try:
+        send_message(serve, message)
+    except socket.timeout:
+        STATS.add("slow_consumers")
+        raise
+    serve.settimeout(CLIENT_TIMEOUT)
 
-            player = threading.Thread(
-                target=threaded_client, args=[conn, player_num, game_id]
-            )
-            player.start()
 
-            id_count += 1
+def serve_connection(serve, address_bucket, address, connection_id):
+    """Serve every game played over a connection, each game is on its
+    own channel and a request is answered on the channel it came on
+
+    Args:
+        serve (client connection): the connection to the client/player
+        address_bucket (TokenBucket): request bucket of the address
+        address (str): address of the client
+        connection_id (int): id of the connection in the traffic capture
+    """
+    # (player number, game number, sequence number) of every channel
+    channels = {}
+    buckets = [TokenBucket(CONNECTION_RATE, CONNECTION_BURST)]
+    if ADDRESS_LIMITS:
+        buckets.append(address_bucket)
+    try:
+        with serve:
+            serve.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+            serve.settimeout(CLIENT_TIMEOUT)
+            while True:
+                frame = recv_frame(serve)
+                if CAPTURE is not None:
+                    CAPTURE.message(connection_id, frame)
+                channel, seq, request = pickle.loads(frame)
+                throttle(buckets)
+                STATS.add("requests")
+                if request[0] == "STATS":
+                    send_reply(serve, (channel, seq, server_stats()))
+                    continue
+                if request[0] == "OPEN":
+                    reply = None
+                    _, size, name = request
+                    if channel not in channels and len(channels) < MAX_CHANNELS:
+                        if not isinstance(size, int) or not MIN_SIZE <= size <= MAX_SIZE:
+                            size = DEFAULT_SIZE
+                        name = name[:MAX_NAME] if isinstance(name, str) else ""
+                        num, game_id = open_game(size, name)
+                        channels[channel] = [num, game_id, seq]
+                        # sending player number, game id and board size
+                        reply = (num, game_id, size)
+                    send_reply(serve, (channel, seq, reply))
+                    continue
+
+                if channel not in channels:
+                    # the game of the channel is over
+                    send_reply(serve, (channel, seq, None))
+                    continue
+                num, game_id, last = channels[channel]
+                if seq != last + 1:
+                    raise ConnectionError(f"request {seq} out of order on channel {channel}")
+                channels[channel][2] = seq
+                reply = None
+                if request[0] == "CLOSE":
+                    del channels[channel]
+                    leave_game(num, game_id)
+                else:
+                    STATS.add("handling")
+                    try:
+                        shed = STATS.get("handling") > SHED_LOAD
+                        reply = handle_request(num, game_id, request, shed)
+                    except KeyError:
+                        # game already deleted by the other player
+                        del channels[channel]
+                    finally:
+                        STATS.add("handling", -1)
+                send_reply(serve, (channel, seq, reply))
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, ValueError, TypeError):
+        # closed, silent for too long, too slow or sending garbage
+        pass
+
+    for num, game_id, _ in channels.values():
+        leave_game(num, game_id)
+    release(address)
+    if CAPTURE is not None:
+        CAPTURE.disconnect(connection_id)
+
+
+def main():
+    """Starts the server and waits for players to connect, the time
+    control can be given on the command line, e.g. "fischer:300+10",
+    followed by a file to capture the traffic received to. "--replay"
+    anywhere on the command line lifts the limits of an address for
+    replaying a capture
+    """
+    global TIME_CONTROL, GAMES, INDEX, RATINGS, ARCHIVE_COUNT, CAPTURE, ADDRESS_LIMITS
+    args = [arg for arg in sys.argv[1:] if arg != "--replay"]
+    if len(args) < len(sys.argv) - 1:
+        ADDRESS_LIMITS = False
+    if len(args) > 0:
+        TIME_CONTROL = TimeControl.parse(args[0])
+    if len(args) > 1:
+        CAPTURE = TrafficCapture(args[1])
+    if os.path.exists(ARCHIVE_PATH):
+        ARCHIVE_COUNT = sum(1 for _ in iter_game_texts(ARCHIVE_PATH))
+    GAMES = GameStore(HIBERNATE_PATH, RESIDENT_BYTES, HIBERNATE_AFTER, game_size)
+    # games hibernated by an earlier server can not be resumed
+    GAMES.clear()
+    INDEX = PositionIndex(INDEX_PATH)
+    RATINGS = RatingStore(RATINGS_PATH)
+    threading.Thread(target=watch_clocks, daemon=True).start()
+    threading.Thread(target=sweep_games, daemon=True).start()
+    indexer = threading.Thread(target=index_games, daemon=True)
+    indexer.start()
+
+    connection_id = 0
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.settimeout(300)
+            server.bind((HOST, PORT))
+            server.listen()
+            print("Server started, listening for connections")
+
+            while True:
+                conn, addr = server.accept()
+                connection_id += 1
+                if CAPTURE is not None:
+                    CAPTURE.connect(connection_id, addr[0])
+                address_bucket = admit(addr[0])
+                if address_bucket is None:
+                    # shedding connections the server can not take
+                    conn.close()
+                    if CAPTURE is not None:
+                        CAPTURE.disconnect(connection_id)
+                    continue
+                print(f"Connected to: {addr}")
+                # one thread per connection, however many games it carries
+                player = threading.Thread(
+                    target=serve_connection,
+                    args=[conn, address_bucket, addr[0], connection_id],
+                )
+                player.start()
+    finally:
+        # the games still queued are written before the index is closed
+        INDEX_QUEUE.put(None)
+        indexer.join()
+        INDEX.close()
+        if CAPTURE is not None:
+            CAPTURE.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,367 @@
+"""This module reads and writes games in the SGF format.
+Large collections are streamed one game at a time and every game
+can be replayed through the GoBoard rules engine to validate it.
+"""
+import re
+import sys
+import time
+
+from go_board import BLACK_STONE, PASS, WHITE_STONE, GoBoard
+
+# characters that change the state of the SGF scanner
+SPECIAL = re.compile(r"[()\[\]\\]")
+PROPERTY = re.compile(r"([A-Z]+)((?:\s*\[(?:[^\]\\]|\\.)*\])+)", re.DOTALL)
+VALUE = re.compile(r"\[((?:[^\]\\]|\\.)*)\]", re.DOTALL)
+
+COLORS = {"B": BLACK_STONE, "W": WHITE_STONE}
+LETTERS = {BLACK_STONE: "B", WHITE_STONE: "W"}
+
+
+class GameRecord:
+    """Class representing the main line of a recorded game
+
+    Args:
+        size (int): size of the board
+        moves (list): (color, position) of every move, position is PASS for passes
+        setup (list, optional): (color, position) of stones placed before the game
+        komi (float): points given to white
+        result (str): result of the game, e.g. "B+R" or "W+3.5"
+        black (str): name of the black player
+        white (str): name of the white player
+    """
+
+    def __init__(self, size, moves, setup=None, komi=0.0, result="", black="", white=""):
+        self.size = size
+        self.moves = moves
+        self.setup = setup or []
+        self.komi = komi
+        self.result = result
+        self.black = black
+        self.white = white
+
+    @classmethod
+    def from_engine(cls, engine, **info):
+        """Create a record of the moves played on an engine
+
+        Args:
+            engine (GoBoard): engine whose history is recorded
+            **info: komi, result and player names of the game
+
+        Returns:
+            GameRecord: record of the game
+        """
+        moves = [(color, pos) for pos, color, _, _ in engine.history]
+        return cls(engine.size, moves, **info)
+
+    def replay(self):
+        """Play the game through the rules engine
+
+        Raises:
+            ValueError: if a move is illegal
+
+        Returns:
+            GoBoard: engine at the end of the game
+        """
+        engine = GoBoard(self.size)
+        if self.setup:
+            board = engine.board
+            for color, pos in self.setup:
+                board.flat[pos] = color
+            first = self.moves[0][0] if self.moves else BLACK_STONE
+            engine.load(board, first)
+        for color, pos in self.moves:
+            if color != engine.to_play:
+                # two moves of the same color in a row, the other color passed
+                engine.play(PASS)
+            engine.play(pos)
+        return engine
+
+
+def decode_point(value, size):
+    """Convert SGF coordinates to a position
+
+    Args:
+        value (str): two letters, column then row, empty for a pass
+        size (int): size of the board
+
+    Raises:
+        ValueError: if the point is not two letters on the board
+
+    Returns:
+        int: position of the point, or PASS
+    """
+    if not value or (value == "tt" and size <= 19):
+        return PASS
+    if len(value) != 2:
+        raise ValueError(f"bad point {value!r}")
+    col = ord(value[0]) - ord("a")
+    row = ord(value[1]) - ord("a")
+    if not (0 <= col < size and 0 <= row < size):
+        raise ValueError(f"point {value!r} is off the {size}x{size} board")
+    return row * size + col
+
+
+def encode_point(pos, size):
+    """Convert a position to SGF coordinates
+
+    Args:
+        pos (int): position of the point, or PASS
+        size (int): size of the board
+
+    Returns:
+        str: two letters, column then row, empty for a pass
+    """
+    if pos == PASS:
+        return ""
+    row, col = divmod(pos, size)
+    return chr(ord("a") + col) + chr(ord("a") + row)
+
+
+def parse_game(text):
+    """Parse the main line of a single SGF game
+
+    Args:
+        text (str): SGF text of one game
+
+    Raises:
+        ValueError: if a property or a point can not be read
+
+    Returns:
+        GameRecord: record of the game
+    """
+    # the main line ends where the first variation closes
+    scanner = Scanner()
+    cuts = []
+    for index, char in scanner.feed(text):
+        cuts.append(index)
+        if char == ")":
+            break
+    parts = []
+    start = 0
+    for index in cuts:
+        parts.append(text[start:index])
+        start = index + 1
+    body = "".join(parts)
+
+    size = 19
+    komi = 0.0
+    info = {}
+    setup = []
+    moves = []
+    for match in PROPERTY.finditer(body):
+        name = match.group(1)
+        values = VALUE.findall(match.group(2))
+        if name == "SZ":
+            size = int(values[0].split(":")[0])
+        elif name == "KM":
+            komi = float(values[0] or 0)
+        elif name == "RE":
+            info["result"] = _unescape(values[0])
+        elif name == "PB":
+            info["black"] = _unescape(values[0])
+        elif name == "PW":
+            info["white"] = _unescape(values[0])
+        elif name in ("AB", "AW"):
+            color = COLORS[name[1]]
+            setup.extend((color, value) for value in values)
+        elif name in COLORS:
+            moves.append((COLORS[name], values[0]))
+
+    setup = [(color, decode_point(value, size)) for color, value in setup]
+    moves = [(color, decode_point(value, size)) for color, value in moves]
+    return GameRecord(size, moves, setup, komi, **info)
+
+
+class Scanner:
+    """Class finding the parentheses of SGF text that are not inside
+    property values, the text can be fed in chunks
+    """
+
+    def __init__(self):
+        self.in_value = False
+        # whether the first character of the next chunk is escaped
+        self.skip_first = False
+
+    def feed(self, chunk):
+        """Scan a chunk of text
+
+        Args:
+            chunk (str): next chunk of the text
+
+        Yields:
+            tuple: index and character of every parenthesis in the chunk
+        """
+        next_free = 1 if self.skip_first else 0
+        self.skip_first = False
+        for match in SPECIAL.finditer(chunk):
+            index = match.start()
+            if index < next_free:
+                # escaped by the previous backslash
+                continue
+            char = match.group()
+            if self.in_value:
+                if char == "\\":
+                    next_free = index + 2
+                    self.skip_first = next_free > len(chunk)
+                elif char == "]":
+                    self.in_value = False
+            elif char == "[":
+                self.in_value = True
+            elif char in "()":
+                yield index, char
+
+
+def write_game(record):
+    """Write a game as SGF
+
+    Args:
+        record (GameRecord): game to write
+
+    Returns:
+        str: SGF text of the game
+    """
+    size = record.size
+    header = [f"(;GM[1]FF[4]SZ[{size}]KM[{record.komi:g}]"]
+    if record.black:
+        header.append(f"PB[{_escape(record.black)}]")
+    if record.white:
+        header.append(f"PW[{_escape(record.white)}]")
+    if record.result:
+        header.append(f"RE[{_escape(record.result)}]")
+    for color in (BLACK_STONE, WHITE_STONE):
+        points = [encode_point(pos, size) for stone, pos in record.setup if stone == color]
+        if points:
+            header.append(f"A{LETTERS[color]}" + "".join(f"[{p}]" for p in points))
+    moves = [f";{LETTERS[color]}[{encode_point(pos, size)}]" for color, pos in record.moves]
+    return "".join(header) + "".join(moves) + ")\n"
+
+
+def _escape(value):
+    """Escape a text property value
+
+    Args:
+        value (str): text to escape
+
+    Returns:
+        str: text with backslashes and closing brackets escaped
+    """
+    return value.replace("\\", "\\\\").replace("]", "\\]")
+
+
+def _unescape(value):
+    """Remove the escaping of a text property value
+
+    Args:
+        value (str): escaped text
+
+    Returns:
+        str: text with escaping backslashes removed
+    """
+    return re.sub(r"\\(.)", r"\1", value, flags=re.DOTALL)
+
+
+def save_game(record, path):
+    """Append a game to an SGF file
+
+    Args:
+        record (GameRecord): game to save
+        path (str): path of the SGF file
+    """
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(write_game(record))
+
+
+def iter_game_texts(path, chunk_size=1 << 20):
+    """Stream the text of every game of an SGF collection, only the
+    game being scanned is kept in memory
+
+    Args:
+        path (str): path of the SGF file
+        chunk_size (int): number of characters read at a time
+
+    Yields:
+        str: SGF text of one game
+    """
+    scanner = Scanner()
+    depth = 0
+    parts = []
+    with open(path, encoding="utf-8", errors="replace") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            start = 0 if depth else None
+            for index, char in scanner.feed(chunk):
+                if char == "(":
+                    if depth == 0:
+                        start = index
+                    depth += 1
+                elif depth:
+                    depth -= 1
+                    if depth == 0:
+                        parts.append(chunk[start : index + 1])
+                        yield "".join(parts)
+                        parts = []
+                        start = None
+            if depth and start is not None:
+                parts.append(chunk[start:])
+
+
+def iter_games(path, chunk_size=1 << 20):
+    """Stream every game of an SGF collection
+
+    Args:
+        path (str): path of the SGF file
+        chunk_size (int): number of characters read at a time
+
+    Yields:
+        GameRecord: record of one game
+    """
+    for text in iter_game_texts(path, chunk_size):
+        yield parse_game(text)
+
+
+def replay_games(path):
+    """Replay every game of an SGF collection through the rules
+    engine and report the validation throughput
+
+    Args:
+        path (str): path of the SGF file
+
+    Returns:
+        dict: number of games, moves, invalid games and elapsed seconds
+    """
+    games = 0
+    moves = 0
+    invalid = []
+    start = time.perf_counter()
+    for games, text in enumerate(iter_game_texts(path), start=1):
+        # a malformed record is reported like an illegal game
+        try:
+            record = parse_game(text)
+            moves += len(record.moves)
+            record.replay()
+        except (ValueError, IndexError) as error:
+            invalid.append((games, str(error)))
+    elapsed = time.perf_counter() - start
+    return {"games": games, "moves": moves, "invalid": invalid, "seconds": elapsed}
+
+
+def main():
+    """Replays the SGF collections given on the command line
+    """
+    for path in sys.argv[1:]:
+        stats = replay_games(path)
+        seconds = max(stats["seconds"], 1e-9)
+        print(
+            f"{path}: {stats['games']} games, {stats['moves']} moves in "
+            f"{seconds:.2f}s ({stats['games'] / seconds:.0f} games/s, "
+            f"{stats['moves'] / seconds:.0f} moves/s), "
+            f"{len(stats['invalid'])} invalid"
+        )
+        for game, error in stats["invalid"][:10]:
+            print(f"  game {game}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Runs the differential test of the rules engines with fixed seeds, so
+a disagreement with the reference fails the test suite
+"""
+import numpy as np
+
+import differential
+from batch_board import BatchBoard
+from differential import Undo, run_random, run_sequence
+from go_board import PASS, GoBoard
+
+
+# black takes the white stone at 6 by playing 7, white taking back at
+# 6 at once is Ko
+KO_SEQUENCE = [1, 2, 5, 8, 11, 12, 24, 6, 7, 6]
+# white passes after the capture and takes the pass back, so 6 is Ko
+# again, then black's capture is taken back and played again
+UNDO_SEQUENCE = KO_SEQUENCE[:-1] + [PASS, Undo(1), 6, Undo(2), 7, 6, Undo(9), 6]
+
+
+class NoKoBatchBoard(BatchBoard):
+    """BatchBoard that forgets the board before the last move, so it
+    misses Ko
+    """
+
+    def step(self, moves):
+        self.previous[:] = 2
+        return super().step(moves)
+
+
+def test_small_boards_agree():
+    tried, failure = run_random(100, 5, seed=0)
+    assert tried > 0
+    assert failure is None
+
+
+def test_medium_board_agrees():
+    tried, failure = run_random(10, 9, seed=0)
+    assert tried > 0
+    assert failure is None
+
+
+def test_ko_agrees():
+    assert run_sequence(5, KO_SEQUENCE) is None
+
+
+def test_undo_agrees():
+    assert run_sequence(5, UNDO_SEQUENCE) is None
+
+
+def test_undo_bug_is_found(monkeypatch):
+    undo = GoBoard.undo
+
+    def forget_ko(self):
+        undo(self)
+        self.ko_point = None
+
+    monkeypatch.setattr(GoBoard, "undo", forget_ko)
+    mismatch = run_sequence(5, UNDO_SEQUENCE)
+    assert mismatch is not None
+    assert mismatch.check == "hash after undo"
+    assert mismatch.step == UNDO_SEQUENCE.index(Undo(1)) + 1
+
+
+def test_batch_board_bug_is_found(monkeypatch):
+    monkeypatch.setattr(differential, "BatchBoard", NoKoBatchBoard)
+    mismatch = run_sequence(5, KO_SEQUENCE)
+    assert mismatch is not None
+    assert mismatch.check == "batch legality of 6"
+    assert mismatch.step == len(KO_SEQUENCE)
+
+
+def test_score_bug_is_found(monkeypatch):
+    score_game = differential.score_game
+
+    def off_by_one(*args, **kwargs):
+        result = score_game(*args, **kwargs)
+        result["black"] += 1
+        return result
+
+    monkeypatch.setattr(differential, "score_game", off_by_one)
+    _, failure = run_random(1, 5, seed=0, legality=False)
+    assert failure is not None
+    moves, mismatch = failure
+    assert mismatch.check == "territory score"
+    assert np.isclose(mismatch.actual[0], mismatch.expected[0] + 1)
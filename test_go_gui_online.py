@@ -0,0 +1,84 @@
+"""Drives GoGuiOnline with replies of the server, without a server or
+a window
+"""
+import os
+
+# pygame reads the drivers when it is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+from game_history import GameHistory
+from go_gui_online import GoGuiOnline
+from server import game_view
+
+pygame.init()
+
+
+class FakeChannel:
+    """Channel handing the replies given to it to the game
+
+    Args:
+        replies (list): (request, reply) answered in order
+    """
+
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.sent = []
+        self.notify = None
+        self.poll_request = ("GET",)
+
+    def send(self, request):
+        self.sent.append(request)
+
+    def poll(self):
+        replies, self.replies = self.replies, []
+        return [(request, 0, reply, 0.0) for request, reply in replies]
+
+
+def test_get_before_start_keeps_polling():
+    # player 1 polls before player 0 sent the game
+    channel = FakeChannel([(("GET",), False)])
+    game = GoGuiOnline(channel, 9, 1)
+    game.started = True
+    game.handle_network()
+    assert game.started
+    assert not game.my_turn
+    assert channel.poll_request == ("GET",)
+
+    history = GameHistory(9)
+    history.play(40)
+    channel.replies.append((("GET",), (game_view(history), None, 1)))
+    game.handle_network()
+    assert game.my_turn
+    assert game.board[4, 4] == 1
+
+
+def test_waiting_player_starts_on_first_game():
+    channel = FakeChannel([(("GET",), False)])
+    game = GoGuiOnline(channel, 9, 0)
+    game.handle_network()
+    assert not game.started
+    channel.replies.append((("GET",), (game_view(GameHistory(9)), None, 0)))
+    game.handle_network()
+    assert game.started
+
+
+def test_shed_reply_keeps_asking_for_the_game():
+    channel = FakeChannel()
+    game = GoGuiOnline(channel, 9, 1)
+    game.started = True
+    # the busy server answers without the game the opponent just moved in
+    channel.replies.append((("GET",), (None, None, 1)))
+    game.handle_network()
+    assert channel.poll_request == ("GET",)
+    assert not game.my_turn
+
+    history = GameHistory(9)
+    history.play(40)
+    channel.replies.append((channel.poll_request, (game_view(history), None, 1)))
+    game.handle_network()
+    assert channel.poll_request == ("GET", 1)
+    assert game.my_turn
+    assert game.board[4, 4] == 1
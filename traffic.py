@@ -0,0 +1,363 @@
+"""This module captures the traffic received by the server and replays
+it against another server. A capture keeps every message received,
+still pickled, with the time it arrived and the connection it came on,
+in a gzip compressed log. Replaying sends the messages of every
+connection again in the order they were received, at the speed they
+were received, a multiple of it or as fast as possible, and measures
+how long the server takes to answer.
+
+Every connection of a replay comes from the replaying machine, so the
+server holds all of them to the limits of a single address: at most
+MAX_ADDRESS_CONNECTIONS connections and ADDRESS_RATE requests per
+second. A server started with "--replay" lifts those limits, replaying
+warns when a capture would go over them.
+
+A capture that already exists is continued: the records of the new
+session come after the old ones in time and on new connection ids,
+and the connections the old session left open are closed.
+
+Log layout, one record after the other:
+    header: seconds since the capture started, connection id, kind of
+        record, length of the payload
+    payload: address of the client for a connection, pickled message
+        for a message, empty when the connection closed
+"""
+import gzip
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+from protocol import recv_frame, send_frame
+
+RECORD = struct.Struct("<dIBI")
+# kinds of record
+CONNECT = 0
+MESSAGE = 1
+DISCONNECT = 2
+# seconds given to the server to answer the last messages of a replay
+DRAIN_TIMEOUT = 10.0
+# seconds between flushes of a capture, at most this much is lost if
+# the server is killed
+FLUSH_INTERVAL = 1.0
+
+
+class TrafficCapture:
+    """Class representing a capture being written, safe to share
+    between threads and used as a context manager
+
+    Args:
+        path (str): path of the log, continued if it exists
+    """
+
+    def __init__(self, path):
+        self.records = 0
+        # added to the connection ids of this session
+        self.first_connection = 0
+        last_stamp = 0.0
+        if os.path.exists(path):
+            # the old records are copied to a new log, a log cut short
+            # by a crash can not be appended to
+            temp = path + ".tmp"
+            self.file = gzip.open(temp, "wb")
+            open_connections = set()
+            for stamp, connection, kind, payload in read_capture(path):
+                self.file.write(RECORD.pack(stamp, connection, kind, len(payload)) + payload)
+                self.records += 1
+                last_stamp = stamp
+                self.first_connection = max(self.first_connection, connection)
+                if kind == CONNECT:
+                    open_connections.add(connection)
+                elif kind == DISCONNECT:
+                    open_connections.discard(connection)
+            for connection in sorted(open_connections):
+                # the server that had them open is gone
+                self.file.write(RECORD.pack(last_stamp, connection, DISCONNECT, 0))
+                self.records += 1
+            self.file.flush()
+            os.replace(temp, path)
+        else:
+            self.file = gzip.open(path, "wb")
+        # the new session carries on from the last record
+        self.start = time.monotonic() - last_stamp
+        self.flushed = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, connection, kind, payload):
+        """Append a record to the log
+
+        Args:
+            connection (int): id of the connection
+            kind (int): CONNECT, MESSAGE or DISCONNECT
+            payload (bytes): payload of the record
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.file.write(
+                RECORD.pack(now - self.start, self.first_connection + connection, kind, len(payload))
+                + payload
+            )
+            self.records += 1
+            if now - self.flushed >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.flushed = now
+
+    def connect(self, connection, address):
+        """Record a new connection
+
+        Args:
+            connection (int): id of the connection
+            address (str): address of the client
+        """
+        self._write(connection, CONNECT, address.encode())
+
+    def message(self, connection, data):
+        """Record a message received
+
+        Args:
+            connection (int): id of the connection
+            data (bytes): pickled message
+        """
+        self._write(connection, MESSAGE, data)
+
+    def disconnect(self, connection):
+        """Record the end of a connection
+
+        Args:
+            connection (int): id of the connection
+        """
+        self._write(connection, DISCONNECT, b"")
+
+    def close(self):
+        """Finish the log, a log that is not closed loses its last records
+        """
+        with self.lock:
+            self.file.close()
+
+
+def read_capture(path):
+    """Read the records of a capture, a log cut short by a crash is read
+    up to its last whole record
+
+    Args:
+        path (str): path of the log
+
+    Yields:
+        tuple: seconds since the capture started, connection id, kind of
+            record and payload
+    """
+    with gzip.open(path, "rb") as file:
+        try:
+            while True:
+                header = file.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                stamp, connection, kind, length = RECORD.unpack(header)
+                payload = file.read(length)
+                if len(payload) < length:
+                    return
+                yield stamp, connection, kind, payload
+        except EOFError:
+            return
+
+
+class ReplayConnection:
+    """Class representing a connection of a replay, the replies are
+    read on a background thread and timed against their message
+
+    Args:
+        host (str): address of the server
+        port (int): port of the server
+        latencies (list): seconds taken by every reply, shared by
+            every connection of the replay
+    """
+
+    def __init__(self, host, port, latencies):
+        self.sock = socket.create_connection((host, port))
+        self.latencies = latencies
+        # time every message waiting for its reply was sent
+        self.sent = deque()
+        self.failed = False
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    def send(self, data):
+        """Send a pickled message
+
+        Args:
+            data (bytes): pickled message
+        """
+        if self.failed:
+            return
+        try:
+            self.sent.append(time.monotonic())
+            send_frame(self.sock, data)
+        except OSError:
+            # refused or dropped by the server
+            self.failed = True
+
+    def _read_loop(self):
+        """Read the replies until the server closes the connection
+        """
+        try:
+            while True:
+                recv_frame(self.sock)
+                self.latencies.append(time.monotonic() - self.sent.popleft())
+        except (OSError, IndexError):
+            self.failed = self.failed or bool(self.sent)
+
+    def finish(self):
+        """Stop sending, the server answers what it already has then
+        closes the connection
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            self.failed = True
+
+    def join(self, timeout):
+        """Wait for the last replies then close the connection
+
+        Args:
+            timeout (float): seconds to wait
+        """
+        self.reader.join(timeout)
+        self.sock.close()
+
+
+def capture_load(path, speed=1.0):
+    """Find the busiest moments of a capture once replayed
+
+    Args:
+        path (str): path of the log
+        speed (float): speed relative to the capture, None for as fast
+            as possible
+
+    Returns:
+        tuple: most connections open at once and most messages sent in
+            one second of the replay, every message for None
+    """
+    open_connections = 0
+    peak_connections = 0
+    stamps = deque()
+    peak_messages = 0
+    for stamp, _, kind, _ in read_capture(path):
+        if kind == CONNECT:
+            open_connections += 1
+            peak_connections = max(peak_connections, open_connections)
+        elif kind == DISCONNECT:
+            open_connections -= 1
+        else:
+            stamps.append(stamp)
+            if speed is not None:
+                # a second of the replay is speed seconds of the capture
+                while stamps[0] <= stamp - speed:
+                    stamps.popleft()
+            peak_messages = max(peak_messages, len(stamps))
+    return peak_connections, peak_messages
+
+
+def replay(path, host, port, speed=1.0):
+    """Send the traffic of a capture to a server
+
+    Args:
+        path (str): path of the log
+        host (str): address of the server
+        port (int): port of the server
+        speed (float): speed relative to the capture, None for as fast
+            as possible
+
+    Returns:
+        dict: connections, messages sent, replies received, connections
+            refused or dropped, seconds taken and sorted latencies
+    """
+    latencies = []
+    connections = {}
+    finished = []
+    refused = 0
+    messages = 0
+    start = time.monotonic()
+    for stamp, connection, kind, payload in read_capture(path):
+        if speed is not None:
+            delay = start + stamp / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if kind == CONNECT:
+            try:
+                connections[connection] = ReplayConnection(host, port, latencies)
+            except OSError:
+                connections[connection] = None
+                refused += 1
+        elif kind == MESSAGE:
+            replayed = connections.get(connection)
+            if replayed is not None:
+                replayed.send(payload)
+                messages += 1
+        elif kind == DISCONNECT:
+            replayed = connections.pop(connection, None)
+            if replayed is not None:
+                replayed.finish()
+                finished.append(replayed)
+    for replayed in connections.values():
+        if replayed is not None:
+            replayed.finish()
+            finished.append(replayed)
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    for replayed in finished:
+        replayed.join(max(0.0, deadline - time.monotonic()))
+    return {
+        "connections": len(finished) + refused,
+        "messages": messages,
+        "replies": len(latencies),
+        "failed": sum(replayed.failed for replayed in finished) + refused,
+        "seconds": time.monotonic() - start,
+        "latencies": sorted(latencies),
+    }
+
+
+def main():
+    """Replays a capture against a server with
+    "replay <capture> <host> <port> [speed]", the speed is a multiple
+    of the captured speed or "max"
+    """
+    if len(sys.argv) in (5, 6) and sys.argv[1] == "replay":
+        # imported here as the server imports this module
+        from server import ADDRESS_BURST, ADDRESS_RATE, MAX_ADDRESS_CONNECTIONS
+
+        speed = sys.argv[5] if len(sys.argv) == 6 else "1"
+        speed = None if speed == "max" else float(speed)
+        connections, messages = capture_load(sys.argv[2], speed)
+        if connections > MAX_ADDRESS_CONNECTIONS or messages > ADDRESS_RATE + ADDRESS_BURST:
+            print(
+                f"warning: the replay opens up to {connections} connections and sends "
+                f"up to {messages} messages in a second from one address, over the "
+                f"server's limits of {MAX_ADDRESS_CONNECTIONS} connections and "
+                f"{ADDRESS_RATE} requests per second, start the server with --replay"
+            )
+        stats = replay(sys.argv[2], sys.argv[3], int(sys.argv[4]), speed)
+        print(
+            f"{stats['messages']} messages on {stats['connections']} connections "
+            f"in {stats['seconds']:.2f}s, {stats['replies']} replies, "
+            f"{stats['failed']} connections failed"
+        )
+        latencies = stats["latencies"]
+        if latencies:
+            for percentile in (50, 90, 99):
+                latency = latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)]
+                print(f"p{percentile} latency {latency * 1000:.2f}ms")
+            print(f"max latency {latencies[-1] * 1000:.2f}ms")
+    else:
+        print("usage: traffic.py replay <capture> <host> <port> [speed|max]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""This module contains the TranspositionTable class.
+TranspositionTable objects remember search statistics and scoring
+results of positions keyed by their hash, so positions reached
+through different move orders are only evaluated once.
+"""
+import sys
+from collections import OrderedDict
+
+# bytes taken by an entry without its score, measured on CPython
+ENTRY_BYTES = 240
+
+
+class Entry:
+    """Class representing what is known about a position
+
+    Attributes:
+        visits (int): playouts run through the position
+        wins (float): playouts won by the player who moved into the position
+        score (object): cached scoring result, None if not scored
+    """
+
+    __slots__ = ("visits", "wins", "score", "nbytes")
+
+    def __init__(self):
+        self.visits = 0
+        self.wins = 0.0
+        self.score = None
+        self.nbytes = ENTRY_BYTES
+
+
+def score_bytes(score):
+    """Estimate the memory taken by a scoring result
+
+    Args:
+        score (tuple): scoring result, may contain numpy arrays
+
+    Returns:
+        int: estimated size in bytes
+    """
+    size = sys.getsizeof(score)
+    for item in score:
+        size += getattr(item, "nbytes", sys.getsizeof(item))
+    return size
+
+
+class TranspositionTable:
+    """Class representing a table of positions bounded in memory,
+    the least recently used positions are evicted first
+
+    Args:
+        max_bytes (int): memory the table may use
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """Look a position up
+
+        Args:
+            key (int): hash of the position
+
+        Returns:
+            Entry: entry of the position, None if not in the table
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def entry(self, key):
+        """Get the entry of a position, adding it if it is not in the table
+
+        Args:
+            key (int): hash of the position
+
+        Returns:
+            Entry: entry of the position
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = Entry()
+            self.entries[key] = entry
+            self.used_bytes += entry.nbytes
+            self._evict()
+        else:
+            self.entries.move_to_end(key)
+        return entry
+
+    def update(self, key, won):
+        """Record the result of a playout through a position
+
+        Args:
+            key (int): hash of the position
+            won (bool): True if the player who moved into the position won
+        """
+        entry = self.entry(key)
+        entry.visits += 1
+        if won:
+            entry.wins += 1
+
+    def store_score(self, key, score):
+        """Remember the scoring result of a position
+
+        Args:
+            key (int): hash of the position
+            score (tuple): scoring result
+        """
+        entry = self.entry(key)
+        self.used_bytes -= entry.nbytes
+        entry.score = score
+        entry.nbytes = ENTRY_BYTES + score_bytes(score)
+        self.used_bytes += entry.nbytes
+        self._evict()
+
+    def _evict(self):
+        """Evict the least recently used entries until the table fits
+        in its memory budget, the newest entry is always kept
+        """
+        while self.used_bytes > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.used_bytes -= entry.nbytes
+
+    def clear(self):
+        """Remove every entry
+        """
+        self.entries.clear()
+        self.used_bytes = 0